@@ -4,7 +4,8 @@ __version__ = version("procgen_gym")
 
 from .env import ProcgenEnv, ProcgenVecEnv
 from .gym_registration import register_environments
+from .sharded import ProcgenShardedVecEnv
 
 register_environments()
 
-__all__ = ["ProcgenEnv", "ProcgenVecEnv"]
+__all__ = ["ProcgenEnv", "ProcgenVecEnv", "ProcgenShardedVecEnv"]
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""
+Throughput and latency benchmark for procgen environments.
+
+Sweeps games, distribution modes, batch sizes, thread counts and render modes,
+and reports steps/sec, p50/p99 step latency, reset latency and peak RSS for
+each configuration. Results can be written to JSON and compared against a
+previous run to catch regressions in CI.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing as mp
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from .env import ENV_NAMES, EXPLORATION_LEVEL_SEEDS, KEY_COMBOS, ProcgenVecEnv
+
+# should match the checks in Game::parse_options in game.cpp
+EXTREME_MODE_ENV_NAMES = ["chaser", "dodgeball", "leaper", "starpilot"]
+MEMORY_MODE_ENV_NAMES = ["caveflyer", "dodgeball", "heist", "jumper", "maze", "miner"]
+
+RENDER_MODES = {"none": None, "rgb_array": "rgb_array"}
+
+# metrics where a larger value is a regression, all others regress when they get smaller
+_LOWER_IS_BETTER = {"step_latency_p50_ms", "step_latency_p99_ms", "reset_latency_ms", "peak_rss_mb"}
+
+_CONFIG_KEYS = ("env_name", "distribution_mode", "num_envs", "num_threads", "render_mode")
+
+
+def supported_distribution_modes(env_name):
+    """Return the distribution modes that ``env_name`` can be created with."""
+    modes = ["easy", "hard"]
+    if env_name in EXTREME_MODE_ENV_NAMES:
+        modes.append("extreme")
+    if env_name in MEMORY_MODE_ENV_NAMES:
+        modes.append("memory")
+    if env_name in EXPLORATION_LEVEL_SEEDS:
+        modes.append("exploration")
+    return modes
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, None where unavailable."""
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def run_config(
+    env_name,
+    distribution_mode="hard",
+    num_envs=1,
+    num_threads=0,
+    render_mode="none",
+    num_steps=500,
+    warmup_steps=50,
+    seed=0,
+    num_resets=10,
+):
+    """
+    Benchmark a single configuration in the current process.
+
+    Reset latency is the mean time of a step in which every sub-environment
+    is forced to reset (action ``-1``), i.e. generating a new level and
+    producing its first observation, averaged over ``num_resets`` steps. With
+    ``render_mode="rgb_array"`` every environment is rendered after each
+    step and the render time is included in the step latency.
+
+    Returns:
+        dict with the configuration and the measured metrics
+    """
+    assert num_resets > 0, "num_resets must be positive"
+    rng = np.random.RandomState(seed)
+    actions = rng.randint(
+        low=0, high=len(KEY_COMBOS), size=(warmup_steps + num_steps, num_envs), dtype=np.int32
+    )
+    render = RENDER_MODES[render_mode] is not None
+
+    env = ProcgenVecEnv(
+        num_envs=num_envs,
+        env_name=env_name,
+        distribution_mode=distribution_mode,
+        num_threads=num_threads,
+        render_mode=RENDER_MODES[render_mode],
+        rand_seed=seed,
+    )
+    env.reset()
+
+    try:
+        reset_actions = np.full(num_envs, -1, dtype=np.int32)
+        start = time.perf_counter()
+        for _ in range(num_resets):
+            env.step(reset_actions)
+        reset_latency = (time.perf_counter() - start) / num_resets
+
+        for i in range(warmup_steps):
+            env.step(actions[i])
+            if render:
+                env.render()
+
+        latencies = np.empty(num_steps)
+        for i in range(num_steps):
+            start = time.perf_counter()
+            env.step(actions[warmup_steps + i])
+            if render:
+                env.render()
+            latencies[i] = time.perf_counter() - start
+    finally:
+        env.close()
+
+    return {
+        "env_name": env_name,
+        "distribution_mode": distribution_mode,
+        "num_envs": num_envs,
+        "num_threads": num_threads,
+        "render_mode": render_mode,
+        "num_steps": num_steps,
+        "steps_per_sec": num_envs * num_steps / latencies.sum(),
+        "step_latency_p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "step_latency_p99_ms": float(np.percentile(latencies, 99)) * 1000,
+        "reset_latency_ms": reset_latency * 1000,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def make_configs(env_names, distribution_modes, num_envs, num_threads, render_modes):
+    """Expand the sweep into a list of run_config keyword arguments."""
+    configs = []
+    for env_name in env_names:
+        modes = [m for m in supported_distribution_modes(env_name) if m in distribution_modes]
+        for mode, n, threads, render_mode in itertools.product(modes, num_envs, num_threads, render_modes):
+            configs.append({
+                "env_name": env_name,
+                "distribution_mode": mode,
+                "num_envs": n,
+                "num_threads": threads,
+                "render_mode": render_mode,
+            })
+    return configs
+
+
+def run_benchmarks(configs, num_steps=500, warmup_steps=50, seed=0, isolate=True, log=None):
+    """
+    Run every configuration and return the list of results.
+
+    With ``isolate=True`` each configuration runs in a fresh process so that
+    peak RSS and the library's process-wide state are measured per
+    configuration.
+    """
+    results = []
+    executor = None
+    if isolate:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=mp.get_context("spawn"), max_tasks_per_child=1
+        )
+    try:
+        for config in configs:
+            kwargs = dict(config, num_steps=num_steps, warmup_steps=warmup_steps, seed=seed)
+            if executor is not None:
+                result = executor.submit(run_config, **kwargs).result()
+            else:
+                result = run_config(**kwargs)
+            results.append(result)
+            if log is not None:
+                log(format_result(result))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results
+
+
+def format_result(result):
+    """One-line human readable summary of a result."""
+    rss = result["peak_rss_mb"]
+    return (
+        f"{result['env_name']:>10} {result['distribution_mode']:>11} "
+        f"envs={result['num_envs']:<4} threads={result['num_threads']:<3} "
+        f"render={result['render_mode']:<9} "
+        f"{result['steps_per_sec']:>10.0f} steps/s  "
+        f"p50={result['step_latency_p50_ms']:.3f}ms p99={result['step_latency_p99_ms']:.3f}ms  "
+        f"reset={result['reset_latency_ms']:.1f}ms  "
+        f"rss={'n/a' if rss is None else f'{rss:.0f}MB'}"
+    )
+
+
+def compare_results(baseline, current, max_regression=0.1, metrics=("steps_per_sec",)):
+    """
+    Compare two lists of results and return the regressions.
+
+    Results are matched on their configuration. A metric regresses when it is
+    worse than the baseline by more than ``max_regression`` (a fraction).
+
+    Returns:
+        list of dicts with the configuration, metric, baseline and current value
+    """
+    baseline_by_config = {tuple(r[k] for k in _CONFIG_KEYS): r for r in baseline}
+    regressions = []
+    for result in current:
+        key = tuple(result[k] for k in _CONFIG_KEYS)
+        base = baseline_by_config.get(key)
+        if base is None:
+            continue
+        for metric in metrics:
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            if metric in _LOWER_IS_BETTER:
+                change = (new - old) / old
+            else:
+                change = (old - new) / old
+            if change > max_regression:
+                regressions.append(dict(zip(_CONFIG_KEYS, key), metric=metric, baseline=old, current=new))
+    return regressions
+
+
+def main(argv=None):
+    default_str = "(default: %(default)s)"
+    parser = argparse.ArgumentParser(
+        description="Benchmark throughput and latency of the procgen environments"
+    )
+    parser.add_argument(
+        "--env-names",
+        nargs="+",
+        default=ENV_NAMES,
+        choices=ENV_NAMES,
+        metavar="ENV_NAME",
+        help="games to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--distribution-modes",
+        nargs="+",
+        default=["easy", "hard", "extreme", "memory", "exploration"],
+        help="distribution modes to benchmark, unsupported ones are skipped per game " + default_str,
+    )
+    parser.add_argument(
+        "--num-envs", nargs="+", type=int, default=[1, 64], help="batch sizes " + default_str
+    )
+    parser.add_argument(
+        "--num-threads", nargs="+", type=int, default=[0, 4], help="stepping thread counts " + default_str
+    )
+    parser.add_argument(
+        "--render-modes",
+        nargs="+",
+        default=["none"],
+        choices=list(RENDER_MODES),
+        help="render modes, rgb_array renders every env after each step " + default_str,
+    )
+    parser.add_argument(
+        "--num-steps", type=int, default=500, help="timed steps per configuration " + default_str
+    )
+    parser.add_argument(
+        "--warmup-steps", type=int, default=50, help="untimed steps before measuring " + default_str
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed " + default_str)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from a previous run to compare against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.1,
+        help="fail when steps/sec drops by more than this fraction of the baseline " + default_str,
+    )
+    parser.add_argument(
+        "--no-isolate",
+        action="store_true",
+        default=False,
+        help="run every configuration in this process instead of a fresh one",
+    )
+
+    args = parser.parse_args(argv)
+
+    configs = make_configs(
+        args.env_names, args.distribution_modes, args.num_envs, args.num_threads, args.render_modes
+    )
+    results = run_benchmarks(
+        configs,
+        num_steps=args.num_steps,
+        warmup_steps=args.warmup_steps,
+        seed=args.seed,
+        isolate=not args.no_isolate,
+        log=print,
+    )
+
+    report = {
+        "metadata": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "num_steps": args.num_steps,
+            "warmup_steps": args.warmup_steps,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_results(baseline, results, max_regression=args.max_regression)
+        for r in regressions:
+            print(
+                f"REGRESSION {r['env_name']} {r['distribution_mode']} envs={r['num_envs']} "
+                f"threads={r['num_threads']} render={r['render_mode']}: "
+                f"{r['metric']} {r['baseline']:.1f} -> {r['current']:.1f}"
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
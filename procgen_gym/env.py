@@ -1,5 +1,4 @@
 import os
-import ctypes
 import platform
 import random
 from typing import Sequence, Optional, List
@@ -7,13 +6,15 @@ from typing import Sequence, Optional, List
 import gymnasium as gym
 import numpy as np
 from gymnasium import spaces
+from gymnasium.error import AlreadyPendingCallError, NoAsyncCallError
 
 from .builder import build
 from .libenv import CLibenv
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-MAX_STATE_SIZE = 2 ** 20
+# should match RENDER_RES in game.h
+RENDER_RES = 512
 
 ENV_NAMES = [
     "bigfish",
@@ -55,6 +56,33 @@ DISTRIBUTION_MODE_DICT = {
 }
 
 
+# should match ObsFormat in game.h, "_chw" formats are channels-first
+OBS_FORMAT_DICT = {
+    "rgb": 0,
+    "gray": 1,
+    "rgb_chw": 2,
+    "gray_chw": 3,
+}
+
+# should match RenderBackend in painter.h
+RENDER_BACKEND_DICT = {
+    "qt": 0,
+    "fast": 1,
+}
+
+# should match PerfPhase in perf-stats.h
+PERF_PHASES = ["game_step", "render", "convert", "reset"]
+
+# should match get_level_cache_stats in vecgame.cpp
+LEVEL_CACHE_STATS = ["hits", "misses", "evictions", "entries", "bytes"]
+
+# should match the constants at the top of game.cpp, compact states start with the magic
+# followed by their version as a zigzag varint, default states start with their version
+SERIALIZE_VERSION = 0
+COMPACT_SERIALIZE_MAGIC = 0x31434750
+COMPACT_SERIALIZE_VERSION = 2
+
+
 def create_random_seed():
     rand_seed = random.SystemRandom().randint(0, 2 ** 31 - 1)
     try:
@@ -67,6 +95,64 @@ def create_random_seed():
     return rand_seed
 
 
+def default_num_threads(num_envs):
+    """
+    Number of C++ stepping threads to use for ``num_envs`` environments.
+
+    Uses one thread per available core, capped at ``num_envs``. A single
+    environment is stepped on the calling thread since there is nothing to
+    parallelise.
+    """
+    if num_envs <= 1:
+        return 0
+    try:
+        num_cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is not available on Windows and macOS
+        num_cores = os.cpu_count() or 1
+    return min(num_envs, num_cores)
+
+
+def _read_compact_versions(data, starts, stops):
+    """
+    Decode the zigzag varint that follows the magic of compact states starting at ``starts``.
+
+    Returns the versions and whether each varint ended within its state.
+    """
+    # a 32 bit varint takes at most 5 bytes
+    idx = starts[:, None] + 4 + np.arange(5)
+    in_state = idx < stops[:, None]
+    b = data[np.minimum(idx, len(data) - 1)].astype(np.int64)
+    is_last = in_state & (b & 0x80 == 0)
+    complete = is_last.any(axis=1)
+    used = np.arange(5) <= np.argmax(is_last, axis=1)[:, None]
+    v = np.sum(np.where(used, (b & 0x7F) << (7 * np.arange(5)), 0), axis=1)
+    return (v >> 1) ^ -(v & 1), complete
+
+
+def _check_state_versions(data, offsets):
+    """Raise ValueError if a state was saved in a format version this library can't read."""
+    starts = offsets[:-1]
+    if len(starts) == 0:
+        return
+    if np.any(offsets[1:] - starts < 5):
+        raise ValueError("state data is too short to be a procgen state")
+    versions = data[starts[:, None] + np.arange(4)].copy().view("<i4")[:, 0]
+    compact = versions == COMPACT_SERIALIZE_MAGIC
+    compact_versions, complete = _read_compact_versions(data, starts, offsets[1:])
+    bad = np.where(compact, ~complete | (compact_versions != COMPACT_SERIALIZE_VERSION), versions != SERIALIZE_VERSION)
+    if np.any(bad):
+        i = int(np.argmax(bad))
+        if compact[i] and not complete[i]:
+            raise ValueError(f"state {i} is too short to hold its compact format version")
+        if compact[i]:
+            raise ValueError(
+                f"state {i} uses compact format version {compact_versions[i]}, "
+                f"expected version {COMPACT_SERIALIZE_VERSION}"
+            )
+        raise ValueError(f"state {i} uses format version {versions[i]}, expected version {SERIALIZE_VERSION}")
+
+
 KEY_COMBOS = [
     ("LEFT", "DOWN"),
     ("LEFT",),
@@ -127,6 +213,81 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
 
     This is a batched (vectorized) environment — it manages ``num_envs``
     sub-environments internally on the C++ side.
+
+    With ``copy=False`` the arrays returned by :meth:`reset` and :meth:`step`
+    are read-only views into double-buffered memory written by the C++ side
+    instead of fresh copies. They remain valid until the next call to
+    :meth:`step` after the one that produced them, copy them if they need to
+    be kept for longer.
+
+    Stepping can be split into :meth:`step_async` / :meth:`step_wait` so the
+    caller can do other work (e.g. a policy forward pass) while the C++
+    threads simulate. :meth:`step_half_async` / :meth:`step_half_wait` do the
+    same for one half of the batch at a time, which allows inference on one
+    half to overlap with simulation of the other.
+
+    With ``level_cache_mb > 0`` the state of each freshly generated level is
+    kept in an LRU cache of that size (shared by the sub-environments) and
+    later resets to the same level restore it instead of generating the level
+    again. This pays off when levels repeat, i.e. with a finite
+    ``num_levels``. It has no effect with ``use_generated_assets=True``.
+
+    With ``cache_static_tiles=True`` the grid tiles of each level are drawn
+    once into a layer that is copied into every observation, and only the
+    tiles that change are drawn again. Observations are identical to the
+    uncached ones. Tile edges that blend with what is below them are still
+    drawn directly, levels with many of them and frames where the view has
+    scrolled by a fraction of a pixel are drawn without the layer. The option
+    helps most in games with a fixed view and solid tiles, like maze, heist
+    and miner.
+
+    With ``cache_scaled_sprites=True`` sprites and backgrounds that are drawn
+    at the same rect in many frames are scaled once, in a cache shared by all
+    games in the process, and observations copy the scaled images instead of
+    scaling them on every draw. Observations are the same as without the
+    cache. With Qt, games with a fixed view like maze, heist and miner render
+    about 1.1 to 1.6 times faster, games that scroll by fractions of a pixel
+    like coinrun, jumper and caveflyer 5 to 20% slower.
+
+    With ``render_backend="fast"`` rect fills and unrotated sprites in
+    observations are drawn by a small software rasterizer that repeats the
+    arithmetic of Qt's raster engine, so observations are identical to the Qt
+    backend. Everything else (rotated sprites, ellipses, lines, scaled
+    backgrounds, translucent scaled sprites) is still drawn with QPainter,
+    so this backend needs Qt as well. Observations render about 1.2 times
+    faster on average, from 0.85 to 1.55 times depending on the game.
+    ``render()`` draws its high resolution frames with Qt either way.
+
+    With ``collision_broadphase=True`` entities are kept in a spatial hash and
+    entity collision checks only test entities close to each other instead of
+    every pair. The same collisions are found in the same order, so episodes
+    are identical to the default brute force checks. Levels with fewer than
+    ``broadphase_min_entities`` entities keep testing every pair, which is
+    faster at that size.
+
+    The info dict holds per-env arrays. On steps where an episode ended,
+    ``episode_return``, ``episode_length`` and ``prev_level_seed`` describe
+    that episode, the statistics are zero on other steps. An episode during
+    which a default format state was restored (see :meth:`get_state`) reports
+    an ``episode_return`` of NaN and an ``episode_length`` of -1.
+
+    With ``perf_stats=True`` the C++ side keeps cumulative timings of each
+    phase of stepping, see :meth:`get_perf_stats`.
+
+    With ``frame_stack=k`` the C++ side keeps the last ``k`` frames of each
+    environment and stacks them along the channel axis, oldest first, e.g.
+    ``(64, 64, 3 * k)`` for ``"rgb"`` or ``(k, 64, 64)`` for ``"gray_chw"``.
+    The stack is cleared (zero-filled) whenever an episode starts and when a
+    state is restored.
+
+    With ``action_repeat=k`` every step applies the action for ``k`` game
+    steps and returns the sum of their rewards, stopping early when the
+    episode ends. Only the frames needed for the observation are rendered.
+    With ``max_pool_last=n`` as well, the observation is the per-channel
+    maximum of the last ``n`` frames (taken before conversion to
+    ``obs_format``), like ``MaxAndSkipObservation`` with ``skip=k``. If the
+    episode ends during the repeat, the observation is the first frame of the
+    next episode, without pooling.
     """
 
     metadata = {
@@ -153,14 +314,40 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
         use_sequential_levels: bool = False,
         debug_mode: int = 0,
         resource_root: Optional[str] = None,
-        num_threads: int = 4,
+        num_threads: Optional[int] = None,
+        spin_wait_us: int = 0,
+        obs_format: str = "rgb",
+        frame_stack: int = 1,
+        action_repeat: int = 1,
+        max_pool_last: int = 1,
+        perf_stats: bool = False,
+        level_cache_mb: int = 0,
+        cache_static_tiles: bool = False,
+        cache_scaled_sprites: bool = False,
+        render_backend: str = "qt",
+        collision_broadphase: bool = False,
+        broadphase_min_entities: int = 96,
         render_mode: Optional[str] = None,
+        copy: bool = True,
     ):
         assert env_name in ENV_NAMES, f"Unknown environment: {env_name}"
         assert (
             distribution_mode in DISTRIBUTION_MODE_DICT
         ), f'"{distribution_mode}" is not a valid distribution mode.'
 
+        assert obs_format in OBS_FORMAT_DICT, f'"{obs_format}" is not a valid observation format.'
+        assert frame_stack >= 1, "frame_stack must be at least 1"
+        assert action_repeat >= 1, "action_repeat must be at least 1"
+        assert 1 <= max_pool_last <= action_repeat, "max_pool_last must be between 1 and action_repeat"
+        assert level_cache_mb >= 0, "level_cache_mb must be non-negative"
+        assert broadphase_min_entities >= 0, "broadphase_min_entities must be non-negative"
+        assert (
+            render_backend in RENDER_BACKEND_DICT
+        ), f'"{render_backend}" is not a valid render backend.'
+
+        if num_threads is None:
+            num_threads = default_num_threads(num_envs)
+
         if distribution_mode == "exploration":
             assert (
                 env_name in EXPLORATION_LEVEL_SEEDS
@@ -181,11 +368,7 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
         else:
             lib_dir = build(debug=debug)
 
-        if render_mode is None:
-            render_human = False
-        elif render_mode == "rgb_array":
-            render_human = True
-        else:
+        if render_mode not in (None, "rgb_array"):
             raise ValueError(f"invalid render mode '{render_mode}', expected None or 'rgb_array'")
 
         if rand_seed is None:
@@ -200,7 +383,13 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
             "debug_mode": debug_mode,
             "rand_seed": rand_seed,
             "num_threads": num_threads,
-            "render_human": render_human,
+            "spin_wait_us": spin_wait_us,
+            "obs_format": OBS_FORMAT_DICT[obs_format],
+            "frame_stack": frame_stack,
+            "action_repeat": action_repeat,
+            "max_pool_last": max_pool_last,
+            "perf_stats": perf_stats,
+            "level_cache_mb": level_cache_mb,
             "resource_root": resource_root,
             "center_agent": center_agent,
             "use_generated_assets": use_generated_assets,
@@ -208,6 +397,11 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
             "restrict_themes": restrict_themes,
             "use_backgrounds": use_backgrounds,
             "paint_vel_info": paint_vel_info,
+            "cache_static_tiles": cache_static_tiles,
+            "cache_scaled_sprites": cache_scaled_sprites,
+            "render_backend": RENDER_BACKEND_DICT[render_backend],
+            "collision_broadphase": collision_broadphase,
+            "broadphase_min_entities": broadphase_min_entities,
             "distribution_mode": distribution_mode_int,
         }
 
@@ -218,9 +412,28 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
             c_func_defs=[
                 "int get_state(libenv_env *, int, char *, int);",
                 "void set_state(libenv_env *, int, char *, int);",
+                "void set_buffer_sets(libenv_env *, struct libenv_buffers *, int);",
+                "void use_buffer_set(libenv_env *, int, int, int);",
+                "void act_range(libenv_env *, int, int);",
+                "void observe_range(libenv_env *, int, int);",
+                "void rollout(libenv_env *, const int32_t *, int, void **, void **, float *, uint8_t *);",
+                "int64_t serialize_states(libenv_env *, const uint8_t *, int);",
+                "void read_states(libenv_env *, const uint8_t *, char *, int64_t *);",
+                "void set_states(libenv_env *, const uint8_t *, char *, const int64_t *);",
+                "void clone_envs(libenv_env *, const int32_t *, const int32_t *, int);",
+                "void render_envs(libenv_env *, const int32_t *, int, uint8_t *);",
+                "void get_perf_stats(libenv_env *, int64_t *, int64_t *, int64_t *);",
+                "void reset_perf_stats(libenv_env *);",
+                "void get_level_cache_stats(libenv_env *, int64_t *);",
+                "void time_level_resets(libenv_env *, int, const int32_t *, int, int64_t *);",
             ],
+            copy=copy,
         )
         self._env_name = env_name
+        self._perf_stats = perf_stats
+        self._use_generated_assets = use_generated_assets
+        self._step_pending = False
+        self._half_pending = [False, False]
 
         # Initialize VectorEnv base (no-arg super().__init__ in gymnasium 1.x)
         super().__init__()
@@ -229,8 +442,10 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
         self.num_envs = num_envs
         self.render_mode = render_mode
 
+        ob_type = self._clib.ob_types[0]
+        self._obs_key = ob_type["name"]
         self.single_observation_space = spaces.Box(
-            low=0, high=255, shape=(64, 64, 3), dtype=np.uint8
+            low=0, high=255, shape=ob_type["shape"], dtype=np.uint8
         )
         self.single_action_space = spaces.Discrete(len(KEY_COMBOS))
 
@@ -248,12 +463,12 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
         internally, so this returns the current observation.
 
         Returns:
-            obs: np.ndarray of shape (num_envs, 64, 64, 3)
+            obs: np.ndarray of shape (num_envs, *single_observation_space.shape)
             info: dict of per-env info arrays
         """
         # Procgen auto-resets; we just observe the current state
         first, obs, _rew, info = self._clib.observe()
-        return obs["rgb"], self._convert_info(info)
+        return obs[self._obs_key], self._convert_info(info)
 
     def step(self, actions):
         """
@@ -265,18 +480,221 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
         Returns:
             obs, reward, terminated, truncated, info
         """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions):
+        """
+        Start stepping all environments and return without waiting.
+
+        Args:
+            actions: np.ndarray of shape (num_envs,) with int actions
+        """
+        self._check_no_pending_step()
         self._clib.act(np.asarray(actions, dtype=np.int32))
-        first, obs, rew, info = self._clib.observe()
+        self._step_pending = True
+
+    def step_wait(self):
+        """
+        Wait for the step started by :meth:`step_async` to complete.
+
+        Returns:
+            obs, reward, terminated, truncated, info
+        """
+        if not self._step_pending:
+            raise NoAsyncCallError("Calling `step_wait` without any prior call to `step_async`.", "step")
+        self._step_pending = False
+        return self._make_step_result(*self._clib.observe())
+
+    def step_half_async(self, half: int, actions):
+        """
+        Start stepping one half of the batch and return without waiting.
+
+        Half ``0`` covers environments ``[0, num_envs // 2)`` and half ``1``
+        covers ``[num_envs // 2, num_envs)``. The other half can be stepped or
+        waited on independently in the meantime.
+
+        Args:
+            half: 0 or 1
+            actions: np.ndarray with one int action per environment in the half
+        """
+        start, stop = self._half_range(half)
+        if self._step_pending or self._half_pending[half]:
+            raise AlreadyPendingCallError(
+                f"Calling `step_half_async` while waiting for a pending step of half {half} to complete.",
+                "step",
+            )
+        self._clib.act_range(np.asarray(actions, dtype=np.int32), start, stop)
+        self._half_pending[half] = True
+
+    def step_half_wait(self, half: int):
+        """
+        Wait for the step of one half started by :meth:`step_half_async`.
+
+        Returns:
+            obs, reward, terminated, truncated, info for the environments in the half
+        """
+        start, stop = self._half_range(half)
+        if not self._half_pending[half]:
+            raise NoAsyncCallError(
+                f"Calling `step_half_wait` without any prior call to `step_half_async` for half {half}.",
+                "step",
+            )
+        self._half_pending[half] = False
+        return self._make_step_result(*self._clib.observe_range(start, stop))
+
+    def rollout(self, actions, out: Optional[dict] = None):
+        """
+        Step all environments through a sequence of actions in one native call.
+
+        The steps run back to back on the stepping threads without returning
+        to Python in between, which avoids the per-step overhead of
+        :meth:`step` for open-loop action sequences and search rollouts. The
+        results are the same as calling :meth:`step` with each row of
+        ``actions`` in turn.
+
+        Args:
+            actions: int array of shape (num_steps, num_envs), row ``t`` holds
+                the actions of step ``t``, each one of the actions of
+                :meth:`step` or -1 to end the episode
+            out: optional buffers from :meth:`make_rollout_buffers` to write
+                the results into, new ones are allocated if None
+
+        Returns:
+            obs, reward, terminated, truncated, info like :meth:`step`, with
+            an extra leading num_steps axis
+        """
+        self._check_no_pending_step()
+        actions = np.asarray(actions)
+        assert actions.dtype.kind in "iu", f"actions must be integers, got {actions.dtype}"
+        assert actions.ndim == 2 and actions.shape[1] == self.num_envs, (
+            f"actions must have shape (num_steps, {self.num_envs}), got {actions.shape}"
+        )
+        num_actions = self.single_action_space.n
+        assert actions.size == 0 or (actions.min() >= -1 and actions.max() < num_actions), (
+            f"actions must be in [-1, {num_actions}), got values from {actions.min()} to {actions.max()}"
+        )
+        actions = np.ascontiguousarray(actions, dtype=np.int32)
+        num_steps = len(actions)
+        if out is None:
+            out = self.make_rollout_buffers(num_steps)
+        else:
+            self._check_rollout_buffers(out, num_steps)
+        # procgen doesn't distinguish truncation from termination, like step()
+        out["truncated"].fill(False)
+
+        self._clib.rollout(
+            actions,
+            {self._obs_key: out["obs"]},
+            out["info"],
+            out["reward"],
+            out["terminated"],
+        )
+        return out["obs"], out["reward"], out["terminated"], out["truncated"], out["info"]
+
+    def make_rollout_buffers(self, num_steps: int) -> dict:
+        """
+        Allocate output buffers for :meth:`rollout` of ``num_steps`` steps.
+
+        Returns:
+            dict with ``obs``, ``reward``, ``terminated``, ``truncated`` and
+            ``info`` arrays of shape (num_steps, num_envs, ...), ``info``
+            being a dict of per-key arrays
+        """
+        shape = (num_steps, self.num_envs)
+        return {
+            "obs": np.zeros(shape + self.single_observation_space.shape, dtype=np.uint8),
+            "reward": np.zeros(shape, dtype=np.float32),
+            "terminated": np.zeros(shape, dtype=bool),
+            "truncated": np.zeros(shape, dtype=bool),
+            "info": {
+                tt["name"]: np.zeros(shape + tt["shape"], dtype=tt["dtype"])
+                for tt in self._clib.info_types
+            },
+        }
+
+    def set_output_buffers(self, actions, buffer_sets):
+        """
+        Read actions from and write the outputs of :meth:`step_into` into caller owned arrays.
 
+        This lets the C++ side step straight into e.g. shared memory, as the
+        workers of :class:`~procgen_gym.sharded.ProcgenShardedVecEnv` do. The
+        arrays are registered once, :meth:`step_into` then only picks the set
+        a step writes into. The current outputs are not copied over.
+
+        Args:
+            actions: int32 array of shape (num_envs,) that :meth:`step_into`
+                reads the actions from
+            buffer_sets: list of dicts with ``obs``, ``reward`` and
+                ``terminated`` arrays and an ``info`` dict of arrays, shaped
+                and typed like the results of :meth:`step` and C contiguous,
+                which must stay alive until the env is closed
+        """
+        self._check_no_pending_step()
+        assert actions.shape == (self.num_envs,) and actions.dtype == np.int32, (
+            f"actions must be an int32 array of shape ({self.num_envs},), got {actions.dtype} {actions.shape}"
+        )
+        assert actions.flags.c_contiguous, "actions must be C contiguous"
+        assert len(buffer_sets) > 0, "at least one buffer set is required"
+        for arrays in buffer_sets:
+            self._check_buffers(arrays, ("obs", "reward", "terminated"), (self.num_envs,))
+        self._clib.set_buffer_sets(actions, [
+            {
+                "ob": {self._obs_key: arrays["obs"]},
+                "info": arrays["info"],
+                "rew": arrays["reward"],
+                "first": arrays["terminated"].view(np.uint8),
+            }
+            for arrays in buffer_sets
+        ])
+
+    def step_into(self, buffer_set: int):
+        """
+        Step every environment with the actions in the array given to
+        :meth:`set_output_buffers` and wait until the outputs are written
+        into buffer set ``buffer_set``.
+        """
+        self._check_no_pending_step()
+        self._clib.act_into(buffer_set)
+        self._clib.wait()
+
+    def _check_rollout_buffers(self, out, num_steps):
+        self._check_buffers(out, ("obs", "reward", "terminated", "truncated"), (num_steps, self.num_envs))
+
+    def _check_buffers(self, out, keys, leading_shape):
+        expected = self.make_rollout_buffers(0)
+        arrays = [(key, out[key], expected[key]) for key in keys]
+        arrays += [(f"info[{key!r}]", out["info"][key], arr) for key, arr in expected["info"].items()]
+        for name, arr, like in arrays:
+            shape = leading_shape + like.shape[2:]
+            assert arr.shape == shape and arr.dtype == like.dtype, (
+                f"out {name} must be a {like.dtype} array of shape {shape}, got {arr.dtype} {arr.shape}"
+            )
+            assert arr.flags.c_contiguous, f"out {name} must be C contiguous"
+
+    def _half_range(self, half):
+        assert half in (0, 1), f"half must be 0 or 1, got {half}"
+        assert self.num_envs >= 2, "half-batch stepping requires num_envs >= 2"
+        mid = self.num_envs // 2
+        return (0, mid) if half == 0 else (mid, self.num_envs)
+
+    def _check_no_pending_step(self):
+        if self._step_pending or any(self._half_pending):
+            raise AlreadyPendingCallError(
+                "Calling `step_async` while waiting for a pending call to `step` to complete.",
+                "step",
+            )
+
+    def _make_step_result(self, first, obs, rew, info):
         # In procgen, 'first' indicates the env was just reset (episode ended on the
         # *previous* step). We treat this as the episode having terminated.
         # The observation returned is already the first obs of the NEW episode (auto-reset).
         terminated = first.astype(bool)
 
         # Procgen doesn't distinguish truncation from termination
-        truncated = np.zeros(self.num_envs, dtype=bool)
+        truncated = np.zeros(len(first), dtype=bool)
 
-        return obs["rgb"], rew, terminated, truncated, self._convert_info(info)
+        return obs[self._obs_key], rew, terminated, truncated, self._convert_info(info)
 
     def _convert_info(self, raw_info):
         """Convert raw info dict to gymnasium-compatible info dict."""
@@ -285,16 +703,34 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
             info[key] = arr
         return info
 
-    def render(self):
-        """Return list of RGB frames (one per env) if render_mode='rgb_array'."""
-        if self.render_mode == "rgb_array":
-            info = self._clib.get_info_bufs()
-            if "rgb" in info:
-                frames = info["rgb"]
-            else:
-                frames = self._clib.get_ob_bufs()["rgb"]
-            return [frames[i].copy() for i in range(self.num_envs)]
-        return None
+    def render(self, env_indices: Optional[Sequence[int]] = None):
+        """
+        Return list of RGB frames if render_mode='rgb_array'.
+
+        Frames are rendered at 512x512 on demand, in parallel on the stepping
+        threads, so nothing is rendered for environments that are never
+        requested.
+
+        Args:
+            env_indices: environments to render, all environments if None
+
+        Returns:
+            list with one (512, 512, 3) frame per requested environment
+        """
+        if self.render_mode != "rgb_array":
+            return None
+
+        if env_indices is None:
+            env_indices = range(self.num_envs)
+        # render each env once even if it is requested several times
+        unique_indices, inverse = np.unique(np.asarray(env_indices, dtype=np.int32), return_inverse=True)
+        assert np.all((unique_indices >= 0) & (unique_indices < self.num_envs)), "env index out of range"
+
+        frames = np.empty((len(unique_indices), RENDER_RES, RENDER_RES, 3), dtype=np.uint8)
+        self._clib.call_c_func(
+            "render_envs", unique_indices.ctypes.data, len(unique_indices), frames.ctypes.data
+        )
+        return [frames[i] for i in inverse]
 
     def close(self):
         """Release C resources."""
@@ -302,28 +738,190 @@ class ProcgenVecEnv(gym.vector.VectorEnv):
             self._clib.close()
             self._clib = None
 
+    # ---- Profiling (procgen-specific) ----
+
+    def get_perf_stats(self):
+        """
+        Cumulative per-phase timings, requires ``perf_stats=True``.
+
+        The phases are ``game_step`` (game logic and physics), ``render``
+        (drawing the 64x64 frame), ``convert`` (converting it to the
+        observation format, including frame stacking) and ``reset`` (level
+        generation). ``wait`` is the time the calling thread spent blocked on
+        the stepping threads, which is always zero with ``num_threads=0``.
+
+        Returns:
+            dict mapping each phase to a dict with ``time_s`` and ``count``,
+            arrays of shape (num_envs,) for the per-environment phases and
+            scalars for ``wait``
+        """
+        assert self._perf_stats, "perf stats are disabled, create the env with perf_stats=True"
+        time_ns = np.zeros((self.num_envs, len(PERF_PHASES)), dtype=np.int64)
+        counts = np.zeros((self.num_envs, len(PERF_PHASES)), dtype=np.int64)
+        wait = np.zeros(2, dtype=np.int64)
+        self._clib.call_c_func("get_perf_stats", time_ns.ctypes.data, counts.ctypes.data, wait.ctypes.data)
+
+        stats = {}
+        for i, phase in enumerate(PERF_PHASES):
+            stats[phase] = {"time_s": time_ns[:, i] / 1e9, "count": counts[:, i]}
+        stats["wait"] = {"time_s": wait[0] / 1e9, "count": wait[1]}
+        return stats
+
+    def reset_perf_stats(self):
+        """Zero the counters returned by :meth:`get_perf_stats`."""
+        assert self._perf_stats, "perf stats are disabled, create the env with perf_stats=True"
+        self._clib.call_c_func("reset_perf_stats")
+
+    def get_level_cache_stats(self):
+        """
+        Counters of the level cache enabled with ``level_cache_mb``.
+
+        Returns:
+            dict with the number of ``hits``, ``misses`` and ``evictions``
+            and the current number of ``entries`` and ``bytes``, all zero if
+            the cache is disabled
+        """
+        stats = np.zeros(len(LEVEL_CACHE_STATS), dtype=np.int64)
+        self._clib.call_c_func("get_level_cache_stats", stats.ctypes.data)
+        return {name: int(value) for name, value in zip(LEVEL_CACHE_STATS, stats)}
+
+    def time_level_resets(self, seeds, env_idx: int = 0):
+        """
+        Time the generation of the level for each of the level seeds.
+
+        Levels are generated one after the other on the calling thread by
+        sub-environment ``env_idx``, bypassing the level cache, and its state
+        is restored afterwards so the episode in progress, including the
+        stacked frames, is not affected. Unlike ``get_perf_stats()["reset"]``
+        this times a chosen seed rather than whichever level the environment
+        moves on to. Not supported with ``use_generated_assets=True``, since
+        the state of such environments can't be saved.
+
+        Returns:
+            float64 array with the generation time of each seed in seconds
+        """
+        assert not self._use_generated_assets, "time_level_resets is not supported with use_generated_assets=True"
+        assert 0 <= env_idx < self.num_envs, f"env_idx {env_idx} out of range"
+        seeds = np.ascontiguousarray(seeds, dtype=np.int32)
+        assert seeds.ndim == 1
+        time_ns = np.zeros(len(seeds), dtype=np.int64)
+        self._clib.call_c_func("time_level_resets", env_idx, seeds.ctypes.data, len(seeds), time_ns.ctypes.data)
+        return time_ns / 1e9
+
     # ---- State save/load (procgen-specific) ----
 
-    def get_state(self):
-        """Serialize the state of each sub-environment."""
-        length = MAX_STATE_SIZE
-        buf = ctypes.create_string_buffer(length)
-        result = []
-        for env_idx in range(self.num_envs):
-            n = self._clib.call_c_func(
-                "get_state", env_idx, buf, length
-            )
-            result.append(buf.raw[:n])
-        return result
+    def get_state(self, compact: bool = False):
+        """
+        Serialize the state of each sub-environment.
+
+        With ``compact=True`` the states use a compact encoding, several
+        times smaller and faster to produce. :meth:`set_state` accepts either.
+        Only compact states hold the running episode statistics, after
+        restoring a default state they are unknown and the episode in
+        progress reports NaN and -1 when it ends.
+        """
+        data, offsets = self.get_states(compact=compact)
+        return [data[offsets[i]:offsets[i + 1]].tobytes() for i in range(self.num_envs)]
 
     def set_state(self, states):
         """Restore the state of each sub-environment."""
         assert len(states) == self.num_envs
-        for env_idx in range(self.num_envs):
-            state = states[env_idx]
-            self._clib.call_c_func(
-                "set_state", env_idx, state, len(state)
-            )
+        offsets = np.zeros(self.num_envs + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(state) for state in states])
+        data = np.frombuffer(b"".join(states), dtype=np.uint8)
+        self.set_states(data, offsets)
+
+    def get_states(self, mask: Optional[np.ndarray] = None, compact: bool = False):
+        """
+        Serialize sub-environments in parallel into one contiguous buffer.
+
+        Args:
+            mask: optional boolean array of shape (num_envs,) selecting which
+                environments to serialize, all environments if None
+            compact: use the compact encoding, see :meth:`get_state`
+
+        Returns:
+            data: uint8 array holding the selected states back to back
+            offsets: int64 array with one entry per selected environment plus
+                the total size, state ``i`` is ``data[offsets[i]:offsets[i + 1]]``
+        """
+        mask = self._state_mask(mask)
+        mask_ptr = None if mask is None else mask.ctypes.data
+        count = self.num_envs if mask is None else int(mask.sum())
+
+        total = self._clib.call_c_func("serialize_states", mask_ptr, int(compact))
+        data = np.empty(total, dtype=np.uint8)
+        offsets = np.empty(count + 1, dtype=np.int64)
+        self._clib.call_c_func("read_states", mask_ptr, data.ctypes.data, offsets.ctypes.data)
+        return data, offsets
+
+    def set_states(self, data: np.ndarray, offsets: np.ndarray, mask: Optional[np.ndarray] = None):
+        """
+        Restore sub-environments in parallel from the output of :meth:`get_states`.
+
+        Args:
+            data: uint8 array holding the states back to back
+            offsets: int64 array with one entry per restored environment plus
+                the total size
+            mask: optional boolean array of shape (num_envs,) selecting which
+                environments to restore, all environments if None
+
+        Raises:
+            ValueError: if a state was saved in a format version that this
+                version of procgen_gym can't read
+        """
+        mask = self._state_mask(mask)
+        count = self.num_envs if mask is None else int(mask.sum())
+        data = np.ascontiguousarray(data, dtype=np.uint8)
+        offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        assert offsets.shape == (count + 1,), f"expected {count + 1} offsets, got {offsets.shape}"
+        assert offsets[-1] <= len(data), "offsets point past the end of the state data"
+        _check_state_versions(data, offsets)
+
+        self._clib.call_c_func(
+            "set_states",
+            None if mask is None else mask.ctypes.data,
+            data.ctypes.data,
+            offsets.ctypes.data,
+        )
+
+    def clone_env(self, src: int, dst: int):
+        """Make sub-environment ``dst`` an exact copy of ``src``, see :meth:`clone_envs`."""
+        assert 0 <= src < self.num_envs and 0 <= dst < self.num_envs, "env index out of range"
+        assert src != dst, "an environment can't be cloned into itself"
+        src_indices = np.array([src], dtype=np.int32)
+        dst_indices = np.array([dst], dtype=np.int32)
+        self._clib.call_c_func("clone_envs", src_indices.ctypes.data, dst_indices.ctypes.data, 1)
+
+    def clone_envs(self, src_indices, dst_indices):
+        """
+        Copy the state of sub-environments into others, in parallel and without
+        the states passing through Python.
+
+        Sub-environment ``dst_indices[i]`` becomes an exact copy of
+        ``src_indices[i]``, including its current observation and its future
+        level seeds, so ``clone_envs([3] * 3, [0, 1, 2])`` fans env 3 out to
+        envs 0 to 2. A source can be copied any number of times, but each
+        destination may only appear once and may not also be a source.
+        """
+        src_indices = np.ascontiguousarray(src_indices, dtype=np.int32)
+        dst_indices = np.ascontiguousarray(dst_indices, dtype=np.int32)
+        assert src_indices.ndim == 1 and src_indices.shape == dst_indices.shape
+        assert np.all((0 <= src_indices) & (src_indices < self.num_envs)), "source index out of range"
+        assert np.all((0 <= dst_indices) & (dst_indices < self.num_envs)), "destination index out of range"
+        dst_counts = np.bincount(dst_indices, minlength=self.num_envs)
+        assert np.all(dst_counts <= 1), "destinations must be unique"
+        assert not np.any(dst_counts[src_indices]), "destinations may not also be sources"
+        self._clib.call_c_func(
+            "clone_envs", src_indices.ctypes.data, dst_indices.ctypes.data, len(src_indices)
+        )
+
+    def _state_mask(self, mask):
+        if mask is None:
+            return None
+        mask = np.ascontiguousarray(mask, dtype=bool).view(np.uint8)
+        assert mask.shape == (self.num_envs,), f"mask must have shape ({self.num_envs},)"
+        return mask
 
     # ---- Interactive helper ----
 
@@ -350,18 +948,26 @@ class ProcgenEnv(gym.Env):
 
     Provides standard ``gymnasium.Env`` interface (non-vectorized) so that
     ``gym.make("procgen_gym/procgen-coinrun-v0")`` works as expected.
+
+    ``num_threads`` follows the same default as :class:`ProcgenVecEnv`,
+    :func:`default_num_threads`, which steps a single environment on the
+    calling thread. Pass it explicitly to override.
     """
 
     metadata = {"render_modes": ["rgb_array"], "render_fps": 15}
 
-    def __init__(self, env_name: str = "coinrun", render_mode: Optional[str] = None, **kwargs):
+    def __init__(
+        self,
+        env_name: str = "coinrun",
+        render_mode: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        **kwargs,
+    ):
         self._vec_env = ProcgenVecEnv(
-            num_envs=1, env_name=env_name, num_threads=0,
+            num_envs=1, env_name=env_name, num_threads=num_threads,
             render_mode=render_mode, **kwargs,
         )
-        self.observation_space = spaces.Box(
-            low=0, high=255, shape=(64, 64, 3), dtype=np.uint8
-        )
+        self.observation_space = self._vec_env.single_observation_space
         self.action_space = spaces.Discrete(len(KEY_COMBOS))
         self.render_mode = render_mode
 
@@ -10,7 +10,6 @@ def make_vec_env(env_name, render_mode=None, num_envs=1, **kwargs):
     return ProcgenVecEnv(
         num_envs=num_envs,
         env_name=env_name,
-        num_threads=0,
         render_mode=render_mode,
         **kwargs,
     )
@@ -191,6 +191,33 @@ def _make_options(options_dict):
     return opts, keepalive
 
 
+# ctypes types of the scalar C types used in c_func_defs, pointers are passed as c_void_p
+_C_SCALAR_TYPES = {
+    "void": None,
+    "int": ctypes.c_int,
+    "int32_t": ctypes.c_int32,
+    "int64_t": ctypes.c_int64,
+    "uint8_t": ctypes.c_uint8,
+    "float": ctypes.c_float,
+}
+
+
+def _c_type(decl):
+    """Return the ctypes type for a C type such as ``"int"`` or ``"const int32_t *"``."""
+    if "*" in decl:
+        return ctypes.c_void_p
+    return _C_SCALAR_TYPES[decl.replace("const ", "").strip()]
+
+
+def _bind_c_func(lib, c_func_def):
+    """Set restype and argtypes of a function from a declaration like ``"int f(libenv_env *, int);"``."""
+    head, args = c_func_def.strip().rstrip(";").rstrip(")").split("(", 1)
+    restype, name = head.rsplit(None, 1)
+    func = getattr(lib, name)
+    func.restype = _c_type(restype)
+    func.argtypes = [_c_type(arg) for arg in args.split(",") if arg.strip()]
+
+
 def _get_tensortypes(lib, handle, space):
     """Query tensor types for a given space from the C library."""
     lib.libenv_get_tensortypes.restype = ctypes.c_int
@@ -223,16 +250,33 @@ def _get_tensortypes(lib, handle, space):
     return result
 
 
+def _readonly_view(arr):
+    """Return a view of ``arr`` that cannot be written to from Python."""
+    view = arr.view()
+    view.flags.writeable = False
+    return view
+
+
 class CLibenv:
     """
     Low-level wrapper around a libenv shared library.
 
     Manages the C environment handle, allocates numpy buffers, and provides
     act/observe/close operations. This replaces gym3.libenv.CEnv.
+
+    With ``copy=False`` two sets of output buffers are allocated and every
+    environment switches to the other set each time it is stepped (double
+    buffering), so :meth:`observe` and :meth:`observe_range` can return
+    read-only views instead of copies. Arrays returned for step ``t`` of an
+    environment stay valid until the buffers are reused by its step ``t + 2``.
+
+    Besides the libenv interface this calls procgen's buffer set, range and
+    rollout functions, which must be among ``c_func_defs``.
     """
 
-    def __init__(self, lib_dir, num, options, c_func_defs=None):
+    def __init__(self, lib_dir, num, options, c_func_defs=None, copy=True):
         self.num = num
+        self.copy = copy
         self._handle = None
         self._lib = _load_library(lib_dir)
         self._keepalive = []
@@ -255,6 +299,11 @@ class CLibenv:
             ctypes.c_void_p, ctypes.POINTER(_LibenvBuffers)
         ]
 
+        # Bind extra C functions (e.g. get_state, set_state)
+        self._c_func_defs = c_func_defs or []
+        for c_func_def in self._c_func_defs:
+            _bind_c_func(self._lib, c_func_def)
+
         # Create the environment
         opts, keepalive = _make_options(options)
         self._keepalive.extend(keepalive)
@@ -265,84 +314,182 @@ class CLibenv:
         self._ac_types = _get_tensortypes(self._lib, self._handle, _SPACE_ACTION)
         self._info_types = _get_tensortypes(self._lib, self._handle, _SPACE_INFO)
 
-        # Allocate numpy buffers
-        self._ob_bufs = {}
-        for tt in self._ob_types:
-            self._ob_bufs[tt["name"]] = np.zeros((num,) + tt["shape"], dtype=tt["dtype"])
-
+        # Allocate numpy buffers, actions are shared between buffer sets
         self._ac_bufs = {}
         for tt in self._ac_types:
             self._ac_bufs[tt["name"]] = np.zeros((num,) + tt["shape"], dtype=tt["dtype"])
 
-        self._info_bufs = {}
-        for tt in self._info_types:
-            self._info_bufs[tt["name"]] = np.zeros((num,) + tt["shape"], dtype=tt["dtype"])
-
-        self._rew_buf = np.zeros(num, dtype=np.float32)
-        self._first_buf = np.zeros(num, dtype=np.uint8)
-
-        # Set buffers on the C side
-        self._set_buffers()
-
-        # Register extra C functions (e.g. get_state, set_state)
-        self._c_func_defs = c_func_defs or []
+        self._buffer_sets = [self._make_buffer_set() for _ in range(1 if copy else 2)]
+        # the buffer set each environment writes its outputs into
+        self._env_sets = np.zeros(num, dtype=np.int64)
+        self._register_buffer_sets()
 
         # Observe initial state
         self._lib.libenv_observe(self._handle)
 
-    def _set_buffers(self):
-        """Pass numpy buffer pointers to the C library."""
-        ob_ptrs = (ctypes.c_void_p * len(self._ob_types))()
-        for i, tt in enumerate(self._ob_types):
-            buf = self._ob_bufs[tt["name"]]
-            for env_idx in range(self.num):
-                pass  # buffers are contiguous per-env
-            ob_ptrs[i] = buf.ctypes.data
+    def _make_buffer_set(self, arrays=None):
+        """
+        Allocate one set of output buffers and the matching C pointer struct,
+        or wrap the arrays of a set given in the form :meth:`set_buffer_sets` takes.
+        """
+        if arrays is None:
+            arrays = {
+                "ob": {
+                    tt["name"]: np.zeros((self.num,) + tt["shape"], dtype=tt["dtype"])
+                    for tt in self._ob_types
+                },
+                "info": {
+                    tt["name"]: np.zeros((self.num,) + tt["shape"], dtype=tt["dtype"])
+                    for tt in self._info_types
+                },
+                "rew": np.zeros(self.num, dtype=np.float32),
+                "first": np.zeros(self.num, dtype=np.uint8),
+            }
+        ob_bufs = arrays["ob"]
+        info_bufs = arrays["info"]
+        rew_buf = arrays["rew"]
+        first_buf = arrays["first"]
 
         # The C side expects pointers laid out as:
         # buf[space_idx * num_envs + env_idx] = pointer to env_idx's data for space_idx
-        # We need to provide per-env pointers for each space
-
-        ob_ptr_arr = (ctypes.c_void_p * (len(self._ob_types) * self.num))()
-        for space_idx, tt in enumerate(self._ob_types):
-            buf = self._ob_bufs[tt["name"]]
-            env_stride = int(np.prod(tt["shape"])) * buf.dtype.itemsize
-            for env_idx in range(self.num):
-                ob_ptr_arr[space_idx * self.num + env_idx] = buf.ctypes.data + env_idx * env_stride
-
-        ac_ptr_arr = (ctypes.c_void_p * (len(self._ac_types) * self.num))()
-        for space_idx, tt in enumerate(self._ac_types):
-            buf = self._ac_bufs[tt["name"]]
-            env_stride = max(int(np.prod(tt["shape"])), 1) * buf.dtype.itemsize
-            for env_idx in range(self.num):
-                ac_ptr_arr[space_idx * self.num + env_idx] = buf.ctypes.data + env_idx * env_stride
-
-        info_ptr_arr = (ctypes.c_void_p * (len(self._info_types) * self.num))()
-        for space_idx, tt in enumerate(self._info_types):
-            buf = self._info_bufs[tt["name"]]
-            env_stride = max(int(np.prod(tt["shape"])), 1) * buf.dtype.itemsize
-            for env_idx in range(self.num):
-                info_ptr_arr[space_idx * self.num + env_idx] = buf.ctypes.data + env_idx * env_stride
+        ob_ptr_arr = self._per_env_pointers(self._ob_types, ob_bufs)
+        ac_ptr_arr = self._per_env_pointers(self._ac_types, self._ac_bufs)
+        info_ptr_arr = self._per_env_pointers(self._info_types, info_bufs)
 
         bufs = _LibenvBuffers()
         bufs.ob = ob_ptr_arr
         bufs.ac = ac_ptr_arr
         bufs.info = info_ptr_arr
-        bufs.rew = self._rew_buf.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
-        bufs.first = self._first_buf.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+        bufs.rew = rew_buf.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+        bufs.first = first_buf.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+
+        return {
+            "ob": ob_bufs,
+            "info": info_bufs,
+            "rew": rew_buf,
+            "first": first_buf,
+            "views": (
+                _readonly_view(first_buf),
+                {k: _readonly_view(v) for k, v in ob_bufs.items()},
+                _readonly_view(rew_buf),
+                {k: _readonly_view(v) for k, v in info_bufs.items()},
+            ),
+            # keep the pointer arrays alive as long as the struct is in use
+            "c_bufs": (ob_ptr_arr, ac_ptr_arr, info_ptr_arr, bufs),
+        }
+
+    def _per_env_pointers(self, types, bufs):
+        """Build the ``space_idx * num_envs + env_idx`` pointer array for a space."""
+        ptr_arr = (ctypes.c_void_p * (len(types) * self.num))()
+        for space_idx, tt in enumerate(types):
+            buf = bufs[tt["name"]]
+            env_stride = max(int(np.prod(tt["shape"])), 1) * buf.dtype.itemsize
+            offsets = buf.ctypes.data + env_stride * np.arange(self.num, dtype=np.uint64)
+            ptr_arr[space_idx * self.num:(space_idx + 1) * self.num] = offsets.tolist()
+        return ptr_arr
+
+    def set_buffer_sets(self, actions, buffer_sets):
+        """
+        Make the C library read actions from and write outputs into caller
+        owned arrays instead of its own buffers.
+
+        ``actions`` is an int32 array of shape ``(num,)`` and every buffer set
+        is a dict with ``ob`` and ``info`` dicts of arrays and ``rew`` and
+        ``first`` arrays, shaped and typed like the arrays :meth:`observe`
+        returns and C contiguous. The current outputs are not copied over.
+        Set 0 is used first, the arrays must stay alive until the library is
+        closed.
+        """
+        self._ac_bufs = {"action": actions}
+        self._buffer_sets = [self._make_buffer_set(arrays) for arrays in buffer_sets]
+        self._register_buffer_sets()
+
+    def _register_buffer_sets(self):
+        """Hand every buffer set to the C library once, the environments start out on set 0."""
+        c_bufs = (_LibenvBuffers * len(self._buffer_sets))(
+            *[buffer_set["c_bufs"][-1] for buffer_set in self._buffer_sets]
+        )
+        self.call_c_func("set_buffer_sets", c_bufs, len(self._buffer_sets))
+        self._env_sets[:] = 0
+        self._set_current(0)
+
+    def _set_current(self, idx):
+        """Make buffer set ``idx`` the one the ``get_*_buf(s)`` methods and copies read from."""
+        buffer_set = self._buffer_sets[idx]
+        self._ob_bufs = buffer_set["ob"]
+        self._info_bufs = buffer_set["info"]
+        self._rew_buf = buffer_set["rew"]
+        self._first_buf = buffer_set["first"]
+
+    def use_buffer_set(self, idx):
+        """Point every environment at buffer set ``idx``, without rebuilding any pointers."""
+        # raises IndexError for a set that doesn't exist before the C side sees it
+        self._set_current(idx)
+        self.call_c_func("use_buffer_set", idx, 0, self.num)
+        self._env_sets[:] = idx
+
+    def _runs(self, start, stop):
+        """Split ``[start, stop)`` into runs of environments on the same buffer set."""
+        sets = self._env_sets[start:stop]
+        edges = [0, *(np.flatnonzero(np.diff(sets)) + 1).tolist(), len(sets)]
+        return [(start + a, start + b, int(sets[a])) for a, b in zip(edges[:-1], edges[1:])]
+
+    def _swap_buffer_sets(self, start, stop):
+        """
+        Step environments ``[start, stop)`` into their other buffer set so the
+        views handed out for their previous step are not overwritten while
+        they are still in use.
+        """
+        for run_start, run_stop, idx in self._runs(start, stop):
+            self.call_c_func("use_buffer_set", 1 - idx, run_start, run_stop)
+        self._env_sets[start:stop] = 1 - self._env_sets[start:stop]
+        self._set_current(int(self._env_sets[start]))
+
+    def _views(self, start, stop):
+        """Read-only views of the outputs of environments ``[start, stop)``."""
+        runs = self._runs(start, stop)
+        if len(runs) > 1:
+            # the range was stepped in parts that are on different buffer sets, so gather them
+            parts = [self._views(run_start, run_stop) for run_start, run_stop, _ in runs]
+            first, ob, rew, info = parts[0]
+            return (
+                _readonly_view(np.concatenate([p[0] for p in parts])),
+                {k: _readonly_view(np.concatenate([p[1][k] for p in parts])) for k in ob},
+                _readonly_view(np.concatenate([p[2] for p in parts])),
+                {k: _readonly_view(np.concatenate([p[3][k] for p in parts])) for k in info},
+            )
+        first, ob, rew, info = self._buffer_sets[runs[0][2]]["views"]
+        if (start, stop) == (0, self.num):
+            return first, ob, rew, info
+        return (
+            first[start:stop],
+            {k: v[start:stop] for k, v in ob.items()},
+            rew[start:stop],
+            {k: v[start:stop] for k, v in info.items()},
+        )
 
-        # Keep references alive
-        self._buf_refs = (ob_ptr_arr, ac_ptr_arr, info_ptr_arr, bufs)
-        self._lib.libenv_set_buffers(self._handle, ctypes.byref(bufs))
+    def act_into(self, idx):
+        """Step the environments with the actions already in the action buffer, writing into buffer set ``idx``."""
+        self.use_buffer_set(idx)
+        self._lib.libenv_act(self._handle)
 
     def act(self, action):
         """Write actions and step the environments."""
         self._ac_bufs["action"][:] = action
+        if not self.copy:
+            self._swap_buffer_sets(0, self.num)
         self._lib.libenv_act(self._handle)
 
     def observe(self):
-        """Read observations, rewards, and firsts from the C side."""
+        """
+        Read observations, rewards, and firsts from the C side.
+
+        Returns copies of the buffers, or read-only views into the buffer set
+        that was stepped into when the library was created with ``copy=False``.
+        """
         self._lib.libenv_observe(self._handle)
+        if not self.copy:
+            return self._views(0, self.num)
         return (
             self._first_buf.copy(),
             {k: v.copy() for k, v in self._ob_bufs.items()},
@@ -350,6 +497,62 @@ class CLibenv:
             {k: v.copy() for k, v in self._info_bufs.items()},
         )
 
+    def wait(self):
+        """Wait for the environments to finish stepping without reading their outputs."""
+        self._lib.libenv_observe(self._handle)
+
+    def act_range(self, action, start, stop):
+        """
+        Write actions for environments ``[start, stop)`` and step only those.
+
+        Returns immediately when the library has stepping threads, use
+        :meth:`observe_range` to wait for the results.
+        """
+        self._ac_bufs["action"][start:stop] = action
+        if not self.copy:
+            self._swap_buffer_sets(start, stop)
+        self.call_c_func("act_range", start, stop)
+
+    def observe_range(self, start, stop):
+        """
+        Wait for environments ``[start, stop)`` and read their outputs.
+
+        With ``copy=False`` these are views like those of :meth:`observe`,
+        which stay valid until the same environments are stepped twice more.
+        """
+        self.call_c_func("observe_range", start, stop)
+        if not self.copy:
+            return self._views(start, stop)
+        return (
+            self._first_buf[start:stop].copy(),
+            {k: v[start:stop].copy() for k, v in self._ob_bufs.items()},
+            self._rew_buf[start:stop].copy(),
+            {k: v[start:stop].copy() for k, v in self._info_bufs.items()},
+        )
+
+    def rollout(self, actions, ob_bufs, info_bufs, rew, first):
+        """
+        Step the environments once for every row of ``actions`` in a single call.
+
+        The outputs of step ``t`` are written to row ``t`` of the step major
+        ``(num_steps, num, ...)`` arrays, which must be C contiguous. Afterwards
+        the output buffers hold the last step, as if it had been taken with
+        :meth:`act`.
+        """
+        if not self.copy:
+            # same as act(), keep the views handed out for the previous step intact
+            self._swap_buffer_sets(0, self.num)
+        ob_ptrs = (ctypes.c_void_p * len(self._ob_types))(
+            *[ob_bufs[tt["name"]].ctypes.data for tt in self._ob_types]
+        )
+        info_ptrs = (ctypes.c_void_p * len(self._info_types))(
+            *[info_bufs[tt["name"]].ctypes.data for tt in self._info_types]
+        )
+        self.call_c_func(
+            "rollout", actions.ctypes.data, len(actions), ob_ptrs, info_ptrs,
+            rew.ctypes.data, first.ctypes.data,
+        )
+
     def get_ob_bufs(self):
         """Return current observation buffers without copying."""
         return self._ob_bufs
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Level generation latency profiler.
+
+Sweeps a range of level seeds for each game and distribution mode, times the
+generation of every level and reports the latency distribution along with the
+slowest seeds. Slow seeds come from the retry loops in level generation and
+stall a whole batch while the other environments wait for them, so the report
+shows which levels are worth excluding or pre-generating with the level cache.
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from .bench import supported_distribution_modes
+from .env import ENV_NAMES, ProcgenVecEnv
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def profile_resets(
+    env_name,
+    distribution_mode="hard",
+    start_seed=0,
+    num_seeds=1000,
+    repeats=3,
+    num_worst=10,
+):
+    """
+    Time level generation for seeds ``start_seed`` to ``start_seed + num_seeds - 1``.
+
+    Every seed is generated ``repeats`` times and the fastest time is kept,
+    which filters out most of the noise from the rest of the system.
+
+    Returns:
+        dict with the configuration, the latency percentiles, mean and max in
+        ms, and ``worst`` listing the slowest seeds with their latency
+    """
+    assert num_seeds > 0 and repeats > 0
+    seeds = np.arange(start_seed, start_seed + num_seeds, dtype=np.int64)
+    assert seeds[-1] < 2 ** 31, "level seeds must fit in an int32"
+
+    env = ProcgenVecEnv(num_envs=1, env_name=env_name, distribution_mode=distribution_mode)
+    try:
+        latencies = env.time_level_resets(seeds)
+        for _ in range(repeats - 1):
+            latencies = np.minimum(latencies, env.time_level_resets(seeds))
+    finally:
+        env.close()
+
+    latencies_ms = latencies * 1000
+    # stable so that ties keep the lower seed first
+    worst = np.argsort(-latencies_ms, kind="stable")[:num_worst]
+    result = {
+        "env_name": env_name,
+        "distribution_mode": distribution_mode,
+        "start_seed": start_seed,
+        "num_seeds": num_seeds,
+        "repeats": repeats,
+        "mean_ms": float(latencies_ms.mean()),
+        "max_ms": float(latencies_ms.max()),
+    }
+    for q in PERCENTILES:
+        result[f"p{q:g}_ms"] = float(np.percentile(latencies_ms, q))
+    result["worst"] = [{"seed": int(seeds[i]), "latency_ms": float(latencies_ms[i])} for i in worst]
+    return result
+
+
+def format_result(result):
+    """Human readable summary of a result, one line followed by the worst seeds."""
+    percentiles = " ".join(f"p{q:g}={result[f'p{q:g}_ms']:.3f}ms" for q in PERCENTILES)
+    lines = [
+        f"{result['env_name']:>10} {result['distribution_mode']:>11} "
+        f"seeds={result['start_seed']}..{result['start_seed'] + result['num_seeds'] - 1}  "
+        f"mean={result['mean_ms']:.3f}ms {percentiles} max={result['max_ms']:.3f}ms"
+    ]
+    if result["worst"]:
+        worst = ", ".join(f"{w['seed']} ({w['latency_ms']:.3f}ms)" for w in result["worst"])
+        lines.append(f"{'':>10} worst seeds: {worst}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    default_str = "(default: %(default)s)"
+    parser = argparse.ArgumentParser(
+        description="Profile level generation latency across level seeds"
+    )
+    parser.add_argument(
+        "--env-names",
+        nargs="+",
+        default=ENV_NAMES,
+        choices=ENV_NAMES,
+        metavar="ENV_NAME",
+        help="games to profile (default: all)",
+    )
+    parser.add_argument(
+        "--distribution-modes",
+        nargs="+",
+        default=["easy", "hard"],
+        help="distribution modes to profile, unsupported ones are skipped per game " + default_str,
+    )
+    parser.add_argument("--start-seed", type=int, default=0, help="first level seed " + default_str)
+    parser.add_argument(
+        "--num-seeds", type=int, default=1000, help="number of consecutive level seeds " + default_str
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="times each seed is generated, the fastest is kept " + default_str
+    )
+    parser.add_argument(
+        "--num-worst", type=int, default=10, help="number of slowest seeds to list " + default_str
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+
+    args = parser.parse_args(argv)
+
+    results = []
+    for env_name in args.env_names:
+        modes = [m for m in supported_distribution_modes(env_name) if m in args.distribution_modes]
+        for mode in modes:
+            result = profile_resets(
+                env_name,
+                distribution_mode=mode,
+                start_seed=args.start_seed,
+                num_seeds=args.num_seeds,
+                repeats=args.repeats,
+                num_worst=args.num_worst,
+            )
+            print(format_result(result))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+Multi-process sharded vector environment.
+
+Splits ``num_envs`` environments over several worker processes, each owning
+its own :class:`~procgen_gym.env.ProcgenVecEnv` (and therefore its own C++
+``VecGame``). Workers write observations, rewards, terminations and infos
+straight into ``multiprocessing.shared_memory`` blocks, so the parent sees one
+contiguous batch and the per-step path only exchanges single-byte commands.
+"""
+
+import multiprocessing as mp
+import traceback
+from multiprocessing import shared_memory
+from typing import Optional
+
+import gymnasium as gym
+import numpy as np
+from gymnasium import spaces
+from gymnasium.error import AlreadyPendingCallError, NoAsyncCallError
+from gymnasium.vector.utils import batch_space
+
+from .env import KEY_COMBOS, ProcgenVecEnv, create_random_seed
+
+# commands sent from the parent to the workers, a step is followed by the
+# index of the buffer set to write into
+_CMD_STEP = b"s"
+_CMD_RESET = b"r"
+_CMD_CLOSE = b"c"
+
+# replies sent from the workers to the parent, an error is followed by the
+# formatted traceback
+_REPLY_DONE = b"d"
+_REPLY_ERROR = b"e"
+
+
+def _attach(name, shape, dtype, start, stop):
+    """Attach to a shared memory block and return it with a view of rows [start, stop)."""
+    shm = shared_memory.SharedMemory(name=name, track=False)
+    arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return shm, arr[start:stop]
+
+
+def _worker(conn, env_kwargs):
+    """Worker process main loop, owns one ProcgenVecEnv shard."""
+    blocks = []
+    env = None
+    initialized = False
+    try:
+        env = ProcgenVecEnv(**env_kwargs)
+        obs, info = env.reset()
+        conn.send({
+            "obs": (obs.shape[1:], obs.dtype.str),
+            "info": {k: (v.shape[1:], v.dtype.str) for k, v in info.items()},
+        })
+        initialized = True
+
+        layout = conn.recv()
+        start, stop = layout["start"], layout["stop"]
+
+        shm, actions = _attach(*layout["actions"], start, stop)
+        blocks.append(shm)
+        buffer_sets = []
+        for arrays in layout["buffer_sets"]:
+            views = {}
+            for key, spec in arrays.items():
+                shm, views[key] = _attach(*spec, start, stop)
+                blocks.append(shm)
+            buffer_sets.append(views)
+
+        # the C++ side reads the actions from and writes its outputs straight into shared memory
+        env.set_output_buffers(actions, [
+            {
+                "obs": views["obs"],
+                "reward": views["rew"],
+                "terminated": views["terminated"],
+                "info": {k[len("info/"):]: v for k, v in views.items() if k.startswith("info/")},
+            }
+            for views in buffer_sets
+        ])
+
+        def write_reset(views, outputs):
+            # a reset repeats the latest observation and infos, without reward or termination
+            for key, v in outputs.items():
+                if key not in ("rew", "terminated"):
+                    np.copyto(views[key], v)
+            views["rew"].fill(0)
+            views["terminated"].fill(False)
+
+        outputs = {"obs": obs, **{"info/" + k: v for k, v in info.items()}}
+        write_reset(buffer_sets[0], outputs)
+        latest = 0
+        conn.send_bytes(_REPLY_DONE)
+
+        while True:
+            cmd = conn.recv_bytes()
+            if cmd[:1] == _CMD_STEP:
+                env.step_into(cmd[1])
+                latest = cmd[1]
+            elif cmd[:1] == _CMD_RESET:
+                write_reset(buffer_sets[cmd[1]], buffer_sets[latest])
+                latest = cmd[1]
+            elif cmd[:1] == _CMD_CLOSE:
+                break
+            conn.send_bytes(_REPLY_DONE)
+    except Exception:
+        message = traceback.format_exc()
+        if initialized:
+            conn.send_bytes(_REPLY_ERROR + message.encode("utf-8"))
+        else:
+            conn.send({"error": message})
+    finally:
+        if env is not None:
+            env.close()
+        # drop the views, the env's included, before closing the blocks they point into
+        env = actions = buffer_sets = views = outputs = None
+        for shm in blocks:
+            shm.close()
+        conn.close()
+
+
+class ProcgenShardedVecEnv(gym.vector.VectorEnv):
+    """
+    Vector environment that spreads ``num_envs`` procgen environments over
+    ``num_workers`` processes.
+
+    Each worker owns a :class:`~procgen_gym.env.ProcgenVecEnv` for a
+    contiguous shard of the batch and writes its outputs into shared memory,
+    which avoids the GIL and the process-wide C++ state of a single
+    ``ProcgenVecEnv``. Shard ``i`` is seeded with ``rand_seed + i``.
+
+    With ``copy=False`` the arrays returned by :meth:`reset` and :meth:`step`
+    are read-only views into double-buffered shared memory, valid until the
+    second :meth:`reset` or :meth:`step` call after the one that produced
+    them.
+
+    Any other keyword arguments are passed to every shard's ``ProcgenVecEnv``.
+    ``num_threads`` defaults to ``0`` since the workers already run in
+    parallel. Rendering and state save/load are not supported.
+    """
+
+    metadata = {
+        "render_modes": [],
+        "autoreset_mode": gym.vector.AutoresetMode.NEXT_STEP,
+    }
+
+    def __init__(
+        self,
+        num_envs: int = 2,
+        num_workers: int = 2,
+        env_name: str = "coinrun",
+        rand_seed: Optional[int] = None,
+        copy: bool = True,
+        context: Optional[str] = None,
+        **kwargs,
+    ):
+        assert 1 <= num_workers <= num_envs, "num_workers must be between 1 and num_envs"
+        assert kwargs.get("render_mode") is None, "ProcgenShardedVecEnv does not support rendering"
+
+        if rand_seed is None:
+            rand_seed = create_random_seed()
+        kwargs.setdefault("num_threads", 0)
+
+        self._closed = False
+        self._copy = copy
+        self._blocks = []
+        self._processes = []
+        self._conns = []
+        self._step_pending = False
+
+        shard_sizes = [len(shard) for shard in np.array_split(np.arange(num_envs), num_workers)]
+        bounds = np.concatenate([[0], np.cumsum(shard_sizes)])
+
+        ctx = mp.get_context(context or "spawn")
+        for i, shard_size in enumerate(shard_sizes):
+            parent_conn, child_conn = ctx.Pipe()
+            env_kwargs = dict(kwargs, num_envs=shard_size, env_name=env_name, rand_seed=rand_seed + i)
+            process = ctx.Process(target=_worker, args=(child_conn, env_kwargs), daemon=True)
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._conns.append(parent_conn)
+
+        try:
+            specs = [self._recv_spec(conn) for conn in self._conns]
+            obs_shape, obs_dtype = specs[0]["obs"]
+
+            self._actions, actions_spec = self._create_array((num_envs,), np.int32)
+            self._buffer_sets = []
+            buffer_set_specs = []
+            for _ in range(1 if copy else 2):
+                arrays, array_specs = {}, {}
+                shapes = {
+                    "obs": ((num_envs,) + obs_shape, obs_dtype),
+                    "rew": ((num_envs,), np.float32),
+                    "terminated": ((num_envs,), bool),
+                }
+                for k, (shape, dtype) in specs[0]["info"].items():
+                    shapes["info/" + k] = ((num_envs,) + shape, dtype)
+                for key, (shape, dtype) in shapes.items():
+                    arrays[key], array_specs[key] = self._create_array(shape, dtype)
+                self._buffer_sets.append(arrays)
+                buffer_set_specs.append(array_specs)
+
+            for i, conn in enumerate(self._conns):
+                conn.send({
+                    "start": int(bounds[i]),
+                    "stop": int(bounds[i + 1]),
+                    "actions": actions_spec,
+                    "buffer_sets": buffer_set_specs,
+                })
+            self._wait_all()
+        except BaseException:
+            self.close()
+            raise
+
+        self._active = 0
+        self._views = [
+            {k: self._readonly(v) for k, v in arrays.items()} for arrays in self._buffer_sets
+        ]
+
+        super().__init__()
+
+        self.num_envs = num_envs
+        self.num_workers = num_workers
+        self.render_mode = None
+
+        self.single_observation_space = spaces.Box(
+            low=0, high=255, shape=obs_shape, dtype=np.uint8
+        )
+        self.single_action_space = spaces.Discrete(len(KEY_COMBOS))
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+    def _create_array(self, shape, dtype):
+        """Allocate a zeroed shared memory block, return an array backed by it and its spec."""
+        dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._blocks.append(shm)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        arr.fill(0)
+        return arr, (shm.name, shape, dtype.str)
+
+    @staticmethod
+    def _readonly(arr):
+        view = arr.view()
+        view.flags.writeable = False
+        return view
+
+    @staticmethod
+    def _recv_spec(conn):
+        spec = conn.recv()
+        if "error" in spec:
+            raise RuntimeError("procgen worker failed:\n" + spec["error"])
+        return spec
+
+    def _wait_all(self):
+        # read every reply before raising, so the workers that succeeded don't leave a reply
+        # behind for the next command
+        errors = []
+        for i, conn in enumerate(self._conns):
+            reply = conn.recv_bytes()
+            if reply[:1] == _REPLY_ERROR:
+                errors.append(f"worker {i}:\n" + reply[1:].decode("utf-8"))
+        if errors:
+            raise RuntimeError("procgen worker failed:\n" + "\n".join(errors))
+
+    def _send_all(self, cmd):
+        for conn in self._conns:
+            conn.send_bytes(cmd)
+
+    def _result(self):
+        arrays = self._views[self._active] if not self._copy else self._buffer_sets[self._active]
+        info = {k[len("info/"):]: v for k, v in arrays.items() if k.startswith("info/")}
+        if self._copy:
+            return (
+                arrays["obs"].copy(),
+                arrays["rew"].copy(),
+                arrays["terminated"].copy(),
+                {k: v.copy() for k, v in info.items()},
+            )
+        return arrays["obs"], arrays["rew"], arrays["terminated"], info
+
+    def reset(
+        self,
+        seed: Optional[int] = None,
+        options: Optional[dict] = None,
+    ):
+        """
+        Observe the current state. Procgen environments auto-reset
+        internally, so this returns the current observation.
+        """
+        if self._step_pending:
+            self.step_wait()
+        if not self._copy:
+            # like a step, write into the other buffer set so earlier views stay valid
+            self._active = 1 - self._active
+        self._send_all(_CMD_RESET + bytes([self._active]))
+        self._wait_all()
+        obs, _rew, _terminated, info = self._result()
+        return obs, info
+
+    def step(self, actions):
+        """Step all environments with the given actions."""
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions):
+        """Start stepping all environments and return without waiting."""
+        if self._step_pending:
+            raise AlreadyPendingCallError(
+                "Calling `step_async` while waiting for a pending call to `step` to complete.",
+                "step",
+            )
+        self._actions[:] = actions
+        if not self._copy:
+            self._active = 1 - self._active
+        self._send_all(_CMD_STEP + bytes([self._active]))
+        self._step_pending = True
+
+    def step_wait(self):
+        """Wait for the step started by :meth:`step_async` to complete."""
+        if not self._step_pending:
+            raise NoAsyncCallError("Calling `step_wait` without any prior call to `step_async`.", "step")
+        self._step_pending = False
+        self._wait_all()
+        obs, rew, terminated, info = self._result()
+        # Procgen doesn't distinguish truncation from termination
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        return obs, rew, terminated, truncated, info
+
+    def close(self):
+        """Stop the workers and release the shared memory."""
+        if self._closed:
+            return
+        self._closed = True
+
+        for conn in self._conns:
+            try:
+                conn.send_bytes(_CMD_CLOSE)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._conns:
+            conn.close()
+
+        self._views = []
+        self._buffer_sets = []
+        self._actions = None
+        for shm in self._blocks:
+            try:
+                shm.close()
+            except BufferError:
+                # arrays handed out with copy=False still point into the block, it is
+                # released once they are garbage collected
+                pass
+            shm.unlink()
+        self._blocks = []
@@ -2,6 +2,7 @@
 #include "resources.h"
 #include "assetgen.h"
 #include "qt-utils.h"
+#include "fast-painter.h"
 
 const float MAXVTHETA = 15 * PI / 180;
 const float MIXRATEROT = 0.5f;
@@ -19,6 +20,16 @@ const int USE_ASSET_THRESHOLD = 100;
 const int MAX_ASSETS = USE_ASSET_THRESHOLD;
 const int MAX_IMAGE_THEMES = 10;
 
+// with cache_static_tiles, frames the view has to stay at a new sub-pixel position before the
+// tile layer is drawn again there, scrolling views are drawn without the layer until then
+const int TILE_LAYER_SETTLE_FRAMES = 32;
+// size in pixels of the blocks of the tile layer whose cells are drawn directly
+const int TILE_LAYER_BLOCK = 8;
+// levels whose tile layer has more than this fraction of blocks drawn directly are drawn
+// without the layer. With Qt, chaser (about 40% of the blocks) and fruitbot (about 60%) render
+// slower with the layer than without it, miner (about 15%) still renders faster
+const float TILE_LAYER_MAX_DIRECT_BLOCKS = 0.25f;
+
 BasicAbstractGame::BasicAbstractGame(std::string name)
     : Game(name) {
     char_dim = 5;
@@ -118,14 +129,18 @@ void BasicAbstractGame::initialize_asset_if_necessary(int img_idx) {
     asset_aspect_ratios[img_idx] = aspect_ratio;
     asset_num_themes[type] = num_themes;
 
-    std::shared_ptr<QImage> reflection_ptr(new QImage(asset_ptr->mirrored(true, false)));
-    basic_reflections[img_idx] = reflection_ptr;
+    if (names.size() == 0) {
+        std::shared_ptr<QImage> reflection_ptr(new QImage(asset_ptr->mirrored(true, false)));
+        basic_reflections[img_idx] = reflection_ptr;
+    } else {
+        basic_reflections[img_idx] = get_reflected_asset_ptr(names[theme]);
+    }
 }
 
 void BasicAbstractGame::fill_elem(int x, int y, int dx, int dy, char elem) {
     for (int j = 0; j < dx; j++) {
         for (int k = 0; k < dy; k++) {
-            grid.set(x + j, y + k, elem);
+            set_obj(x + j, y + k, elem);
         }
     }
 }
@@ -159,6 +174,7 @@ void BasicAbstractGame::check_grid_collisions(const std::shared_ptr<Entity> &ent
 
             if (grid_type != SPACE) {
                 handle_grid_collision(ent, grid_type, x, y);
+                entity_grid_stale = true;
             }
         }
     }
@@ -215,17 +231,69 @@ std::vector<int> BasicAbstractGame::get_cells_with_type(int type) {
 }
 
 void BasicAbstractGame::set_obj(int idx, int elem) {
+    if (track_grid_changes || options.cache_static_tiles) {
+        record_grid_change(idx, elem);
+    }
     grid.set_index(idx, elem);
 }
 
 void BasicAbstractGame::set_obj(int x, int y, int elem) {
+    if (track_grid_changes || options.cache_static_tiles) {
+        fassert(grid.contains(x, y));
+        record_grid_change(grid.to_index(x, y), elem);
+    }
     grid.set(x, y, elem);
 }
 
+void BasicAbstractGame::record_grid_change(int idx, int elem) {
+    int prev = grid.get_index(idx);
+    if (prev == elem) {
+        return;
+    }
+    if (track_grid_changes) {
+        fassert(elem >= 0);
+        if (elem >= (int)(obj_counts.size())) {
+            obj_counts.resize(elem + 1);
+        }
+        obj_counts[prev]--;
+        obj_counts[elem]++;
+        changed_cells.push_back(idx);
+    }
+    // an invalid layer is drawn from scratch anyway
+    if (tile_layer_valid && !tile_layer_marks[idx]) {
+        tile_layer_marks[idx] = 1;
+        tile_layer_dirty.push_back(idx);
+    }
+}
+
+void BasicAbstractGame::reset_grid_tracking() {
+    if (!track_grid_changes) {
+        return;
+    }
+    changed_cells.clear();
+    all_cells_changed = true;
+    obj_counts.clear();
+    for (int type : grid.data) {
+        fassert(type >= 0);
+        if (type >= (int)(obj_counts.size())) {
+            obj_counts.resize(type + 1);
+        }
+        obj_counts[type]++;
+    }
+}
+
+int BasicAbstractGame::count_obj(int type) {
+    fassert(track_grid_changes);
+    if (type < 0 || type >= (int)(obj_counts.size())) {
+        return 0;
+    }
+    return obj_counts[type];
+}
+
 std::shared_ptr<Entity> BasicAbstractGame::spawn_child(const std::shared_ptr<Entity> &src, int type, float obj_r, bool match_vel) {
     float vx = match_vel ? src->vx : 0;
     float vy = match_vel ? src->vy : 0;
-    auto child = std::make_shared<Entity>(src->x, src->y, vx, vy, obj_r, type);
+    auto child = new_entity(src->x, src->y, vx, vy, obj_r, type);
     entities.push_back(child);
     return child;
 }
@@ -335,34 +403,34 @@ bool BasicAbstractGame::sub_step(const std::shared_ptr<Entity> &obj, float _vx,
     bool block2 = false;
 
     for (int i = (int)(entities.size()) - 1; i >= 0; i--) {
-        auto m = entities[i];
+        const auto &other = entities[i];
 
-        if (m == obj || m->will_erase) {
+        if (other == obj || other->will_erase || !has_collision(obj, other, POS_EPS)) {
             continue;
         }
 
+        // hold a reference of our own, the callbacks below may add entities
+        auto m = other;
         bool curr_block = false;
 
-        if (has_collision(obj, m, POS_EPS)) {
-            if (is_blocked_ents(obj, m, is_horizontal)) {
-                curr_block = true;
-            } else if (will_reflect(obj->type, m->type)) {
-                if (is_horizontal) {
-                    float delx = m->x - obj->x;
-                    float rsum = m->rx + obj->rx;
-                    obj->x += _vx > 0 ? -2 * (rsum - delx) : 2 * (rsum + delx);
-                    obj->vx = -1 * obj->vx;
-                } else {
-                    float dely = m->y - obj->y;
-                    float rsum = m->ry + obj->ry;
-                    obj->y += _vy > 0 ? -2 * (rsum - dely) : 2 * (rsum + dely);
-                    obj->vy = -1 * obj->vy;
-                }
+        if (is_blocked_ents(obj, m, is_horizontal)) {
+            curr_block = true;
+        } else if (will_reflect(obj->type, m->type)) {
+            if (is_horizontal) {
+                float delx = m->x - obj->x;
+                float rsum = m->rx + obj->rx;
+                obj->x += _vx > 0 ? -2 * (rsum - delx) : 2 * (rsum + delx);
+                obj->vx = -1 * obj->vx;
+            } else {
+                float dely = m->y - obj->y;
+                float rsum = m->ry + obj->ry;
+                obj->y += _vy > 0 ? -2 * (rsum - dely) : 2 * (rsum + dely);
+                obj->vy = -1 * obj->vy;
             }
+        }
 
-            if (curr_block) {
-                push_obj(m, obj, is_horizontal, depth);
-            }
+        if (curr_block) {
+            push_obj(m, obj, is_horizontal, depth);
         }
 
         block2 = block2 || curr_block;
@@ -509,7 +577,7 @@ float BasicAbstractGame::get_agent_acceleration_scale() {
 */
 
 std::shared_ptr<Entity> BasicAbstractGame::spawn_entity_rxy(float rx, float ry, int type, float x, float y, float w, float h, bool check_collisions) {
-    std::shared_ptr<Entity> ent(new Entity(0, 0, 0, 0, rx, ry, type));
+    auto ent = new_entity(0, 0, 0, 0, rx, ry, type);
 
     reposition(ent, x, y, w, h, check_collisions);
 
@@ -519,7 +587,7 @@ std::shared_ptr<Entity> BasicAbstractGame::spawn_entity_rxy(float rx, float ry,
 }
 
 bool BasicAbstractGame::agent_has_collision() {
-    for (auto ent : entities) {
+    for (const auto &ent : entities) {
         if (has_agent_collision(ent)) {
             return true;
         }
@@ -564,13 +632,13 @@ std::shared_ptr<Entity> BasicAbstractGame::spawn_entity(float r, int type, float
 }
 
 std::shared_ptr<Entity> BasicAbstractGame::add_entity(float x, float y, float vx, float vy, float r, int type) {
-    std::shared_ptr<Entity> ent(new Entity(x, y, vx, vy, r, r, type));
+    auto ent = new_entity(x, y, vx, vy, r, r, type);
     entities.push_back(ent);
     return ent;
 }
 
 std::shared_ptr<Entity> BasicAbstractGame::add_entity_rxy(float x, float y, float vx, float vy, float rx, float ry, int type) {
-    std::shared_ptr<Entity> ent(new Entity(x, y, vx, vy, rx, ry, type));
+    auto ent = new_entity(x, y, vx, vy, rx, ry, type);
     entities.push_back(ent);
     return ent;
 }
@@ -716,21 +784,30 @@ void BasicAbstractGame::game_step() {
 
     step_entities(entities);
 
+    entity_grid_stale = true;
+
     for (int i = (int)(entities.size()) - 1; i >= 0; i--) {
         auto ent = entities[i];
 
         if (has_agent_collision(ent)) {
             handle_agent_collision(ent);
+            entity_grid_stale = true;
         }
 
         if (ent->collides_with_entities) {
-            for (int j = (int)(entities.size()) - 1; j >= 0; j--) {
-                if (i == j)
-                    continue;
-                auto ent2 = entities[j];
-
-                if (has_collision(ent, ent2, ent->collision_margin) && !ent->will_erase && !ent2->will_erase) {
-                    handle_collision(ent, ent2);
+            if (use_entity_grid()) {
+                handle_entity_collisions(i, ent);
+            } else {
+                for (int j = (int)(entities.size()) - 1; j >= 0; j--) {
+                    if (i == j)
+                        continue;
+                    const auto &other = entities[j];
+
+                    if (has_collision(ent, other, ent->collision_margin) && !ent->will_erase && !other->will_erase) {
+                        // hold a reference of our own, handle_collision() may add entities
+                        auto ent2 = other;
+                        handle_collision(ent, ent2);
+                    }
                 }
             }
         }
@@ -746,13 +823,21 @@ void BasicAbstractGame::game_step() {
 }
 
 void BasicAbstractGame::erase_if_needed() {
-    for (int i = (int)(entities.size()) - 1; i >= 0; i--) {
-        auto e = entities[i];
+    // compact in a single pass, keeping the order of the remaining entities
+    size_t kept = 0;
+    for (size_t i = 0; i < entities.size(); i++) {
+        const auto &e = entities[i];
 
         if (e->will_erase || (e->auto_erase && is_out_of_bounds(e))) {
-            entities.erase(entities.begin() + i);
+            continue;
         }
+
+        if (kept != i) {
+            entities[kept] = std::move(entities[i]);
+        }
+        kept++;
     }
+    entities.resize(kept);
 }
 
 void BasicAbstractGame::game_reset() {
@@ -761,8 +846,12 @@ void BasicAbstractGame::game_reset() {
 
     bg_pct_x = rand_gen.rand01();
 
+    // the layer is drawn from scratch for the new level
+    tile_layer_valid = false;
+
     grid_size = main_width * main_height;
     grid.resize(main_width, main_height);
+    reset_grid_tracking();
 
     background_index = rand_gen.randn((int)(main_bg_images_ptr->size()));
 
@@ -785,7 +874,7 @@ void BasicAbstractGame::game_reset() {
         ay = a_r;
     }
 
-    auto _agent = std::make_shared<Entity>(ax, ay, 0, 0, a_r, PLAYER);
+    auto _agent = new_entity(ax, ay, 0, 0, a_r, PLAYER);
     agent = _agent;
     agent->smart_step = true;
     agent->render_z = 1;
@@ -837,7 +926,7 @@ void BasicAbstractGame::prepare_for_drawing(float rect_height) {
     y_off = unit * (center_y - view_dim / 2);
 }
 
-void BasicAbstractGame::tile_image(QPainter &p, QImage *image, const QRectF &rect, float tile_ratio) {
+void BasicAbstractGame::tile_image(Painter &p, QImage *image, const QRectF &rect, float tile_ratio) {
     if (tile_ratio != 0) {
         if (tile_ratio < 0) {
             tile_ratio = -1 * tile_ratio;
@@ -849,7 +938,7 @@ void BasicAbstractGame::tile_image(QPainter &p, QImage *image, const QRectF &rec
 
             for (int i = 0; i < num_tiles; i++) {
                 QRectF tile_rect = QRectF(rect.x(), rect.y() + tile_height * i, tile_width, tile_height);
-                p.drawImage(tile_rect, *image);
+                draw_scaled_image(p, image, tile_rect);
             }
         } else {
             int num_tiles = int(rect.width() / (rect.height() * tile_ratio));
@@ -860,21 +949,38 @@ void BasicAbstractGame::tile_image(QPainter &p, QImage *image, const QRectF &rec
 
             for (int i = 0; i < num_tiles; i++) {
                 QRectF tile_rect = QRectF(rect.x() + tile_width * i, rect.y(), tile_width, tile_height);
-                p.drawImage(tile_rect, *image);
+                draw_scaled_image(p, image, tile_rect);
             }
         }
     } else {
-        p.drawImage(rect, *image);
+        draw_scaled_image(p, image, rect);
     }
 }
 
+void BasicAbstractGame::draw_scaled_image(Painter &p, QImage *image, const QRectF &rect) {
+    // pre-scaled images are sampled like the unsmoothed painter, so they don't fit antialiased renders.
+    // Images much larger than the observation are backgrounds, which usually scroll and would need
+    // a new scaled image for every frame
+    bool is_small = rect.width() <= 2 * RES_W && rect.height() <= 2 * RES_H;
+    if (options.cache_scaled_sprites && !render_antialias && is_small) {
+        QPoint offset;
+        auto scaled = get_scaled_image_ptr(image, options.render_backend, rect, &offset);
+        if (scaled != nullptr) {
+            p.drawImage(QPointF(offset.x(), offset.y()), *scaled);
+            return;
+        }
+    }
+
+    p.drawImage(rect, *image);
+}
+
 QImage *BasicAbstractGame::lookup_asset(int img_idx, bool is_reflected) {
     initialize_asset_if_necessary(img_idx);
     auto assets = is_reflected ? &basic_reflections : &basic_assets;
     return assets->at(img_idx).get();
 }
 
-void BasicAbstractGame::draw_image(QPainter &p, QRectF &base_rect, float rotation, bool is_reflected, int base_type, int theme, float alpha, float tile_ratio) {
+void BasicAbstractGame::draw_image(Painter &p, QRectF &base_rect, float rotation, bool is_reflected, int base_type, int theme, float alpha, float tile_ratio) {
     int img_type = image_for_type(base_type);
 
     if (img_type < 0) {
@@ -912,13 +1018,295 @@ void BasicAbstractGame::draw_image(QPainter &p, QRectF &base_rect, float rotatio
     }
 }
 
-void BasicAbstractGame::draw_grid_obj(QPainter &p, const QRectF &rect, int type, int theme) {
+void BasicAbstractGame::draw_grid_obj(Painter &p, const QRectF &rect, int type, int theme) {
     if (type == SPACE)
         return;
     p.fillRect(rect, color_for_type(type, theme));
 }
 
-void BasicAbstractGame::draw_foreground(QPainter &p, const QRect &rect) {
+QRectF BasicAbstractGame::get_tile_layer_rect(int x, int y) {
+    // the rect the uncached loop draws the cell at, moved by whole pixels onto the layer
+    QRectF r = get_screen_rect(x, y + 1, 1, 1, RENDER_EPS);
+    return r.translated(-tile_layer_x, -tile_layer_y);
+}
+
+void BasicAbstractGame::draw_tile_layer_cell(Painter &p, int x, int y) {
+    int type = get_obj(x, y);
+
+    if (type == INVALID_OBJ) {
+        return;
+    }
+
+    int theme = theme_for_grid_obj(type);
+
+    QRectF r2 = get_tile_layer_rect(x, y);
+
+    draw_image(p, r2, 0, false, type, theme, 1.0, 0.0);
+}
+
+void BasicAbstractGame::draw_grid_cell(Painter &p, int x, int y) {
+    int type = get_obj(x, y);
+
+    if (type == INVALID_OBJ) {
+        return;
+    }
+
+    int theme = theme_for_grid_obj(type);
+
+    QRectF r2 = get_screen_rect(x, y + 1, 1, 1, RENDER_EPS);
+
+    draw_image(p, r2, 0, false, type, theme, 1.0, 0.0);
+}
+
+void BasicAbstractGame::rebuild_tile_layer() {
+    tile_layer_unit = unit;
+    tile_layer_pad = int(ceil(RENDER_EPS * unit)) + 1;
+    // cells outside of the grid that draw_foreground() can show, see the margin there
+    tile_layer_border = options.center_agent ? int(visibility / 2.0 + 1) + 1 : 0;
+
+    // the layer keeps the sub-pixel position of the cells in this frame
+    get_tile_layer_edges(tile_layer_lefts, tile_layer_tops);
+    tile_layer_x = int(floor(tile_layer_lefts.front())) - tile_layer_pad;
+    tile_layer_y = int(floor(tile_layer_tops.back())) - tile_layer_pad;
+    for (double &left : tile_layer_lefts) {
+        left -= tile_layer_x;
+    }
+    for (double &top : tile_layer_tops) {
+        top -= tile_layer_y;
+    }
+
+    double dim = (1 + 2 * RENDER_EPS) * unit;
+    int w = int(ceil(tile_layer_lefts.back() + dim)) + tile_layer_pad + 1;
+    int h = int(ceil(tile_layer_tops.front() + dim)) + tile_layer_pad + 1;
+
+    if (tile_layer.width() != w || tile_layer.height() != h) {
+        tile_layer = QImage(w, h, QImage::Format_ARGB32_Premultiplied);
+        // same format as the observations, so that cells blend the same way as they do there
+        tile_layer_black = QImage(w, h, QImage::Format_RGB32);
+        tile_layer_white = QImage(w, h, QImage::Format_RGB32);
+    }
+
+    tile_layer_black.fill(QColor(0, 0, 0));
+    tile_layer_white.fill(QColor(255, 255, 255));
+    tile_layer_blocks_w = (w + TILE_LAYER_BLOCK - 1) / TILE_LAYER_BLOCK;
+    tile_layer_blocks.assign(tile_layer_blocks_w * ((h + TILE_LAYER_BLOCK - 1) / TILE_LAYER_BLOCK), 0);
+    tile_layer_marks.assign(grid_size, 0);
+    tile_layer_dirty.clear();
+    tile_view_still_frames = 0;
+
+    for (QImage *image : {&tile_layer_black, &tile_layer_white}) {
+        std::unique_ptr<Painter> painter = create_painter(image, options.render_backend);
+        Painter &p = *painter;
+
+        // same order as the uncached loop in draw_foreground() so that overlapping edges match
+        for (int x = -tile_layer_border; x < main_width + tile_layer_border; x++) {
+            for (int y = -tile_layer_border; y < main_height + tile_layer_border; y++) {
+                draw_tile_layer_cell(p, x, y);
+            }
+        }
+    }
+
+    update_tile_layer_pixels(QRect(0, 0, w, h));
+
+    int direct_blocks = 0;
+    for (uint8_t flag : tile_layer_blocks) {
+        direct_blocks += flag;
+    }
+    tile_layer_unused = direct_blocks > TILE_LAYER_MAX_DIRECT_BLOCKS * tile_layer_blocks.size();
+
+    tile_layer_valid = true;
+}
+
+void BasicAbstractGame::update_tile_layer_pixels(const QRect &area) {
+    QRect r = area.intersected(tile_layer.rect());
+    if (r.isEmpty()) {
+        return;
+    }
+
+    for (int y = r.top(); y <= r.bottom(); y++) {
+        const uint32_t *black = (const uint32_t *)tile_layer_black.constScanLine(y);
+        const uint32_t *white = (const uint32_t *)tile_layer_white.constScanLine(y);
+        uint32_t *solid = (uint32_t *)tile_layer.scanLine(y);
+
+        for (int x = r.left(); x <= r.right(); x++) {
+            uint32_t color = black[x] & 0xffffff;
+            solid[x] = color == (white[x] & 0xffffff) ? 0xff000000 | color : 0;
+        }
+    }
+
+    // flag the blocks again over their whole area. Any source pixel that isn't fully
+    // transparent changes either black or white, pixels where both are unchanged are not
+    // drawn on and don't need the cells drawn there
+    int bx0 = r.left() / TILE_LAYER_BLOCK;
+    int bx1 = r.right() / TILE_LAYER_BLOCK;
+    int by0 = r.top() / TILE_LAYER_BLOCK;
+    int by1 = r.bottom() / TILE_LAYER_BLOCK;
+    for (int by = by0; by <= by1; by++) {
+        for (int bx = bx0; bx <= bx1; bx++) {
+            QRect block = QRect(bx * TILE_LAYER_BLOCK, by * TILE_LAYER_BLOCK, TILE_LAYER_BLOCK, TILE_LAYER_BLOCK).intersected(tile_layer.rect());
+            bool mixed = false;
+            for (int y = block.top(); y <= block.bottom() && !mixed; y++) {
+                const uint32_t *black = (const uint32_t *)tile_layer_black.constScanLine(y);
+                const uint32_t *white = (const uint32_t *)tile_layer_white.constScanLine(y);
+                const uint32_t *solid = (const uint32_t *)tile_layer.constScanLine(y);
+                for (int x = block.left(); x <= block.right(); x++) {
+                    if (solid[x] == 0 && ((black[x] & 0xffffff) != 0 || (white[x] & 0xffffff) != 0xffffff)) {
+                        mixed = true;
+                        break;
+                    }
+                }
+            }
+            tile_layer_blocks[by * tile_layer_blocks_w + bx] = mixed;
+        }
+    }
+}
+
+void BasicAbstractGame::get_tile_layer_edges(std::vector<double> &lefts, std::vector<double> &tops) {
+    int b = tile_layer_border;
+    lefts.resize(main_width + 2 * b);
+    tops.resize(main_height + 2 * b);
+    for (int x = -b; x < main_width + b; x++) {
+        lefts[x + b] = get_screen_rect(x, 1, 1, 1, RENDER_EPS).x();
+    }
+    for (int y = -b; y < main_height + b; y++) {
+        tops[y + b] = get_screen_rect(0, y + 1, 1, 1, RENDER_EPS).y();
+    }
+}
+
+bool BasicAbstractGame::place_tile_layer() {
+    // the view scrolls by fractions of a pixel and the float math of the screen rects rounds
+    // differently at different offsets, so compare every edge with the layer's
+    std::vector<double> lefts, tops;
+    get_tile_layer_edges(lefts, tops);
+    if (lefts.size() != tile_layer_lefts.size() || tops.size() != tile_layer_tops.size()) {
+        return false;
+    }
+
+    double dx = lefts.front() - tile_layer_lefts.front();
+    double dy = tops.front() - tile_layer_tops.front();
+    if (dx != floor(dx) || dy != floor(dy)) {
+        return false;
+    }
+    for (size_t i = 0; i < lefts.size(); i++) {
+        if (lefts[i] - tile_layer_lefts[i] != dx) {
+            return false;
+        }
+    }
+    for (size_t i = 0; i < tops.size(); i++) {
+        if (tops[i] - tile_layer_tops[i] != dy) {
+            return false;
+        }
+    }
+
+    tile_layer_x = int(dx);
+    tile_layer_y = int(dy);
+    return true;
+}
+
+bool BasicAbstractGame::draw_tile_layer(Painter &p, const QRect &rect, int low_x, int high_x, int low_y, int high_y) {
+    if (!tile_layer_valid || unit != tile_layer_unit) {
+        rebuild_tile_layer();
+    }
+    if (tile_layer_unused) {
+        return false;
+    }
+
+    // tiles drawn at another sub-pixel position cover different pixels, so a view that
+    // scrolls by fractions of a pixel is drawn without the layer
+    if (!place_tile_layer()) {
+        float phase_x = x_off - floor(x_off);
+        float phase_y = y_off - floor(y_off);
+        if (phase_x == tile_view_phase_x && phase_y == tile_view_phase_y) {
+            tile_view_still_frames++;
+        } else {
+            tile_view_phase_x = phase_x;
+            tile_view_phase_y = phase_y;
+            tile_view_still_frames = 1;
+        }
+        if (tile_view_still_frames < TILE_LAYER_SETTLE_FRAMES) {
+            return false;
+        }
+        rebuild_tile_layer();
+    }
+
+    if (tile_layer_dirty.size() > 0) {
+        std::unique_ptr<Painter> black_painter = create_painter(&tile_layer_black, options.render_backend);
+        std::unique_ptr<Painter> white_painter = create_painter(&tile_layer_white, options.render_backend);
+
+        for (int idx : tile_layer_dirty) {
+            tile_layer_marks[idx] = 0;
+
+            int x, y;
+            to_grid_xy(idx, &x, &y);
+
+            // neighbouring cells overlap by RENDER_EPS, so clear the cell and draw everything
+            // that touches it again in the original order
+            QRect clip = get_tile_layer_rect(x, y).toAlignedRect();
+            for (Painter *lp : {black_painter.get(), white_painter.get()}) {
+                lp->save();
+                lp->setClipRect(clip);
+                lp->fillRect(clip, lp == black_painter.get() ? QColor(0, 0, 0) : QColor(255, 255, 255));
+
+                int b = tile_layer_border;
+                for (int nx = std::max(x - 1, -b); nx <= std::min(x + 1, main_width + b - 1); nx++) {
+                    for (int ny = std::max(y - 1, -b); ny <= std::min(y + 1, main_height + b - 1); ny++) {
+                        draw_tile_layer_cell(*lp, nx, ny);
+                    }
+                }
+
+                lp->restore();
+            }
+
+            update_tile_layer_pixels(clip);
+        }
+        tile_layer_dirty.clear();
+    }
+
+    int dst_x = tile_layer_x;
+    int dst_y = tile_layer_y;
+    p.drawImage(QPointF(dst_x, dst_y), tile_layer);
+
+    // the other pixels depend on what is below them, so draw every cell that touches the
+    // flagged blocks directly over them in the same order as the uncached loop. Pixels of
+    // the layer that are covered again come out the same whatever they are drawn over
+    int blocks_h = (int)(tile_layer_blocks.size()) / tile_layer_blocks_w;
+    for (int by = 0; by < blocks_h; by++) {
+        int bx = 0;
+        while (bx < tile_layer_blocks_w) {
+            if (!tile_layer_blocks[by * tile_layer_blocks_w + bx]) {
+                bx++;
+                continue;
+            }
+            int bx0 = bx;
+            while (bx < tile_layer_blocks_w && tile_layer_blocks[by * tile_layer_blocks_w + bx]) {
+                bx++;
+            }
+
+            QRect clip = QRect(dst_x + bx0 * TILE_LAYER_BLOCK, dst_y + by * TILE_LAYER_BLOCK, (bx - bx0) * TILE_LAYER_BLOCK, TILE_LAYER_BLOCK).intersected(rect);
+            if (clip.isEmpty()) {
+                continue;
+            }
+
+            int x0 = std::max(low_x, int(floor((clip.left() + x_off) / unit)) - 1);
+            int x1 = std::min(high_x, int(floor((clip.right() + 1 + x_off) / unit)) + 1);
+            int y0 = std::max(low_y, int(floor(view_dim - 1 - (clip.bottom() + 1 - y_off) / unit)) - 1);
+            int y1 = std::min(high_y, int(floor(view_dim - (clip.top() - y_off) / unit)) + 1);
+
+            p.save();
+            p.setClipRect(clip);
+            for (int x = x0; x <= x1; x++) {
+                for (int y = y0; y <= y1; y++) {
+                    draw_grid_cell(p, x, y);
+                }
+            }
+            p.restore();
+        }
+    }
+
+    return true;
+}
+
+void BasicAbstractGame::draw_foreground(Painter &p, const QRect &rect) {
     prepare_for_drawing(rect.height());
 
     draw_entities(p, entities, -1);
@@ -938,19 +1326,13 @@ void BasicAbstractGame::draw_foreground(QPainter &p, const QRect &rect) {
         high_y = main_height - 1;
     }
 
-    for (int x = low_x; x <= high_x; x++) {
-        for (int y = low_y; y <= high_y; y++) {
-            int type = get_obj(x, y);
-
-            if (type == INVALID_OBJ) {
-                continue;
+    // the tile layer is only kept for observations, not for the larger human facing render
+    bool drew_tiles = options.cache_static_tiles && rect.height() == RES_H && draw_tile_layer(p, rect, low_x, high_x, low_y, high_y);
+    if (!drew_tiles) {
+        for (int x = low_x; x <= high_x; x++) {
+            for (int y = low_y; y <= high_y; y++) {
+                draw_grid_cell(p, x, y);
             }
-
-            int theme = theme_for_grid_obj(type);
-
-            QRectF r2 = get_screen_rect(x, y + 1, 1, 1, RENDER_EPS);
-
-            draw_image(p, r2, 0, false, type, theme, 1.0, 0.0);
         }
     }
 
@@ -969,14 +1351,14 @@ void BasicAbstractGame::draw_foreground(QPainter &p, const QRect &rect) {
     }
 }
 
-void BasicAbstractGame::set_pen_brush_color(QPainter &p, QColor color, int thickness) {
+void BasicAbstractGame::set_pen_brush_color(Painter &p, QColor color, int thickness) {
     QBrush brush(color);
     QPen pen(color, thickness);
     p.setBrush(brush);
     p.setPen(pen);
 }
 
-void BasicAbstractGame::draw_background(QPainter &p, const QRect &rect) {
+void BasicAbstractGame::draw_background(Painter &p, const QRect &rect) {
     p.fillRect(rect, QColor(0, 0, 0));
 
     prepare_for_drawing(rect.height());
@@ -1002,11 +1384,11 @@ void BasicAbstractGame::draw_background(QPainter &p, const QRect &rect) {
         float offset_x = bg_pct_x * extra_w;
 
         QRectF bg_rect = adjust_rect(main_rect, QRectF(-offset_x, 0, bg_ar / world_ar, 1));
-        p.drawImage(bg_rect, *background_image);
+        draw_scaled_image(p, background_image.get(), bg_rect);
     }
 }
 
-void BasicAbstractGame::game_draw(QPainter &p, const QRect &rect) {
+void BasicAbstractGame::game_draw(Painter &p, const QRect &rect) {
     draw_background(p, rect);
     draw_foreground(p, rect);
 }
@@ -1049,7 +1431,7 @@ bool BasicAbstractGame::should_draw_entity(const std::shared_ptr<Entity> &entity
     return true;
 }
 
-void BasicAbstractGame::draw_entity(QPainter &p, const std::shared_ptr<Entity> &ent) {
+void BasicAbstractGame::draw_entity(Painter &p, const std::shared_ptr<Entity> &ent) {
     if (should_draw_entity(ent)) {
         QRectF r1 = get_object_rect(ent);
         float tile_ratio = get_tile_aspect_ratio(ent);
@@ -1057,7 +1439,7 @@ void BasicAbstractGame::draw_entity(QPainter &p, const std::shared_ptr<Entity> &
     }
 }
 
-void BasicAbstractGame::draw_entities(QPainter &p, const std::vector<std::shared_ptr<Entity>> &to_draw, int render_z) {
+void BasicAbstractGame::draw_entities(Painter &p, const std::vector<std::shared_ptr<Entity>> &to_draw, int render_z) {
     for (const auto &m : to_draw) {
         if (m->render_z == render_z) {
             draw_entity(p, m);
@@ -1112,8 +1494,25 @@ float BasicAbstractGame::rand_pos(float r, float max) {
 }
 
 bool BasicAbstractGame::has_any_collision(const std::shared_ptr<Entity> &e1, float margin) {
+    if (use_entity_grid()) {
+        // entities may have been changed anywhere since the last check
+        entity_grid.sync(entities);
+        entity_grid_stale = false;
+        query_entity_grid(e1, margin, (int)(entities.size()) - 1, any_collision_candidates);
+
+        for (int i : any_collision_candidates) {
+            const auto &ent = entities[i];
+
+            if (!ent->avoids_collisions && has_collision(e1, ent, margin)) {
+                return true;
+            }
+        }
+
+        return false;
+    }
+
     for (int i = (int)(entities.size()) - 1; i >= 0; i--) {
-        auto ent = entities.at(i);
+        const auto &ent = entities[i];
 
         if (!ent->avoids_collisions && has_collision(e1, ent, margin)) {
             return true;
@@ -1123,6 +1522,51 @@ bool BasicAbstractGame::has_any_collision(const std::shared_ptr<Entity> &e1, flo
     return false;
 }
 
+bool BasicAbstractGame::use_entity_grid() {
+    return options.collision_broadphase && (int)(entities.size()) >= options.broadphase_min_entities;
+}
+
+void BasicAbstractGame::query_entity_grid(const std::shared_ptr<Entity> &ent, float margin, int max_index, std::vector<int> &out) {
+    // has_collision() accepts entities closer than the sum of both sizes and the margin, so any
+    // match overlaps this box (or contains its center when the margin is negative)
+    float qx = std::max(ent->rx + margin, 0.0f);
+    float qy = std::max(ent->ry + margin, 0.0f);
+    entity_grid.query(ent->x - qx, ent->y - qy, ent->x + qx, ent->y + qy, max_index, out);
+}
+
+void BasicAbstractGame::handle_entity_collisions(int idx, const std::shared_ptr<Entity> &ent) {
+    // same checks in the same order as the brute force loop in game_step(), which only visits
+    // the entities that existed when it started
+    std::vector<int> &candidates = step_collision_candidates;
+    int max_index = (int)(entities.size()) - 1;
+
+    if (entity_grid_stale) {
+        entity_grid.sync(entities);
+        entity_grid_stale = false;
+    }
+    query_entity_grid(ent, ent->collision_margin, max_index, candidates);
+
+    size_t k = 0;
+    while (k < candidates.size()) {
+        int j = candidates[k++];
+        if (j == idx)
+            continue;
+        const auto &other = entities[j];
+
+        if (has_collision(ent, other, ent->collision_margin) && !ent->will_erase && !other->will_erase) {
+            // hold a reference of our own, handle_collision() may add entities
+            auto ent2 = other;
+            handle_collision(ent, ent2);
+
+            // the handler may have moved entities, look again at the ones not visited yet
+            entity_grid.sync(entities);
+            entity_grid_stale = false;
+            query_entity_grid(ent, ent->collision_margin, j - 1, candidates);
+            k = 0;
+        }
+    }
+}
+
 bool BasicAbstractGame::has_agent_collision(const std::shared_ptr<Entity> &e1) {
     if (e1->type == PLAYER)
         return false;
@@ -1160,7 +1604,7 @@ void BasicAbstractGame::write_entities(WriteBuffer *b, std::vector<std::shared_p
 void BasicAbstractGame::read_entities(ReadBuffer *b, std::vector<std::shared_ptr<Entity>> &ents) {
     ents.resize(b->read_int());
     for (size_t i = 0; i < ents.size(); i++) {
-        auto e = std::make_shared<Entity>();
+        auto e = new_entity();
         e->deserialize(b);
         ents[i] = e;
     }
@@ -1285,4 +1729,32 @@ void BasicAbstractGame::deserialize(ReadBuffer *b) {
     min_visibility = b->read_float();
 
     grid.deserialize(b);
+    reset_grid_tracking();
+
+    tile_layer_valid = false;
+}
+
+void BasicAbstractGame::serialize_carryover(WriteBuffer *b) {
+    Game::serialize_carryover(b);
+
+    // the last actions of the previous episode are only replaced on the next step
+    b->write_int(last_move_action);
+    b->write_int(move_action);
+    b->write_int(special_action);
+    b->write_float(action_vx);
+    b->write_float(action_vy);
+    b->write_float(action_vrot);
+    b->write_int(step_rand_int);
+}
+
+void BasicAbstractGame::deserialize_carryover(ReadBuffer *b) {
+    Game::deserialize_carryover(b);
+
+    last_move_action = b->read_int();
+    move_action = b->read_int();
+    special_action = b->read_int();
+    action_vx = b->read_float();
+    action_vy = b->read_float();
+    action_vrot = b->read_float();
+    step_rand_int = b->read_int();
 }
@@ -12,6 +12,8 @@ Base game class used by all currently existing games
 #include "game.h"
 #include "grid.h"
 #include "cpp-utils.h"
+#include "entity-pool.h"
+#include "entity-grid.h"
 
 class BasicAbstractGame : public Game {
   public:
@@ -23,10 +25,12 @@ class BasicAbstractGame : public Game {
     // Game methods
     void game_step() override;
     void game_reset() override;
-    void game_draw(QPainter &p, const QRect &rect) override;
+    void game_draw(Painter &p, const QRect &rect) override;
     void game_init() override;
     void serialize(WriteBuffer *b) override;
     void deserialize(ReadBuffer *b) override;
+    void serialize_carryover(WriteBuffer *b) override;
+    void deserialize_carryover(ReadBuffer *b) override;
 
     void write_entities(WriteBuffer *b, std::vector<std::shared_ptr<Entity>> &ents);
     void read_entities(ReadBuffer *b, std::vector<std::shared_ptr<Entity>> &ents);
@@ -46,7 +50,7 @@ class BasicAbstractGame : public Game {
     virtual int theme_for_grid_obj(int type);
     virtual bool should_preserve_type_themes(int type);
     virtual QColor color_for_type(int type, int theme);
-    virtual void draw_grid_obj(QPainter &p, const QRectF &rect, int type, int theme);
+    virtual void draw_grid_obj(Painter &p, const QRectF &rect, int type, int theme);
     virtual void choose_world_dim();
     virtual bool should_draw_entity(const std::shared_ptr<Entity> &entity);
     virtual void set_action_xy(int move_action);
@@ -58,8 +62,8 @@ class BasicAbstractGame : public Game {
     void choose_step_random_theme(const std::shared_ptr<Entity> &ent);
     bool use_procgen_asset(int type);
     void decay_agent_velocity();
-    void tile_image(QPainter &p, std::shared_ptr<QImage> image, QRectF &rect, float tile_ratio);
-    void set_pen_brush_color(QPainter &p, QColor color, int thickness = 1);
+    void tile_image(Painter &p, std::shared_ptr<QImage> image, QRectF &rect, float tile_ratio);
+    void set_pen_brush_color(Painter &p, QColor color, int thickness = 1);
     void basic_step_object(const std::shared_ptr<Entity> &obj);
     std::shared_ptr<Entity> spawn_entity_rxy(float rx, float ry, int type, float x, float y, float w, float h, bool check_collisions = true);
     std::shared_ptr<Entity> spawn_entity(float r, int type, float x, float y, float w, float h, bool check_collisions = true);
@@ -67,6 +71,12 @@ class BasicAbstractGame : public Game {
     std::shared_ptr<Entity> add_entity(float x, float y, float vx, float vy, float r, int type);
     std::shared_ptr<Entity> add_entity_rxy(float x, float y, float vx, float vy, float rx, float ry, int type);
     std::shared_ptr<Entity> spawn_child(const std::shared_ptr<Entity> &src, int type, float obj_r, bool match_vel = false);
+
+    // like std::make_shared<Entity>(), but allocated from entity_pool
+    template <typename... Args>
+    std::shared_ptr<Entity> new_entity(Args &&... args) {
+        return std::allocate_shared<Entity>(EntityAllocator<Entity>(&entity_pool), std::forward<Args>(args)...);
+    }
     void spawn_entities(int num_objects, float r, int type, float x, float y, float w, float h);
     void reposition(const std::shared_ptr<Entity> &ent, float x, float y, float w, float h, bool check_collisions);
     int get_obj(int i, int j);
@@ -79,6 +89,8 @@ class BasicAbstractGame : public Game {
     int get_obj_from_floats(float i, float j);
     int get_agent_index();
     std::vector<int> get_cells_with_type(int type);
+    // number of grid cells holding type, requires track_grid_changes
+    int count_obj(int type);
 
     void check_grid_collisions(const std::shared_ptr<Entity> &src);
     float get_distance(const std::shared_ptr<Entity> &p0, const std::shared_ptr<Entity> &p1);
@@ -86,7 +98,7 @@ class BasicAbstractGame : public Game {
     void fit_aspect_ratio(const std::shared_ptr<Entity> &ent);
     void choose_random_theme(const std::shared_ptr<Entity> &ent);
     int mask_theme_if_necessary(int theme, int type);
-    void tile_image(QPainter &p, QImage *image, const QRectF &rect, float tile_ratio);
+    void tile_image(Painter &p, QImage *image, const QRectF &rect, float tile_ratio);
 
     float rand_pos(float r, float max);
     float rand_pos(float r, float min, float max);
@@ -102,7 +114,7 @@ class BasicAbstractGame : public Game {
     QRectF get_abs_rect(float x, float y, float dx, float dy);
     QRectF get_object_rect(const std::shared_ptr<Entity> &obj);
 
-    void draw_foreground(QPainter &p, const QRect &rect);
+    void draw_foreground(Painter &p, const QRect &rect);
 
     void step_entities(const std::vector<std::shared_ptr<Entity>> &given);
 
@@ -112,6 +124,9 @@ class BasicAbstractGame : public Game {
     void reposition_agent();
 
   protected:
+    // entities are allocated from this pool, so it is declared before everything that holds
+    // entities and destroyed after them
+    EntityPool entity_pool;
     std::shared_ptr<Entity> agent;
     std::vector<std::shared_ptr<Entity>> entities;
     std::vector<std::shared_ptr<QImage>> basic_assets;
@@ -151,6 +166,14 @@ class BasicAbstractGame : public Game {
     int main_height = 0;
     int out_of_bounds_object = 0;
 
+    // when set, set_obj() records the cells whose value it changes in changed_cells and keeps
+    // count_obj() up to date, for games that would otherwise scan the whole grid every step
+    bool track_grid_changes = false;
+    std::vector<int> changed_cells;
+    // set when the grid was replaced without going through set_obj() (a new level or
+    // deserialize()), every cell then has to be treated as changed
+    bool all_cells_changed = true;
+
     float unit = 0.0f;
     float view_dim = 0.0f;
     float x_off = 0.0f;
@@ -160,15 +183,78 @@ class BasicAbstractGame : public Game {
 
   private:
     Grid<int> grid;
+    // number of cells holding each type, only kept with track_grid_changes
+    std::vector<int> obj_counts;
+
+    // with options.cache_static_tiles, the grid cells of the observation are drawn once per
+    // level (in world pixels) and only redrawn where set_obj() changes them. The image of a
+    // grid cell must not change in any other way during a level.
+    // The cells are drawn over black and over white, pixels that come out the same on both
+    // cover whatever is below them and are copied from tile_layer. Blocks of the layer with
+    // any other pixels drawn on (edges of cells, translucent parts) are flagged in
+    // tile_layer_blocks and their cells are drawn directly
+    QImage tile_layer;
+    QImage tile_layer_black;
+    QImage tile_layer_white;
+    std::vector<uint8_t> tile_layer_blocks;
+    int tile_layer_blocks_w = 0;
+    // set when too many blocks were flagged for the layer to save any drawing, the level is
+    // then drawn without it
+    bool tile_layer_unused = false;
+    // cells changed since they were last drawn into tile_layer, and a flag per cell for
+    // whether it is in that list
+    std::vector<int> tile_layer_dirty;
+    std::vector<uint8_t> tile_layer_marks;
+    bool tile_layer_valid = false;
+    float tile_layer_unit = 0.0f;
+    // the left edges of the columns and top edges of the rows of cells the layer was drawn
+    // with, relative to the layer, it is only used for frames whose cells are drawn at the
+    // same edges shifted by whole pixels
+    std::vector<double> tile_layer_lefts;
+    std::vector<double> tile_layer_tops;
+    // where the top left pixel of the layer is on the screen in the current frame
+    int tile_layer_x = 0;
+    int tile_layer_y = 0;
+    int tile_layer_pad = 0;
+    int tile_layer_border = 0;
+    // the sub-pixel position of the view while it differs from the layer's, and for how many
+    // frames in a row it stayed there
+    float tile_view_phase_x = 0.0f;
+    float tile_view_phase_y = 0.0f;
+    int tile_view_still_frames = 0;
+
+    // with options.collision_broadphase, entity collision checks only test the entities near
+    // each other according to this grid, which is synced whenever game code may have moved them
+    EntityGrid entity_grid;
+    bool entity_grid_stale = true;
+    std::vector<int> step_collision_candidates;
+    std::vector<int> any_collision_candidates;
 
     QImage *lookup_asset(int img_idx, bool is_reflected = false);
     void initialize_asset_if_necessary(int img_idx);
     void prepare_for_drawing(float rect_height);
-    void draw_background(QPainter &p, const QRect &rect);
-    void draw_entity(QPainter &p, const std::shared_ptr<Entity> &to_draw);
-    void draw_entities(QPainter &p, const std::vector<std::shared_ptr<Entity>> &to_draw, int render_z = 0);
-    void draw_image(QPainter &p, QRectF &rect, float rotation, bool is_reflected, int img_idx, int theme, float alpha, float tile_ratio);
+    void draw_background(Painter &p, const QRect &rect);
+    void draw_entity(Painter &p, const std::shared_ptr<Entity> &to_draw);
+    void draw_entities(Painter &p, const std::vector<std::shared_ptr<Entity>> &to_draw, int render_z = 0);
+    void draw_image(Painter &p, QRectF &rect, float rotation, bool is_reflected, int img_idx, int theme, float alpha, float tile_ratio);
+    void draw_scaled_image(Painter &p, QImage *image, const QRectF &rect);
+    QRectF get_tile_layer_rect(int x, int y);
+    void draw_tile_layer_cell(Painter &p, int x, int y);
+    void draw_grid_cell(Painter &p, int x, int y);
+    void get_tile_layer_edges(std::vector<double> &lefts, std::vector<double> &tops);
+    bool place_tile_layer();
+    void rebuild_tile_layer();
+    void update_tile_layer_pixels(const QRect &area);
+    // draws the grid cells between low_x, high_x, low_y and high_y from the tile layer, false
+    // when the view is between the layer's pixels
+    bool draw_tile_layer(Painter &p, const QRect &rect, int low_x, int high_x, int low_y, int high_y);
+
+    void record_grid_change(int idx, int elem);
+    void reset_grid_tracking();
 
+    bool use_entity_grid();
+    void query_entity_grid(const std::shared_ptr<Entity> &ent, float margin, int max_index, std::vector<int> &out);
+    void handle_entity_collisions(int idx, const std::shared_ptr<Entity> &ent);
     bool sub_step(const std::shared_ptr<Entity> &obj, float _vx, float _vy, int depth);
     bool should_erase(const std::shared_ptr<Entity> &e1);
 };
@@ -3,15 +3,52 @@
 #include "cpp-utils.h"
 #include <vector>
 #include <string>
+#include <algorithm>
+#include <cstdint>
+#include <cstring>
+
+class RandGen;
+
+// floats in the compact encoding are written as varints of their bytes in reverse order, so
+// that values with few mantissa bits such as 0, 1 or .5 take one or two bytes
+inline uint32_t reverse_bytes(uint32_t v) {
+    return (v >> 24) | ((v >> 8) & 0xff00) | ((v << 8) & 0xff0000) | (v << 24);
+}
 
 struct ReadBuffer {
     char *data = nullptr;
     size_t offset = 0;
     size_t length = 0;
+    // when set, RandGen::deserialize takes the generator states from here, in order, instead
+    // of parsing their much slower text form from data
+    const std::vector<RandGen> *rand_gens = nullptr;
+    size_t rand_gen_idx = 0;
+    // whether the data uses the compact encoding, see WriteBuffer::compact
+    bool compact = false;
 
     ReadBuffer(char *data, size_t length) : data(data), length(length) {
     };
 
+    void read_bytes(void *dst, size_t size) {
+        fassert(offset + size <= length);
+        memcpy(dst, data + offset, size);
+        offset += size;
+    };
+
+    uint32_t read_varint() {
+        uint32_t v = 0;
+        for (int shift = 0; shift < 35; shift += 7) {
+            fassert(offset < length);
+            uint8_t byte = data[offset++];
+            v |= uint32_t(byte & 0x7f) << shift;
+            if (!(byte & 0x80)) {
+                return v;
+            }
+        }
+        fassert(false);
+        return 0;
+    };
+
     bool read_bool() {
         return read_int() > 0;
     };
@@ -26,6 +63,10 @@ struct ReadBuffer {
     };
 
     int read_int() {
+        if (compact) {
+            uint32_t v = read_varint();
+            return int((v >> 1) ^ (~(v & 1) + 1));
+        }
         fassert(offset + sizeof(int) <= length);
         auto d = (int*)(&data[offset]);
         offset += sizeof(int);
@@ -35,6 +76,17 @@ struct ReadBuffer {
     std::vector<int> read_vector_int() {
         std::vector<int> v;
         v.resize(read_int());
+        if (compact) {
+            size_t i = 0;
+            while (i < v.size()) {
+                int value = read_int();
+                size_t run = read_varint();
+                fassert(run > 0 && run <= v.size() - i);
+                std::fill(v.begin() + i, v.begin() + i + run, value);
+                i += run;
+            }
+            return v;
+        }
         for (size_t i = 0; i < v.size(); i++) {
             v[i] = read_int();
         }
@@ -42,6 +94,12 @@ struct ReadBuffer {
     };
 
     float read_float() {
+        if (compact) {
+            uint32_t bits = reverse_bytes(read_varint());
+            float f;
+            memcpy(&f, &bits, sizeof(f));
+            return f;
+        }
         fassert(offset + sizeof(float) <= length);
         auto d = (float*)(&data[offset]);
         offset += sizeof(float);
@@ -75,10 +133,48 @@ struct WriteBuffer {
     char *data = nullptr;
     size_t offset = 0;
     size_t length = 0;
+    // when set, the buffer grows this vector as needed instead of failing on overflow
+    std::vector<char> *storage = nullptr;
+    // when set, RandGen::serialize also appends a copy of the generator here
+    std::vector<RandGen> *rand_gens = nullptr;
+    // when set, ints are written as zigzag varints so that flags and small values take a
+    // single byte, int vectors such as the grid are run-length encoded and random number
+    // generators are written in binary instead of text
+    bool compact = false;
 
     WriteBuffer(char *data, size_t length) :  data(data), length(length) {
     };
 
+    WriteBuffer(std::vector<char> *storage) : storage(storage) {
+        data = storage->data();
+        length = storage->size();
+    };
+
+    void reserve(size_t size) {
+        if (offset + size <= length) {
+            return;
+        }
+        fassert(storage != nullptr);
+        storage->resize(std::max(offset + size, 2 * length));
+        data = storage->data();
+        length = storage->size();
+    };
+
+    void write_bytes(const void *src, size_t size) {
+        reserve(size);
+        memcpy(data + offset, src, size);
+        offset += size;
+    };
+
+    void write_varint(uint32_t v) {
+        reserve(5);
+        while (v >= 0x80) {
+            data[offset++] = char((v & 0x7f) | 0x80);
+            v >>= 7;
+        }
+        data[offset++] = char(v);
+    };
+
     void write_bool(bool b) {
         write_int(b ? 1 : 0);
     };
@@ -91,7 +187,11 @@ struct WriteBuffer {
     };
 
     void write_int(int i) {
-        fassert(offset + sizeof(int) <= length);
+        if (compact) {
+            write_varint((uint32_t(i) << 1) ^ uint32_t(i >> 31));
+            return;
+        }
+        reserve(sizeof(int));
         auto d = (int*)(&data[offset]);
         *d = i;
         offset += sizeof(int);
@@ -100,13 +200,32 @@ struct WriteBuffer {
 
     void write_vector_int(const std::vector<int>& v) {
         write_int(v.size());
+        if (compact) {
+            size_t i = 0;
+            while (i < v.size()) {
+                size_t run = 1;
+                while (i + run < v.size() && v[i + run] == v[i]) {
+                    run++;
+                }
+                write_int(v[i]);
+                write_varint(run);
+                i += run;
+            }
+            return;
+        }
         for (auto i : v) {
             write_int(i);
         }
     };
 
     void write_float(float f) {
-        fassert(offset + sizeof(float) <= length);
+        if (compact) {
+            uint32_t bits;
+            memcpy(&bits, &f, sizeof(bits));
+            write_varint(reverse_bytes(bits));
+            return;
+        }
+        reserve(sizeof(float));
         auto d = (float*)(&data[offset]);
         *d = f;
         offset += sizeof(float);
@@ -120,8 +239,8 @@ struct WriteBuffer {
     };
 
     void write_string(std::string s) {
-        fassert(offset + s.size() <= length);
         write_int(s.size());
+        reserve(s.size());
         auto c = data + offset;
         for (size_t i = 0; i < s.size(); i++) {
             *c = s[i];
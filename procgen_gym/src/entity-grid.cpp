@@ -0,0 +1,154 @@
+#include "entity-grid.h"
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+
+// in world units, most entities have a radius of at most .5
+const float CELL_SIZE = 2.0f;
+const int NUM_BUCKETS = 1024;
+// entities and queries covering more cells than this skip the hash
+const int MAX_CELLS = 16;
+// queries are grown by this much so that rounding can't drop a pair that has_collision() accepts
+const float QUERY_PAD = 0.01f;
+// boxes beyond this are treated like large entities
+const float MAX_COORD = 1e6f;
+
+static int to_cell(float v) {
+    return int(floor(v / CELL_SIZE));
+}
+
+static bool cell_range(float x0, float y0, float x1, float y1, int &cx0, int &cy0, int &cx1, int &cy1) {
+    // also catches nan, and keeps the cell indices from overflowing
+    if (!(fabs(x0) < MAX_COORD && fabs(y0) < MAX_COORD && fabs(x1) < MAX_COORD && fabs(y1) < MAX_COORD)) {
+        return false;
+    }
+    cx0 = to_cell(x0);
+    cy0 = to_cell(y0);
+    cx1 = to_cell(x1);
+    cy1 = to_cell(y1);
+    return int64_t(cx1 - cx0 + 1) * (cy1 - cy0 + 1) <= MAX_CELLS;
+}
+
+EntityGrid::EntityGrid() : buckets(NUM_BUCKETS) {
+}
+
+std::vector<int> &EntityGrid::bucket(int cx, int cy) {
+    uint32_t h = uint32_t(cx) * 73856093u ^ uint32_t(cy) * 19349663u;
+    return buckets[h & (NUM_BUCKETS - 1)];
+}
+
+void EntityGrid::set_box(Box &box, const Entity *ent) {
+    box.ent = ent;
+    box.x = ent->x;
+    box.y = ent->y;
+    box.rx = ent->rx;
+    box.ry = ent->ry;
+    box.is_large = !cell_range(box.x - box.rx, box.y - box.ry, box.x + box.rx, box.y + box.ry, box.cx0, box.cy0, box.cx1, box.cy1);
+}
+
+void EntityGrid::insert(int idx) {
+    const Box &box = boxes[idx];
+    if (box.is_large) {
+        large.push_back(idx);
+        return;
+    }
+    for (int cx = box.cx0; cx <= box.cx1; cx++) {
+        for (int cy = box.cy0; cy <= box.cy1; cy++) {
+            bucket(cx, cy).push_back(idx);
+        }
+    }
+}
+
+void EntityGrid::remove(int idx) {
+    const Box &box = boxes[idx];
+    if (box.is_large) {
+        large.erase(std::find(large.begin(), large.end(), idx));
+        return;
+    }
+    for (int cx = box.cx0; cx <= box.cx1; cx++) {
+        for (int cy = box.cy0; cy <= box.cy1; cy++) {
+            auto &b = bucket(cx, cy);
+            b.erase(std::find(b.begin(), b.end(), idx));
+        }
+    }
+}
+
+void EntityGrid::clear() {
+    for (const Box &box : boxes) {
+        if (box.is_large) {
+            continue;
+        }
+        for (int cx = box.cx0; cx <= box.cx1; cx++) {
+            for (int cy = box.cy0; cy <= box.cy1; cy++) {
+                bucket(cx, cy).clear();
+            }
+        }
+    }
+    large.clear();
+    boxes.clear();
+}
+
+void EntityGrid::sync(const std::vector<std::shared_ptr<Entity>> &ents) {
+    // entities were erased or replaced, indices no longer line up
+    bool rebuild = boxes.size() > ents.size();
+    for (size_t i = 0; i < boxes.size() && !rebuild; i++) {
+        rebuild = boxes[i].ent != ents[i].get();
+    }
+
+    moved.clear();
+    for (size_t i = 0; i < boxes.size() && !rebuild; i++) {
+        const Box &box = boxes[i];
+        const Entity *ent = box.ent;
+        if (ent->x != box.x || ent->y != box.y || ent->rx != box.rx || ent->ry != box.ry) {
+            moved.push_back(i);
+        }
+    }
+
+    // after a step most entities have moved, and inserting everything again is cheaper than
+    // taking each of them out of its buckets
+    if (rebuild || moved.size() * 4 > boxes.size()) {
+        clear();
+    } else {
+        for (int i : moved) {
+            remove(i);
+            set_box(boxes[i], boxes[i].ent);
+            insert(i);
+        }
+    }
+
+    for (size_t i = boxes.size(); i < ents.size(); i++) {
+        boxes.emplace_back();
+        set_box(boxes.back(), ents[i].get());
+        insert(i);
+    }
+}
+
+void EntityGrid::query(float x0, float y0, float x1, float y1, int max_index, std::vector<int> &out) {
+    out.clear();
+
+    int cx0, cy0, cx1, cy1;
+    if (!cell_range(x0 - QUERY_PAD, y0 - QUERY_PAD, x1 + QUERY_PAD, y1 + QUERY_PAD, cx0, cy0, cx1, cy1)) {
+        for (int i = std::min(max_index, int(boxes.size()) - 1); i >= 0; i--) {
+            out.push_back(i);
+        }
+        return;
+    }
+
+    for (int cx = cx0; cx <= cx1; cx++) {
+        for (int cy = cy0; cy <= cy1; cy++) {
+            for (int idx : bucket(cx, cy)) {
+                if (idx <= max_index) {
+                    out.push_back(idx);
+                }
+            }
+        }
+    }
+    for (int idx : large) {
+        if (idx <= max_index) {
+            out.push_back(idx);
+        }
+    }
+
+    std::sort(out.begin(), out.end(), std::greater<int>());
+    out.erase(std::unique(out.begin(), out.end()), out.end());
+}
@@ -0,0 +1,45 @@
+#pragma once
+
+/*
+
+Spatial hash of entity bounding boxes, used as a broadphase so that collision checks only
+look at entities near each other instead of every pair
+
+*/
+
+#include <memory>
+#include <vector>
+#include "entity.h"
+
+class EntityGrid {
+  public:
+    EntityGrid();
+
+    // bring the grid up to date with ents, entities whose position or size changed since the
+    // last sync are moved and entities added to the end of ents are inserted
+    void sync(const std::vector<std::shared_ptr<Entity>> &ents);
+
+    // indices of the entities whose boxes may overlap [x0, x1] x [y0, y1], limited to
+    // max_index, in descending order without duplicates
+    void query(float x0, float y0, float x1, float y1, int max_index, std::vector<int> &out);
+
+  private:
+    struct Box {
+        const Entity *ent;
+        float x, y, rx, ry;
+        int cx0, cy0, cx1, cy1;
+        bool is_large;
+    };
+
+    std::vector<Box> boxes;
+    std::vector<std::vector<int>> buckets;
+    // entities spanning too many cells, returned by every query
+    std::vector<int> large;
+    std::vector<int> moved;
+
+    std::vector<int> &bucket(int cx, int cy);
+    void set_box(Box &box, const Entity *ent);
+    void insert(int idx);
+    void remove(int idx);
+    void clear();
+};
@@ -0,0 +1,33 @@
+#include "entity-pool.h"
+#include "cpp-utils.h"
+
+// blocks added to the pool whenever it runs out
+const int CHUNK_BLOCKS = 64;
+
+void *EntityPool::allocate(size_t size) {
+    // keep every block aligned like operator new would
+    size_t align = alignof(std::max_align_t);
+    size = (size + align - 1) / align * align;
+
+    if (block_size == 0) {
+        block_size = size;
+    }
+    fassert(size == block_size);
+
+    if (free_blocks.empty()) {
+        char *chunk = new char[block_size * CHUNK_BLOCKS];
+        chunks.emplace_back(chunk);
+        // hand out blocks front to back
+        for (int i = CHUNK_BLOCKS - 1; i >= 0; i--) {
+            free_blocks.push_back(chunk + i * block_size);
+        }
+    }
+
+    void *block = free_blocks.back();
+    free_blocks.pop_back();
+    return block;
+}
+
+void EntityPool::deallocate(void *block) {
+    free_blocks.push_back(block);
+}
@@ -0,0 +1,70 @@
+#pragma once
+
+/*
+
+Free list of fixed size blocks that entities are allocated from, so that spawning
+and erasing entities (bullets, fish, ...) reuses memory instead of going to the heap
+
+*/
+
+#include <cstddef>
+#include <memory>
+#include <vector>
+
+class EntityPool {
+  public:
+    EntityPool() = default;
+    EntityPool(const EntityPool &) = delete;
+    EntityPool &operator=(const EntityPool &) = delete;
+
+    // all allocations from one pool must have the same size
+    void *allocate(size_t size);
+    void deallocate(void *block);
+
+  private:
+    size_t block_size = 0;
+    std::vector<std::unique_ptr<char[]>> chunks;
+    std::vector<void *> free_blocks;
+};
+
+// allocator for std::allocate_shared(), which places the entity and its reference count in
+// one block of the pool, the pool must outlive every pointer allocated from it
+template <typename T>
+class EntityAllocator {
+  public:
+    typedef T value_type;
+
+    EntityPool *pool;
+
+    EntityAllocator(EntityPool *_pool) : pool(_pool) {
+    }
+
+    template <typename U>
+    EntityAllocator(const EntityAllocator<U> &other) : pool(other.pool) {
+    }
+
+    T *allocate(size_t n) {
+        if (n != 1) {
+            return std::allocator<T>().allocate(n);
+        }
+        return static_cast<T *>(pool->allocate(sizeof(T)));
+    }
+
+    void deallocate(T *p, size_t n) {
+        if (n != 1) {
+            std::allocator<T>().deallocate(p, n);
+            return;
+        }
+        pool->deallocate(p);
+    }
+};
+
+template <typename T, typename U>
+bool operator==(const EntityAllocator<T> &a, const EntityAllocator<U> &b) {
+    return a.pool == b.pool;
+}
+
+template <typename T, typename U>
+bool operator!=(const EntityAllocator<T> &a, const EntityAllocator<U> &b) {
+    return a.pool != b.pool;
+}
@@ -0,0 +1,388 @@
+#include "fast-painter.h"
+#include "cpp-utils.h"
+#include <algorithm>
+#include <cmath>
+
+// The pixel arithmetic below is Qt 5's (qdrawhelper_p.h, qrgba64.h and qblendfunctions_p.h),
+// any difference in rounding would show up as pixels that differ from the Qt backend
+
+// x * a / 255 for each of the four channels of x, same as Qt's BYTE_MUL
+static inline uint32_t byte_mul(uint32_t x, uint32_t a) {
+    uint32_t t = (x & 0xff00ff) * a;
+    t = (t + ((t >> 8) & 0xff00ff) + 0x800080) >> 8;
+    t &= 0xff00ff;
+
+    x = ((x >> 8) & 0xff00ff) * a;
+    x = (x + ((x >> 8) & 0xff00ff) + 0x800080);
+    x &= 0xff00ff00;
+
+    return x | t;
+}
+
+// (x * a + y * b) / 255 for each channel, same as Qt's INTERPOLATE_PIXEL_255
+static inline uint32_t interpolate_pixel_255(uint32_t x, uint32_t a, uint32_t y, uint32_t b) {
+    uint32_t t = (x & 0xff00ff) * a + (y & 0xff00ff) * b;
+    t = (t + ((t >> 8) & 0xff00ff) + 0x800080) >> 8;
+    t &= 0xff00ff;
+
+    x = ((x >> 8) & 0xff00ff) * a + ((y >> 8) & 0xff00ff) * b;
+    x = (x + ((x >> 8) & 0xff00ff) + 0x800080);
+    x &= 0xff00ff00;
+
+    return x | t;
+}
+
+static inline uint32_t blend_source_over(uint32_t dst, uint32_t src) {
+    if (src >= 0xff000000) {
+        return src;
+    }
+    if (src == 0) {
+        return dst;
+    }
+    return src + byte_mul(dst, 255 - (src >> 24));
+}
+
+static inline uint32_t div_65535(uint32_t x) {
+    return (x + (x >> 16) + 0x8000) >> 16;
+}
+
+static inline uint32_t to_8bit(uint32_t x) {
+    x += 0x80;
+    return (x - (x >> 8)) >> 8;
+}
+
+// QRgba64(r, g, b, a).toArgb32() after premultiplying it with qPremultiply() if needed
+static uint32_t to_argb32(uint32_t r, uint32_t g, uint32_t b, uint32_t a, bool premultiply) {
+    if (premultiply && a != 65535) {
+        r = div_65535(r * a);
+        g = div_65535(g * a);
+        b = div_65535(b * a);
+    }
+    return (to_8bit(a) << 24) | (to_8bit(r) << 16) | (to_8bit(g) << 8) | to_8bit(b);
+}
+
+// the color QRasterPaintEngine fills with for color at the given opacity out of 256
+static uint32_t solid_color(const QColor &color, int int_opacity) {
+    QRgba64 c = color.rgba64();
+    return to_argb32(c.red(), c.green(), c.blue(), (c.alpha() * int_opacity) >> 8, true);
+}
+
+// the color QRasterPaintEngine fills with when drawing a 1x1 image
+static uint32_t single_pixel_color(const QImage &image, int int_opacity) {
+    uint32_t p = *(const uint32_t *)image.constScanLine(0);
+    if (image.format() == QImage::Format_RGB32) {
+        p |= 0xff000000;
+    }
+    uint32_t r = ((p >> 16) & 0xff) * 257;
+    uint32_t g = ((p >> 8) & 0xff) * 257;
+    uint32_t b = (p & 0xff) * 257;
+    uint32_t a = (p >> 24) * 257;
+    if (image.format() == QImage::Format_ARGB32_Premultiplied) {
+        return to_argb32((r * int_opacity) >> 8, (g * int_opacity) >> 8, (b * int_opacity) >> 8, (a * int_opacity) >> 8, false);
+    }
+    return to_argb32(r, g, b, (a * int_opacity) >> 8, true);
+}
+
+static bool is_fast_format(QImage::Format format) {
+    return format == QImage::Format_RGB32 || format == QImage::Format_ARGB32_Premultiplied;
+}
+
+FastPainter::FastPainter(QImage *image) : image(image) {
+    fassert(is_fast_format(image->format()));
+    bits = (uint32_t *)(image->bits());
+    width = image->width();
+    height = image->height();
+    stride = image->bytesPerLine() / 4;
+    st.clip_x1 = width;
+    st.clip_y1 = height;
+}
+
+FastPainter::~FastPainter() {
+}
+
+void FastPainter::save() {
+    stack.push_back(st);
+}
+
+void FastPainter::restore() {
+    st = stack.back();
+    stack.pop_back();
+}
+
+void FastPainter::update_is_simple() {
+    st.is_simple = st.is_clip_simple && st.transform.type() <= QTransform::TxTranslate;
+}
+
+void FastPainter::translate(qreal dx, qreal dy) {
+    st.transform.translate(dx, dy);
+    update_is_simple();
+}
+
+void FastPainter::rotate(qreal degrees) {
+    st.transform.rotate(degrees);
+    update_is_simple();
+}
+
+void FastPainter::setOpacity(qreal opacity) {
+    st.opacity = std::min(qreal(1), std::max(qreal(0), opacity));
+}
+
+int FastPainter::int_opacity() const {
+    // QRasterPaintEngine truncates, it doesn't round
+    return int(st.opacity * 256);
+}
+
+void FastPainter::setPen(const QPen &pen) {
+    st.pen = pen;
+}
+
+void FastPainter::setBrush(const QBrush &brush) {
+    st.brush = brush;
+}
+
+void FastPainter::setCompositionMode(QPainter::CompositionMode mode) {
+    st.mode = mode;
+}
+
+void FastPainter::setClipRect(const QRect &rect) {
+    // like QPainter, the new clip replaces the previous one
+    st.has_clip = true;
+    st.clip_rect = rect;
+    st.clip_transform = st.transform;
+    st.is_clip_simple = st.transform.type() <= QTransform::TxTranslate;
+    update_is_simple();
+
+    if (st.is_clip_simple) {
+        int dx = qRound(st.transform.dx());
+        int dy = qRound(st.transform.dy());
+        st.clip_x0 = std::max(rect.left() + dx, 0);
+        st.clip_y0 = std::max(rect.top() + dy, 0);
+        st.clip_x1 = std::min(rect.left() + rect.width() + dx, width);
+        st.clip_y1 = std::min(rect.top() + rect.height() + dy, height);
+    }
+}
+
+QPainter &FastPainter::qt() {
+    if (qt_painter == nullptr) {
+        qt_painter.reset(new QPainter(image));
+    }
+
+    QPainter &p = *qt_painter;
+    if (st.has_clip) {
+        p.setTransform(st.clip_transform);
+        p.setClipRect(st.clip_rect);
+    } else {
+        p.setClipping(false);
+    }
+    p.setTransform(st.transform);
+    p.setOpacity(st.opacity);
+    p.setCompositionMode(st.mode);
+    p.setPen(st.pen);
+    p.setBrush(st.brush);
+    return p;
+}
+
+void FastPainter::fill_device_rect(const QRectF &rect, uint32_t color) {
+    // the pixels QRasterPaintEngine fills for an aliased rect
+    int x0 = qRound(rect.x());
+    int y0 = qRound(rect.y());
+    int x1 = qRound(rect.right());
+    int y1 = qRound(rect.bottom());
+    if (x1 < x0) {
+        std::swap(x0, x1);
+    }
+    if (y1 < y0) {
+        std::swap(y0, y1);
+    }
+
+    x0 = std::max(x0, st.clip_x0);
+    y0 = std::max(y0, st.clip_y0);
+    x1 = std::min(x1, st.clip_x1);
+    y1 = std::min(y1, st.clip_y1);
+
+    if (x1 <= x0 || y1 <= y0 || color == 0) {
+        return;
+    }
+
+    for (int y = y0; y < y1; y++) {
+        uint32_t *row = bits + y * stride;
+        if ((color >> 24) == 255) {
+            std::fill(row + x0, row + x1, color);
+        } else {
+            uint32_t ialpha = 255 - (color >> 24);
+            for (int x = x0; x < x1; x++) {
+                row[x] = color + byte_mul(row[x], ialpha);
+            }
+        }
+    }
+}
+
+void FastPainter::fillRect(const QRectF &rect, const QColor &color) {
+    if (!st.is_simple || st.mode != QPainter::CompositionMode_SourceOver) {
+        qt().fillRect(rect, color);
+        return;
+    }
+
+    fill_device_rect(rect.translated(st.transform.dx(), st.transform.dy()), solid_color(color, int_opacity()));
+}
+
+void FastPainter::drawImage(const QPointF &point, const QImage &image) {
+    if (!st.is_simple || st.mode != QPainter::CompositionMode_SourceOver || !is_fast_format(image.format())) {
+        qt().drawImage(point, image);
+        return;
+    }
+
+    if (image.isNull()) {
+        return;
+    }
+
+    draw_image_at(QPointF(point.x() + st.transform.dx(), point.y() + st.transform.dy()), image);
+}
+
+void FastPainter::drawImage(const QRectF &target, const QImage &image) {
+    if (!st.is_simple || st.mode != QPainter::CompositionMode_SourceOver || !is_fast_format(image.format())) {
+        qt().drawImage(target, image);
+        return;
+    }
+
+    if (image.isNull()) {
+        return;
+    }
+
+    // QPainter draws the image at its own size along a negative dimension
+    int iw = image.width();
+    int ih = image.height();
+    qreal w = target.width() < 0 ? iw : target.width();
+    qreal h = target.height() < 0 ? ih : target.height();
+    if (w == 0 || h == 0) {
+        return;
+    }
+    QRectF r(target.x(), target.y(), w, h);
+    qreal dx = st.transform.dx();
+    qreal dy = st.transform.dy();
+
+    if (iw == 1 && ih == 1) {
+        fill_device_rect(r.translated(dx, dy), single_pixel_color(image, int_opacity()));
+    } else if (w == iw && h == ih) {
+        draw_image_at(QPointF(r.x() + dx, r.y() + dy), image);
+    } else if (image.format() == QImage::Format_ARGB32_Premultiplied && int_opacity() == 256) {
+        QPointF top_left(r.x() + dx, r.y() + dy);
+        QPointF bottom_right((r.x() + w) + dx, (r.y() + h) + dy);
+        draw_image_scaled(QRectF(top_left, bottom_right), image);
+    } else {
+        // Qt scales opaque images (the backgrounds) and translucent draws (the trails) with its
+        // generic transform code, which samples differently, and there are few of them per frame
+        qt().drawImage(target, image);
+    }
+}
+
+void FastPainter::draw_image_at(const QPointF &point, const QImage &image) {
+    // the blend functions QRasterPaintEngine uses for an image at its own size
+    int alpha = int_opacity();
+    if (alpha == 0) {
+        return;
+    }
+
+    // Qt tests the unrounded position against the last column and row of the clip
+    if (point.x() > st.clip_x1 - 1 || point.y() > st.clip_y1 - 1) {
+        return;
+    }
+
+    int x = qRound(point.x());
+    int y = qRound(point.y());
+    int x0 = std::max(x, st.clip_x0);
+    int y0 = std::max(y, st.clip_y0);
+    int x1 = std::min(x + image.width(), st.clip_x1);
+    int y1 = std::min(y + image.height(), st.clip_y1);
+    if (x1 <= x0 || y1 <= y0) {
+        return;
+    }
+
+    bool is_opaque = image.format() == QImage::Format_RGB32;
+    uint32_t const_alpha = (alpha * 255) >> 8;
+
+    for (int dy = y0; dy < y1; dy++) {
+        const uint32_t *src = (const uint32_t *)image.constScanLine(dy - y) + (x0 - x);
+        uint32_t *dst = bits + dy * stride + x0;
+        int n = x1 - x0;
+
+        if (is_opaque && alpha == 256) {
+            std::copy(src, src + n, dst);
+        } else if (is_opaque) {
+            for (int i = 0; i < n; i++) {
+                dst[i] = interpolate_pixel_255(src[i], const_alpha, dst[i], 255 - const_alpha);
+            }
+        } else if (alpha == 256) {
+            for (int i = 0; i < n; i++) {
+                dst[i] = blend_source_over(dst[i], src[i]);
+            }
+        } else {
+            for (int i = 0; i < n; i++) {
+                uint32_t s = byte_mul(src[i], const_alpha);
+                dst[i] = s + byte_mul(dst[i], 255 - (s >> 24));
+            }
+        }
+    }
+}
+
+void FastPainter::draw_image_scaled(const QRectF &target, const QImage &image) {
+    // the 16.16 fixed point nearest neighbour scaling of qt_scale_image_32bit(), which Qt uses for
+    // opaque draws of premultiplied images
+    int iw = image.width();
+    int ih = image.height();
+    qreal sx = target.width() / iw;
+    qreal sy = target.height() / ih;
+    int ix = int(0x00010000 / sx);
+    int iy = int(0x00010000 / sy);
+
+    // target has a positive size, so unlike Qt this doesn't handle mirroring
+    int tx1 = std::max(qRound(target.left()), st.clip_x0);
+    int tx2 = std::min(qRound(target.right()), st.clip_x1);
+    int ty1 = std::max(qRound(target.top()), st.clip_y0);
+    int ty2 = std::min(qRound(target.bottom()), st.clip_y1);
+    if (tx1 >= tx2 || ty1 >= ty2) {
+        return;
+    }
+
+    int w = tx2 - tx1;
+    int h = ty2 - ty1;
+    uint32_t basex = uint32_t(int(ceil((tx1 + 0.5 - target.left()) * ix)) - 1);
+    uint32_t srcy = uint32_t(int(ceil((ty1 + 0.5 - target.top()) * iy)) - 1);
+
+    // like Qt, drop a last row or column that rounding would sample from outside the image
+    int yend = int(srcy + iy * (h - 1)) >> 16;
+    if (yend < 0 || yend >= ih) {
+        h--;
+    }
+    int xend = int(basex + ix * (w - 1)) >> 16;
+    if (xend < 0 || xend >= iw) {
+        w--;
+    }
+
+    for (int y = 0; y < h; y++) {
+        const uint32_t *src = (const uint32_t *)image.constScanLine(srcy >> 16);
+        uint32_t *dst = bits + (ty1 + y) * stride + tx1;
+        uint32_t srcx = basex;
+
+        for (int x = 0; x < w; x++) {
+            dst[x] = blend_source_over(dst[x], src[srcx >> 16]);
+            srcx += ix;
+        }
+        srcy += iy;
+    }
+}
+
+void FastPainter::drawEllipse(const QRectF &rect) {
+    qt().drawEllipse(rect);
+}
+
+void FastPainter::drawLine(int x1, int y1, int x2, int y2) {
+    qt().drawLine(x1, y1, x2, y2);
+}
+
+std::unique_ptr<Painter> create_painter(QImage *image, RenderBackend backend) {
+    if (backend == FastRenderBackend) {
+        return std::unique_ptr<Painter>(new FastPainter(image));
+    }
+    return std::unique_ptr<Painter>(new QtPainter(image));
+}
@@ -0,0 +1,81 @@
+#pragma once
+
+/*
+
+Software rasterizer for the drawing operations in painter.h, without antialiasing.
+
+Games mostly fill rects and draw images with at most a translation, and for those this
+reproduces the integer arithmetic of Qt's raster engine (pixel rounding, fixed point image
+scaling, blending), so the result is identical to an unsmoothed QPainter while skipping its
+per call overhead. Everything else (rotated images, ellipses, lines, non premultiplied
+sources) is rare and goes through a QPainter on the same image.
+
+*/
+
+#include <cstdint>
+#include <memory>
+#include <vector>
+#include "painter.h"
+
+class FastPainter : public Painter {
+  public:
+    // draws into image, which must be in RGB32 or ARGB32_Premultiplied format
+    FastPainter(QImage *image);
+    ~FastPainter();
+
+    void save() override;
+    void restore() override;
+    void translate(qreal dx, qreal dy) override;
+    void rotate(qreal degrees) override;
+    void setOpacity(qreal opacity) override;
+    void setPen(const QPen &pen) override;
+    void setBrush(const QBrush &brush) override;
+    void setCompositionMode(QPainter::CompositionMode mode) override;
+    void setClipRect(const QRect &rect) override;
+
+    void fillRect(const QRectF &rect, const QColor &color) override;
+    void drawImage(const QRectF &target, const QImage &image) override;
+    void drawImage(const QPointF &point, const QImage &image) override;
+    void drawEllipse(const QRectF &rect) override;
+    void drawLine(int x1, int y1, int x2, int y2) override;
+
+  private:
+    struct State {
+        QTransform transform;
+        qreal opacity = 1;
+        QPainter::CompositionMode mode = QPainter::CompositionMode_SourceOver;
+        QPen pen;
+        QBrush brush;
+        bool has_clip = false;
+        // the clip as it was set, to hand it to the QPainter
+        QRect clip_rect;
+        QTransform clip_transform;
+        // pixels that may be drawn to, [x0, x1) x [y0, y1)
+        int clip_x0 = 0;
+        int clip_y0 = 0;
+        int clip_x1 = 0;
+        int clip_y1 = 0;
+        // whether the transform and the clip are at most translations, so that the fast paths apply
+        bool is_simple = true;
+        bool is_clip_simple = true;
+    };
+
+    QImage *image;
+    uint32_t *bits;
+    int width;
+    int height;
+    int stride;
+    State st;
+    std::vector<State> stack;
+    std::unique_ptr<QPainter> qt_painter;
+
+    int int_opacity() const;
+    void update_is_simple();
+    QPainter &qt();
+    void fill_device_rect(const QRectF &rect, uint32_t color);
+    void draw_image_at(const QPointF &point, const QImage &image);
+    void draw_image_scaled(const QRectF &target, const QImage &image);
+};
+
+// a painter for image using the given backend
+std::unique_ptr<Painter> create_painter(QImage *image, RenderBackend backend);
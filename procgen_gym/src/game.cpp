@@ -1,9 +1,18 @@
 
 #include "game.h"
 #include "vecoptions.h"
+#include "fast-painter.h"
+#include "resources.h"
+#include <algorithm>
+#include <cmath>
+#include <cstring>
 
 // this should be updated whenever the state format or environments may have changed
 const int SERIALIZE_VERSION = 0;
+// states written with WriteBuffer::compact start with these 4 bytes in place of the raw
+// SERIALIZE_VERSION, followed by the version of the compact format
+const int32_t COMPACT_SERIALIZE_MAGIC = 0x31434750;
+const int COMPACT_SERIALIZE_VERSION = 2;
 
 void bgr32_to_rgb888(void *dst_rgb888, void *src_bgr32, int w, int h) {
     uint8_t *src = (uint8_t *)src_bgr32;
@@ -22,6 +31,62 @@ void bgr32_to_rgb888(void *dst_rgb888, void *src_bgr32, int w, int h) {
     }
 }
 
+void bgr32_to_rgb888_planar(void *dst_rgb888, void *src_bgr32, int w, int h) {
+    uint8_t *src = (uint8_t *)src_bgr32;
+    uint8_t *r = (uint8_t *)dst_rgb888;
+    uint8_t *g = r + w * h;
+    uint8_t *b = g + w * h;
+
+    for (int i = 0; i < w * h; i++) {
+        r[i] = src[2];
+        g[i] = src[1];
+        b[i] = src[0];
+        src += 4;
+    }
+}
+
+void bgr32_to_gray8(void *dst_gray8, void *src_bgr32, int w, int h) {
+    uint8_t *src = (uint8_t *)src_bgr32;
+    uint8_t *dst = (uint8_t *)dst_gray8;
+
+    // same weights as gymnasium's GrayscaleObservation, in fixed point
+    for (int i = 0; i < w * h; i++) {
+        dst[i] = (uint8_t)((2125 * src[2] + 7154 * src[1] + 721 * src[0]) / 10000);
+        src += 4;
+    }
+}
+
+void convert_bgr32(void *dst, void *src_bgr32, int w, int h, ObsFormat format) {
+    switch (format) {
+    case RGBFormat:
+        bgr32_to_rgb888(dst, src_bgr32, w, h);
+        break;
+    case RGBChannelsFirstFormat:
+        bgr32_to_rgb888_planar(dst, src_bgr32, w, h);
+        break;
+    case GrayFormat:
+    case GrayChannelsFirstFormat:
+        // with a single channel both layouts are the same in memory
+        bgr32_to_gray8(dst, src_bgr32, w, h);
+        break;
+    default:
+        fatal("invalid obs_format %d\n", format);
+    }
+}
+
+// per-channel max of two bgr32 frames, stored in dst
+void max_frames(uint32_t *dst, const uint32_t *src, int num_pixels) {
+    uint8_t *d = (uint8_t *)(dst);
+    const uint8_t *s = (const uint8_t *)(src);
+    for (int i = 0; i < num_pixels * 4; i++) {
+        d[i] = std::max(d[i], s[i]);
+    }
+}
+
+int obs_format_channels(ObsFormat format) {
+    return (format == GrayFormat || format == GrayChannelsFirstFormat) ? 1 : 3;
+}
+
 Game::Game(std::string name) : game_name(name) {
     timeout = 1000;
     episodes_remaining = 0;
@@ -48,6 +113,16 @@ void Game::parse_options(std::string name, VecOptions opts) {
     opts.consume_bool("use_backgrounds", &options.use_backgrounds);
     opts.consume_bool("center_agent", &options.center_agent);
     opts.consume_bool("use_sequential_levels", &options.use_sequential_levels);
+    opts.consume_bool("cache_static_tiles", &options.cache_static_tiles);
+    opts.consume_bool("cache_scaled_sprites", &options.cache_scaled_sprites);
+
+    int render_backend = QtRenderBackend;
+    opts.consume_int("render_backend", &render_backend);
+    fassert(render_backend == QtRenderBackend || render_backend == FastRenderBackend);
+    options.render_backend = static_cast<RenderBackend>(render_backend);
+
+    opts.consume_bool("collision_broadphase", &options.collision_broadphase);
+    opts.consume_int("broadphase_min_entities", &options.broadphase_min_entities);
 
     int dist_mode = EasyMode;
     opts.consume_int("distribution_mode", &dist_mode);
@@ -72,6 +147,26 @@ void Game::parse_options(std::string name, VecOptions opts) {
     opts.consume_int("game_type", &game_type);
 
     opts.ensure_empty();
+
+    // everything that game_reset() depends on besides the level seed, taken before any
+    // game_reset() since some games override options there
+    std::vector<char> prefix;
+    auto b = WriteBuffer(&prefix);
+    b.write_string(game_name);
+    b.write_int(options.paint_vel_info);
+    b.write_int(options.use_generated_assets);
+    b.write_int(options.use_monochrome_assets);
+    b.write_int(options.restrict_themes);
+    b.write_int(options.use_backgrounds);
+    b.write_int(options.center_agent);
+    b.write_int(options.debug_mode);
+    b.write_int(options.distribution_mode);
+    b.write_int(options.use_sequential_levels);
+    b.write_int(options.use_easy_jump);
+    b.write_int(options.plain_assets);
+    b.write_int(options.physics_mode);
+    b.write_int(game_type);
+    level_cache_prefix = std::string(prefix.data(), b.offset);
 }
 
 void Game::render_to_buf(void *dst, int w, int h, bool antialias) {
@@ -79,14 +174,25 @@ void Game::render_to_buf(void *dst, int w, int h, bool antialias) {
     // https://doc.qt.io/qt-5/qpainter.html#performance
     // so render to an RGB32 buffer and then convert it rather than render to RGB888 directly
     QImage img((uchar *)dst, w, h, w * 4, QImage::Format_RGB32);
-    QPainter p(&img);
+    QRect rect = QRect(0, 0, w, h);
+
+    render_antialias = antialias;
+    if (options.cache_scaled_sprites) {
+        begin_scaled_image_frame();
+    }
+
+    // the fast backend has no antialiasing, so smooth renders always go through Qt
+    if (options.render_backend == FastRenderBackend && !antialias) {
+        FastPainter p(&img);
+        game_draw(p, rect);
+        return;
+    }
 
+    QtPainter p(&img);
     if (antialias) {
         p.setRenderHint(QPainter::Antialiasing, true);
         p.setRenderHint(QPainter::SmoothPixmapTransform, true);
     }
-
-    QRect rect = QRect(0, 0, w, h);
     game_draw(p, rect);
 }
 
@@ -109,16 +215,89 @@ void Game::reset() {
     }
 
     rand_gen.seed(current_level_seed);
-    game_reset();
+    {
+        PerfTimer timer(perf_stats, PerfReset);
+        if (level_cache == nullptr) {
+            game_reset();
+        } else {
+            std::string key = level_cache_key();
+            if (!restore_cached_level(key)) {
+                game_reset();
+                auto snapshot = std::make_shared<LevelSnapshot>();
+                auto b = WriteBuffer(&snapshot->data);
+                b.rand_gens = &snapshot->rand_gens;
+                serialize(&b);
+                snapshot->data.resize(b.offset);
+                level_cache->put(key, snapshot);
+            }
+        }
+    }
 
     cur_time = 0;
-    total_reward = 0;
     episodes_remaining -= 1;
     action = default_action;
 }
 
+void Game::time_level_resets(const int32_t *seeds, int count, int64_t *time_ns) {
+    std::vector<char> saved;
+    auto wb = WriteBuffer(&saved);
+    // only the compact format keeps the running episode statistics
+    wb.compact = true;
+    serialize(&wb);
+
+    for (int i = 0; i < count; i++) {
+        // same seeding as reset(), but always generating the level instead of using the cache
+        current_level_seed = seeds[i];
+        rand_gen.seed(current_level_seed);
+        int64_t start = perf_now_ns();
+        game_reset();
+        time_ns[i] = perf_now_ns() - start;
+    }
+
+    auto rb = ReadBuffer(saved.data(), wb.offset);
+    restore_state(&rb);
+}
+
+void Game::restore_state(ReadBuffer *b) {
+    std::vector<uint8_t> saved_frame_history;
+    saved_frame_history.swap(frame_history);
+    int saved_frame_history_pos = frame_history_pos;
+
+    deserialize(b);
+
+    frame_history.swap(saved_frame_history);
+    frame_history_pos = saved_frame_history_pos;
+}
+
+std::string Game::level_cache_key() {
+    return level_cache_prefix + std::string((const char *)(&current_level_seed), sizeof(current_level_seed));
+}
+
+bool Game::restore_cached_level(const std::string &key) {
+    auto snapshot = level_cache->get(key);
+    if (snapshot == nullptr) {
+        return false;
+    }
+
+    // the snapshot was taken by whichever env generated the level first, so keep the
+    // fields that belong to this env and its episode history
+    RandGen saved_level_seed_rand_gen = level_seed_rand_gen;
+    std::vector<char> carryover;
+    auto wb = WriteBuffer(&carryover);
+    serialize_carryover(&wb);
+
+    auto b = ReadBuffer((char *)(snapshot->data.data()), snapshot->data.size());
+    b.rand_gens = &snapshot->rand_gens;
+    // with use_sequential_levels the episode, and so the frame stack, goes on in the new level
+    restore_state(&b);
+
+    level_seed_rand_gen = saved_level_seed_rand_gen;
+    auto rb = ReadBuffer(carryover.data(), wb.offset);
+    deserialize_carryover(&rb);
+    return true;
+}
+
 void Game::step() {
-    cur_time += 1;
     bool will_force_reset = false;
 
     if (action == -1) {
@@ -126,22 +305,53 @@ void Game::step() {
         will_force_reset = true;
     }
 
-    step_data.reward = 0;
-    step_data.done = false;
-    step_data.level_complete = false;
-    game_step();
+    float reward = 0.0f;
+    // frames rendered into pool_buf for max pooling
+    int pooled_frames = 0;
+    for (int i = 0; i < action_repeat; i++) {
+        cur_time += 1;
+
+        step_data.reward = 0;
+        step_data.done = false;
+        step_data.level_complete = false;
+        {
+            PerfTimer timer(perf_stats, PerfGameStep);
+            game_step();
+        }
+
+        step_data.done = step_data.done || will_force_reset || (cur_time >= timeout);
+        reward += step_data.reward;
+        total_reward += step_data.reward;
 
-    step_data.done = step_data.done || will_force_reset || (cur_time >= timeout);
-    total_reward += step_data.reward;
+        if (step_data.reward != 0) {
+            last_reward_timer = 10;
+            last_reward = step_data.reward;
+        }
+
+        // the episode or level ends here, the observation is the first frame of the next one
+        if (step_data.done) {
+            break;
+        }
 
-    if (step_data.reward != 0) {
-        last_reward_timer = 10;
-        last_reward = step_data.reward;
+        if (i >= action_repeat - max_pool_last && i < action_repeat - 1) {
+            pool_buf.resize(RES_W * RES_H);
+            PerfTimer timer(perf_stats, PerfRender);
+            if (pooled_frames == 0) {
+                render_to_buf(pool_buf.data(), RES_W, RES_H, false);
+            } else {
+                render_to_buf(render_buf, RES_W, RES_H, false);
+                max_frames(pool_buf.data(), render_buf, RES_W * RES_H);
+            }
+            pooled_frames++;
+        }
     }
+    step_data.reward = reward;
 
     prev_level_seed = current_level_seed;
 
-    if (step_data.done) {
+    // the repeat stopped at the end of a level, the frames in pool_buf show the old one
+    bool level_changed = step_data.done;
+    if (level_changed) {
         reset();
     }
 
@@ -151,25 +361,114 @@ void Game::step() {
 
     episode_done = step_data.done;
 
-    observe();
+    episode_steps += 1;
+    if (episode_done) {
+        last_episode_return = episode_stats_known ? total_reward : NAN;
+        last_episode_length = episode_stats_known ? episode_steps : -1;
+        total_reward = 0;
+        episode_steps = 0;
+        episode_stats_known = true;
+    }
+
+    if (pooled_frames > 0 && !level_changed) {
+        {
+            PerfTimer timer(perf_stats, PerfRender);
+            render_to_buf(render_buf, RES_W, RES_H, false);
+            max_frames(render_buf, pool_buf.data(), RES_W * RES_H);
+        }
+        write_observation();
+    } else {
+        observe();
+    }
 }
 
 void Game::observe() {
-    render_to_buf(render_buf, RES_W, RES_H, false);
-    bgr32_to_rgb888(obs_bufs[0], render_buf, RES_W, RES_H);
+    {
+        PerfTimer timer(perf_stats, PerfRender);
+        render_to_buf(render_buf, RES_W, RES_H, false);
+    }
+    write_observation();
+}
+
+void Game::copy_unserialized_state(const Game &src) {
+    fassert(game_name == src.game_name);
+    fassert(frame_stack == src.frame_stack && obs_format == src.obs_format);
+    memcpy(render_buf, src.render_buf, sizeof(render_buf));
+    if (frame_stack > 1) {
+        frame_history = src.frame_history;
+        // write_observation() pushes render_buf again, in the slot it came from
+        frame_history_pos = (src.frame_history_pos + frame_stack - 1) % frame_stack;
+    }
+    write_observation();
+}
+
+void Game::write_observation() {
+    {
+        PerfTimer timer(perf_stats, PerfConvert);
+        if (frame_stack == 1) {
+            convert_bgr32(obs_bufs[0], render_buf, RES_W, RES_H, obs_format);
+        } else {
+            // a new episode starts with an empty stack
+            if (step_data.done) {
+                clear_frame_history();
+            }
+            int frame_size = RES_W * RES_H * obs_format_channels(obs_format);
+            frame_history_pos = (frame_history_pos + 1) % frame_stack;
+            convert_bgr32(&frame_history[frame_history_pos * frame_size], render_buf, RES_W, RES_H, obs_format);
+            write_stacked_obs((uint8_t *)(obs_bufs[0]));
+        }
+    }
     *reward_ptr = step_data.reward;
     *first_ptr = (uint8_t)step_data.done;
     *(int32_t *)(info_bufs[info_name_to_offset.at("prev_level_seed")]) = (int32_t)(prev_level_seed);
     *(uint8_t *)(info_bufs[info_name_to_offset.at("prev_level_complete")]) = (uint8_t)(step_data.level_complete);
     *(int32_t *)(info_bufs[info_name_to_offset.at("level_seed")]) = (int32_t)(current_level_seed);
+    *(float *)(info_bufs[info_name_to_offset.at("episode_return")]) = step_data.done ? last_episode_return : 0.0f;
+    *(int32_t *)(info_bufs[info_name_to_offset.at("episode_length")]) = step_data.done ? last_episode_length : 0;
+}
+
+void Game::clear_frame_history() {
+    int frame_size = RES_W * RES_H * obs_format_channels(obs_format);
+    frame_history.assign((size_t)frame_stack * frame_size, 0);
+    frame_history_pos = frame_stack - 1;
+}
+
+void Game::write_stacked_obs(uint8_t *dst) {
+    int channels = obs_format_channels(obs_format);
+    int num_pixels = RES_W * RES_H;
+    int frame_size = num_pixels * channels;
+    bool channels_first = obs_format == RGBChannelsFirstFormat || obs_format == GrayChannelsFirstFormat;
+
+    // oldest frame first
+    for (int i = 0; i < frame_stack; i++) {
+        const uint8_t *src = &frame_history[((frame_history_pos + 1 + i) % frame_stack) * frame_size];
+        if (channels_first) {
+            memcpy(dst + i * frame_size, src, frame_size);
+        } else {
+            int stride = frame_stack * channels;
+            uint8_t *d = dst + i * channels;
+            for (int p = 0; p < num_pixels; p++) {
+                for (int c = 0; c < channels; c++) {
+                    d[c] = src[c];
+                }
+                src += channels;
+                d += stride;
+            }
+        }
+    }
 }
 
 void Game::game_init() {
 }
 
 void Game::serialize(WriteBuffer *b) {
-    b->write_int(SERIALIZE_VERSION);
-    
+    if (b->compact) {
+        b->write_bytes(&COMPACT_SERIALIZE_MAGIC, sizeof(COMPACT_SERIALIZE_MAGIC));
+        b->write_int(COMPACT_SERIALIZE_VERSION);
+    } else {
+        b->write_int(SERIALIZE_VERSION);
+    }
+
     b->write_string(game_name);
 
     b->write_int(options.paint_vel_info);
@@ -219,6 +518,16 @@ void Game::serialize(WriteBuffer *b) {
     b->write_int(cur_time);
     b->write_int(is_waiting_for_step);
 
+    // the episode statistics were added after the default format was fixed, keep them out of
+    // it so that states saved before still load and save to the same bytes
+    if (b->compact) {
+        b->write_float(total_reward);
+        b->write_int(episode_steps);
+        b->write_float(last_episode_return);
+        b->write_int(last_episode_length);
+        b->write_int(episode_stats_known);
+    }
+
     // don't serialize these, since they are pointers, and will likely have incorrect values
     // if deserialized into another game object
     // int32_t *action_ptr;
@@ -228,8 +537,68 @@ void Game::serialize(WriteBuffer *b) {
     // uint8_t *first_ptr = nullptr;
 }
 
+void Game::serialize_carryover(WriteBuffer *b) {
+    // level_seed_rand_gen is carried over as well, but copied directly since its text form
+    // is slow to produce
+    b->write_int(level_seed_low);
+    b->write_int(level_seed_high);
+    b->write_int(game_n);
+
+    b->write_float(step_data.reward);
+    b->write_int(step_data.done);
+    b->write_int(step_data.level_complete);
+
+    b->write_int(prev_level_seed);
+    b->write_int(episodes_remaining);
+    b->write_int(episode_done);
+
+    b->write_int(last_reward_timer);
+    b->write_float(last_reward);
+
+    b->write_int(is_waiting_for_step);
+
+    b->write_float(total_reward);
+    b->write_int(episode_steps);
+    b->write_float(last_episode_return);
+    b->write_int(last_episode_length);
+    b->write_int(episode_stats_known);
+}
+
+void Game::deserialize_carryover(ReadBuffer *b) {
+    level_seed_low = b->read_int();
+    level_seed_high = b->read_int();
+    game_n = b->read_int();
+
+    step_data.reward = b->read_float();
+    step_data.done = b->read_int();
+    step_data.level_complete = b->read_int();
+
+    prev_level_seed = b->read_int();
+    episodes_remaining = b->read_int();
+    episode_done = b->read_int();
+
+    last_reward_timer = b->read_int();
+    last_reward = b->read_float();
+
+    is_waiting_for_step = b->read_int();
+
+    total_reward = b->read_float();
+    episode_steps = b->read_int();
+    last_episode_return = b->read_float();
+    last_episode_length = b->read_int();
+    episode_stats_known = b->read_int();
+}
+
 void Game::deserialize(ReadBuffer *b) {
-    fassert(SERIALIZE_VERSION == b->read_int());
+    // both formats can be read, the compact one is told apart by its first 4 bytes
+    int32_t version;
+    b->read_bytes(&version, sizeof(version));
+    if (version == COMPACT_SERIALIZE_MAGIC) {
+        b->compact = true;
+        fassert(COMPACT_SERIALIZE_VERSION == b->read_int());
+    } else {
+        fassert(SERIALIZE_VERSION == version);
+    }
     fassert(game_name == b->read_string());
 
     options.paint_vel_info = b->read_int();
@@ -275,4 +644,25 @@ void Game::deserialize(ReadBuffer *b) {
 
     cur_time = b->read_int();
     is_waiting_for_step = b->read_int();
+
+    if (b->compact) {
+        total_reward = b->read_float();
+        episode_steps = b->read_int();
+        last_episode_return = b->read_float();
+        last_episode_length = b->read_int();
+        episode_stats_known = b->read_int();
+    } else {
+        // the statistics of the episode in progress are lost, report them as unknown when it
+        // ends rather than counting from the restore
+        total_reward = 0.0f;
+        episode_steps = 0;
+        last_episode_return = NAN;
+        last_episode_length = -1;
+        episode_stats_known = false;
+    }
+
+    // previous frames are not part of the saved state, so restart the stack
+    if (frame_stack > 1) {
+        clear_frame_history();
+    }
 }
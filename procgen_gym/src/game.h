@@ -17,6 +17,9 @@ Base class used for all games, all games must inherit from this
 #include "object-ids.h"
 #include "game-registry.h"
 #include "buffer.h"
+#include "perf-stats.h"
+#include "level-cache.h"
+#include "painter.h"
 
 // We want all games to have same observation space. So all these
 // constants here related to observation space are constants forever.
@@ -25,8 +28,6 @@ const int RES_H = 64;
 
 const int RENDER_RES = 512;
 
-void bgr32_to_rgb888(void *dst_rgb888, void *src_bgr32, int w, int h);
-
 class VecOptions;
 
 enum DistributionMode {
@@ -36,6 +37,21 @@ enum DistributionMode {
     MemoryMode = 10,
 };
 
+// should match OBS_FORMAT_DICT in env.py
+enum ObsFormat {
+    RGBFormat = 0,
+    GrayFormat = 1,
+    RGBChannelsFirstFormat = 2,
+    GrayChannelsFirstFormat = 3,
+};
+
+void bgr32_to_rgb888(void *dst_rgb888, void *src_bgr32, int w, int h);
+void bgr32_to_rgb888_planar(void *dst_rgb888, void *src_bgr32, int w, int h);
+void bgr32_to_gray8(void *dst_gray8, void *src_bgr32, int w, int h);
+void convert_bgr32(void *dst, void *src_bgr32, int w, int h, ObsFormat format);
+void max_frames(uint32_t *dst, const uint32_t *src, int num_pixels);
+int obs_format_channels(ObsFormat format);
+
 struct StepData {
     float reward = 0.0f;
     bool done = false;
@@ -52,6 +68,14 @@ struct GameOptions {
     int debug_mode = 0;
     DistributionMode distribution_mode = HardMode;
     bool use_sequential_levels = false;
+    // only change how observations are drawn, so they are neither serialized nor part of the level
+    bool cache_static_tiles = false;
+    bool cache_scaled_sprites = false;
+    RenderBackend render_backend = QtRenderBackend;
+    // finds the same collisions in the same order, so it is not serialized either
+    bool collision_broadphase = false;
+    // with fewer entities than this, testing every pair is faster than keeping the grid up to date
+    int broadphase_min_entities = 96;
 
     // coinrun_old
     bool use_easy_jump = false;
@@ -65,6 +89,19 @@ class Game {
     std::map<std::string, int> info_name_to_offset;
 
     GameOptions options;
+    ObsFormat obs_format = RGBFormat;
+
+    // when frame_stack > 1, the last frame_stack converted frames are kept in a ring and
+    // the observation is written with the frames stacked along the channel axis
+    int frame_stack = 1;
+    std::vector<uint8_t> frame_history;
+    int frame_history_pos = 0;
+
+    // each step applies the action for action_repeat game steps and sums their rewards, the
+    // observation is the per-channel max of the last max_pool_last frames, only those frames
+    // are rendered
+    int action_repeat = 1;
+    int max_pool_last = 1;
 
     bool initial_reset_complete = false;
     bool grid_step = false;
@@ -93,11 +130,20 @@ class Game {
     int fixed_asset_seed = 0;
 
     uint32_t render_buf[RES_W * RES_H];
+    // whether the render_to_buf() call in progress draws with antialiasing and smooth scaling
+    bool render_antialias = false;
 
     int cur_time = 0;
 
     bool is_waiting_for_step = false;
 
+    // per-phase timings, only collected when perf_stats.enabled is set
+    PerfStats perf_stats;
+
+    // when set, reset() restores previously generated levels from this cache instead of
+    // calling game_reset(), shared by all games of a VecGame
+    std::shared_ptr<LevelCache> level_cache;
+
     // pointers to buffers
     int32_t *action_ptr;
     std::vector<void *> obs_bufs;
@@ -110,17 +156,47 @@ class Game {
     void reset();
     void render_to_buf(void *buf, int w, int h, bool antialias);
     void parse_options(std::string name, VecOptions opt_vec);
+    void clear_frame_history();
+    // time game_reset() for each of the level seeds, the game state is restored afterwards
+    void time_level_resets(const int32_t *seeds, int count, int64_t *time_ns);
 
     virtual ~Game() = 0;
     virtual void observe();
+    // after this game was deserialized from the state of src, copy what the state leaves out
+    // (the last frame and the frame stack) and write the observation
+    // without rendering it again
+    void copy_unserialized_state(const Game &src);
     virtual void game_init() = 0;
     virtual void game_reset() = 0;
     virtual void game_step() = 0;
-    virtual void game_draw(QPainter &p, const QRect &rect) = 0;
+    virtual void game_draw(Painter &p, const QRect &rect) = 0;
     virtual void serialize(WriteBuffer *b);
     virtual void deserialize(ReadBuffer *b);
 
+    // state that is carried over from the previous episode instead of being set up by
+    // game_reset(), kept when a level is restored from the level cache
+    virtual void serialize_carryover(WriteBuffer *b);
+    virtual void deserialize_carryover(ReadBuffer *b);
+
   private:
+    void write_observation();
+    // deserialize() without restarting the frame stack, for restores in the middle of an episode
+    void restore_state(ReadBuffer *b);
+    // per-channel max of the frames rendered for max_pool_last, except the last one
+    std::vector<uint32_t> pool_buf;
+    void write_stacked_obs(uint8_t *dst);
+    std::string level_cache_key();
+    std::string level_cache_prefix;
+    bool restore_cached_level(const std::string &key);
+
     int reset_count = 0;
+    // return and length in steps of the episode in progress, they carry over resets that
+    // don't end the episode (use_sequential_levels)
     float total_reward = 0.0f;
+    int episode_steps = 0;
+    // the same for the last episode that ended, NaN and -1 if they aren't known
+    float last_episode_return = 0.0f;
+    int last_episode_length = 0;
+    // false if a state without the statistics was restored during the episode in progress
+    bool episode_stats_known = true;
 };
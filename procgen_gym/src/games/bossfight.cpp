@@ -333,7 +333,7 @@ class BossfightGame : public BasicAbstractGame {
             float ent_y = rand_gen.rand01() * (BOTTOM_MARGIN - min_barrier_y - barrier_r) + min_barrier_y;
             float ent_x = rand_gen.rand01() * (main_width - 2 * barrier_r) + barrier_r;
 
-            auto ent = std::make_shared<Entity>(ent_x, ent_y, 0, 0, barrier_r, BARRIER);
+            auto ent = new_entity(ent_x, ent_y, 0, 0, barrier_r, BARRIER);
             choose_random_theme(ent);
             match_aspect_ratio(ent);
             ent->health = 3;
@@ -475,6 +475,22 @@ class BossfightGame : public BasicAbstractGame {
         fassert(shields_idx >= 0);
         shields = entities[shields_idx];
     }
+
+    void serialize_carryover(WriteBuffer *b) override {
+        BasicAbstractGame::serialize_carryover(b);
+        b->write_float(rand_pct);
+        b->write_float(rand_fire_pct);
+        b->write_float(rand_pct_x);
+        b->write_float(rand_pct_y);
+    }
+
+    void deserialize_carryover(ReadBuffer *b) override {
+        BasicAbstractGame::deserialize_carryover(b);
+        rand_pct = b->read_float();
+        rand_fire_pct = b->read_float();
+        rand_pct_x = b->read_float();
+        rand_pct_y = b->read_float();
+    }
 };
 
 REGISTER_GAME(NAME, BossfightGame);
@@ -159,7 +159,7 @@ class CaveFlyerGame : public BasicAbstractGame {
             room_manager->update();
         }
 
-        std::set<int> best_room;
+        std::vector<int> best_room;
         room_manager->find_best_room(best_room);
         fassert(best_room.size() > 0);
 
@@ -190,8 +190,7 @@ class CaveFlyerGame : public BasicAbstractGame {
         bool should_prune = options.distribution_mode != MemoryMode;
 
         if (should_prune) {
-            std::set<int> wide_path;
-            wide_path.insert(goal_path.begin(), goal_path.end());
+            std::vector<int> wide_path = goal_path;
             room_manager->expand_room(wide_path, 4);
 
             for (int i = 0; i < grid_size; i++) {
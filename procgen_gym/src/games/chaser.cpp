@@ -108,7 +108,7 @@ class ChaserGame : public BasicAbstractGame {
         return BasicAbstractGame::image_for_type(type);
     }
 
-    void draw_grid_obj(QPainter &p, const QRectF &rect, int type, int theme) override {
+    void draw_grid_obj(Painter &p, const QRectF &rect, int type, int theme) override {
         if (type == ORB) {
             p.fillRect(QRectF(rect.x() + rect.width() * (1 - ORB_DIM) / 2, rect.y() + rect.height() * (1 - ORB_DIM) / 2, rect.width() * ORB_DIM, rect.height() * ORB_DIM), QColor(0, 255, 0));
         } else {
@@ -134,7 +134,7 @@ class Jumper : public BasicAbstractGame {
         return BasicAbstractGame::image_for_type(type);
     }
 
-    void draw_compass(QPainter &p, const QRect &rect) {
+    void draw_compass(Painter &p, const QRect &rect) {
         QRectF compass_rect = get_abs_rect(view_dim - compass_dim - .25, .25, compass_dim, compass_dim);
         QColor clock_color = QColor(168, 166, 158);
 
@@ -168,7 +168,7 @@ class Jumper : public BasicAbstractGame {
         }
     }
 
-    void game_draw(QPainter &p, const QRect &rect) override {
+    void game_draw(Painter &p, const QRect &rect) override {
         BasicAbstractGame::game_draw(p, rect);
 
         if (options.distribution_mode != MemoryMode) {
@@ -273,7 +273,7 @@ class Jumper : public BasicAbstractGame {
             set_obj(main_width - 1, i, CAVEWALL);
         }
 
-        std::set<int> best_room;
+        std::vector<int> best_room;
         room_manager->find_best_room(best_room);
         fassert(best_room.size() > 0);
 
@@ -309,8 +309,7 @@ class Jumper : public BasicAbstractGame {
         bool should_prune = options.distribution_mode != MemoryMode;
 
         if (should_prune) {
-            std::set<int> wide_path;
-            wide_path.insert(goal_path.begin(), goal_path.end());
+            std::vector<int> wide_path = goal_path;
             room_manager->expand_room(wide_path, 4);
 
             for (int i = 0; i < grid_size; i++) {
@@ -22,6 +22,12 @@ class MinerGame : public BasicAbstractGame {
   public:
     int diamonds_remaining = 0;
 
+    // cells that game_step() has to look at, since something they depend on changed after
+    // they were last updated, all other cells would be left as they are
+    std::vector<uint8_t> cell_marks;
+    int prev_agent_idx = 0;
+    int prev_agent_cell = 0;
+
     MinerGame()
         : BasicAbstractGame(NAME) {
         main_width = 20;
@@ -33,6 +39,8 @@ class MinerGame : public BasicAbstractGame {
 
         out_of_bounds_object = OOB_WALL;
         visibility = 8.0;
+
+        track_grid_changes = true;
     }
 
     void load_background_images() override {
@@ -244,6 +252,27 @@ class MinerGame : public BasicAbstractGame {
         }
     }
 
+    // mark the cells whose update in game_step() looks at cell, that is the cells on its row
+    // and the row above within one column of it
+    void mark_dependents(int cell) {
+        int main_area = main_width * main_height;
+        for (int dy = 0; dy <= 1; dy++) {
+            for (int dx = -1; dx <= 1; dx++) {
+                int idx = cell + dy * main_width + dx;
+                if (0 <= idx && idx < main_area) {
+                    cell_marks[idx] = 1;
+                }
+            }
+        }
+    }
+
+    void mark_changed_cells() {
+        for (int cell : changed_cells) {
+            mark_dependents(cell);
+        }
+        changed_cells.clear();
+    }
+
     void game_step() override {
         BasicAbstractGame::game_step();
 
@@ -265,21 +294,41 @@ class MinerGame : public BasicAbstractGame {
         }
 
         int main_area = main_width * main_height;
+        int agent_idx = (agent->y - .5) * main_width + (agent->x - .5);
+        int agent_cell = get_agent_index();
 
-        int diamonds_count = 0;
-
+        if (all_cells_changed || (int)(cell_marks.size()) != main_area) {
+            cell_marks.assign(main_area, 1);
+            all_cells_changed = false;
+        }
+        mark_changed_cells();
+        // is_free() and the check for the agent below depend on where the agent is, and on
+        // where it was when the cells were last updated
+        mark_dependents(agent_idx);
+        mark_dependents(agent_cell);
+        mark_dependents(prev_agent_idx);
+        mark_dependents(prev_agent_cell);
+        prev_agent_idx = agent_idx;
+        prev_agent_cell = agent_cell;
+
+        // a scan over every cell counts each diamond once, and counts it again whenever it
+        // slides right onto a cell that the scan has yet to reach
+        int diamonds_count = count_obj(DIAMOND) + count_obj(MOVING_DIAMOND);
+
+        // cells are updated in the same order as a scan over every cell, and marks added for
+        // cells further along are picked up by this loop just like the scan would see them
         for (int idx = 0; idx < main_area; idx++) {
+            if (!cell_marks[idx]) {
+                continue;
+            }
+            cell_marks[idx] = 0;
+
             int obj = get_obj(idx);
 
             int obj_x = idx % main_width;
-            int agent_idx = (agent->y - .5) * main_width + (agent->x - .5);
 
             int stat_type = get_stationary_type(obj);
 
-            if (stat_type == DIAMOND) {
-                diamonds_count++;
-            }
-
             if (obj == BOULDER || obj == MOVING_BOULDER || obj == DIAMOND || obj == MOVING_DIAMOND) {
                 int below_idx = idx - main_width;
                 int obj2 = get_obj(below_idx);
@@ -290,15 +339,21 @@ class MinerGame : public BasicAbstractGame {
                     set_obj(below_idx, get_moving_type(obj));
                 } else if (agent_is_below && is_moving(obj)) {
                     step_data.done = true;
+                    cell_marks[idx] = 1;
                 } else if (is_round(obj2) && obj_x > 0 && is_free(idx - 1) && is_free(idx - main_width - 1)) {
                     set_obj(idx, SPACE);
                     set_obj(idx - 1, get_stationary_type(obj));
                 } else if (is_round(obj2) && obj_x < main_width - 1 && is_free(idx + 1) && is_free(idx - main_width + 1)) {
                     set_obj(idx, SPACE);
                     set_obj(idx + 1, stat_type);
+                    if (stat_type == DIAMOND) {
+                        diamonds_count++;
+                    }
                 } else {
                     set_obj(idx, stat_type);
                 }
+
+                mark_changed_cells();
             }
         }
 
@@ -322,6 +377,18 @@ class MinerGame : public BasicAbstractGame {
         BasicAbstractGame::deserialize(b);
         diamonds_remaining = b->read_int();
     }
+
+    // diamonds_remaining is only recounted at the end of a step, so the first step of an
+    // episode still sees the count from the previous one
+    void serialize_carryover(WriteBuffer *b) override {
+        BasicAbstractGame::serialize_carryover(b);
+        b->write_int(diamonds_remaining);
+    }
+
+    void deserialize_carryover(ReadBuffer *b) override {
+        BasicAbstractGame::deserialize_carryover(b);
+        diamonds_remaining = b->read_int();
+    }
 };
 
 REGISTER_GAME(NAME, MinerGame);
\ No newline at end of file
@@ -163,7 +163,7 @@ class Ninja : public BasicAbstractGame {
         return BasicAbstractGame::image_for_type(type);
     }
 
-    void game_draw(QPainter &p, const QRect &rect) override {
+    void game_draw(Painter &p, const QRect &rect) override {
         BasicAbstractGame::game_draw(p, rect);
 
         QColor charge_color = QColor(66, 245, 135);
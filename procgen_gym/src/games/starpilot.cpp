@@ -104,7 +104,7 @@ class StarPilotGame : public BasicAbstractGame {
         }
     }
 
-    void game_draw(QPainter &p, const QRect &rect) override {
+    void game_draw(Painter &p, const QRect &rect) override {
         float scale = rect.height() / main_height;
 
         QColor bg_color = QColor(0, 0, 0);
@@ -301,7 +301,7 @@ class StarPilotGame : public BasicAbstractGame {
                     vx *= -1;
                 }
 
-                auto spawner = std::make_shared<Entity>(x_pos, y_pos, vx, vy, r, type);
+                auto spawner = new_entity(x_pos, y_pos, vx, vy, r, type);
                 spawner->fire_time = fire_time;
                 spawner->spawn_time = spawn_time;
                 spawner->health = health;
@@ -385,7 +385,7 @@ class StarPilotGame : public BasicAbstractGame {
                 b_vx = b_vx * bv_scale;
                 b_vy = b_vy * bv_scale;
 
-                std::shared_ptr<Entity> new_bullet(new Entity(m->x, m->y, b_vx, b_vy, bullet_r, bullet_type));
+                auto new_bullet = new_entity(m->x, m->y, b_vx, b_vy, bullet_r, bullet_type);
                 new_bullet->face_direction(b_vx, b_vy, -1 * PI / 2);
                 entities.push_back(new_bullet);
             }
@@ -413,7 +413,7 @@ class StarPilotGame : public BasicAbstractGame {
             float vy = sin(theta) * v_scale;
             float x_off = agent->rx * cos(theta);
 
-            auto bullet = std::make_shared<Entity>(agent->x + x_off, agent->y, vx, vy, bullet_r, BULLET_PLAYER);
+            auto bullet = new_entity(agent->x + x_off, agent->y, vx, vy, bullet_r, BULLET_PLAYER);
             bullet->collides_with_entities = true;
             bullet->face_direction(vx, vy);
             bullet->rotation -= PI / 2;
@@ -421,7 +421,7 @@ class StarPilotGame : public BasicAbstractGame {
         }
 
         if (cur_time == SHOOTER_WIN_TIME) {
-            auto finish = std::make_shared<Entity>(main_width, main_height / 2, -1 * hp_slow_v * V_SCALE, 0, 2, main_height / 2, FINISH_LINE);
+            auto finish = new_entity(main_width, main_height / 2, -1 * hp_slow_v * V_SCALE, 0, 2, main_height / 2, FINISH_LINE);
             choose_random_theme(finish);
             match_aspect_ratio(finish, false);
             finish->x = main_width + finish->rx;
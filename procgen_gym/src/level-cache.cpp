@@ -0,0 +1,53 @@
+#include "level-cache.h"
+
+LevelCache::LevelCache(size_t _max_bytes) : max_bytes(_max_bytes) {
+}
+
+std::shared_ptr<const LevelSnapshot> LevelCache::get(const std::string &key) {
+    std::unique_lock<std::mutex> lock(mutex);
+    auto it = index.find(key);
+    if (it == index.end()) {
+        misses++;
+        return nullptr;
+    }
+    hits++;
+    entries.splice(entries.begin(), entries, it->second);
+    return it->second->snapshot;
+}
+
+void LevelCache::put(const std::string &key, std::shared_ptr<const LevelSnapshot> snapshot) {
+    size_t size = snapshot->num_bytes() + key.size();
+    if (size > max_bytes) {
+        return;
+    }
+
+    std::unique_lock<std::mutex> lock(mutex);
+    auto it = index.find(key);
+    if (it != index.end()) {
+        // another env generated the same level in the meantime, keep the existing snapshot
+        entries.splice(entries.begin(), entries, it->second);
+        return;
+    }
+
+    while (total_bytes + size > max_bytes) {
+        const auto &oldest = entries.back();
+        total_bytes -= oldest.snapshot->num_bytes() + oldest.key.size();
+        index.erase(oldest.key);
+        entries.pop_back();
+        evictions++;
+    }
+
+    entries.push_front(Entry{key, snapshot});
+    index[key] = entries.begin();
+    total_bytes += size;
+}
+
+size_t LevelCache::num_entries() {
+    std::unique_lock<std::mutex> lock(mutex);
+    return entries.size();
+}
+
+size_t LevelCache::num_bytes() {
+    std::unique_lock<std::mutex> lock(mutex);
+    return total_bytes;
+}
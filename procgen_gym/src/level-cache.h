@@ -0,0 +1,58 @@
+#pragma once
+
+/*
+
+Memory bounded LRU cache of serialized game states taken right after a level was
+generated, so that resets to a level that was seen before can skip level generation
+
+*/
+
+#include <cstdint>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <unordered_map>
+#include <vector>
+#include "randgen.h"
+
+struct LevelSnapshot {
+    std::vector<char> data;
+    // the random generators written to data, in order, so that restoring the snapshot
+    // doesn't need to parse their text form
+    std::vector<RandGen> rand_gens;
+
+    size_t num_bytes() const {
+        return data.size() + rand_gens.size() * sizeof(RandGen);
+    }
+};
+
+class LevelCache {
+  public:
+    int64_t hits = 0;
+    int64_t misses = 0;
+    int64_t evictions = 0;
+
+    LevelCache(size_t _max_bytes);
+
+    // returns nullptr and counts a miss if there is no snapshot for key
+    std::shared_ptr<const LevelSnapshot> get(const std::string &key);
+    void put(const std::string &key, std::shared_ptr<const LevelSnapshot> snapshot);
+
+    size_t num_entries();
+    size_t num_bytes();
+
+  private:
+    struct Entry {
+        std::string key;
+        std::shared_ptr<const LevelSnapshot> snapshot;
+    };
+
+    // games on different stepping threads share a cache, so every method takes this lock
+    std::mutex mutex;
+    size_t max_bytes;
+    size_t total_bytes = 0;
+    // most recently used first
+    std::list<Entry> entries;
+    std::unordered_map<std::string, std::list<Entry>::iterator> index;
+};
@@ -15,6 +15,7 @@ MazeGen::MazeGen(RandGen *_rand_gen, int _maze_dim) {
     array_dim = maze_dim + 2;
     cell_sets.resize(array_dim * array_dim);
     cell_sets_idxs.resize(array_dim * array_dim);
+    is_free_cell.resize(array_dim * array_dim);
     free_cells.resize(array_dim * array_dim);
     grid.resize(array_dim, array_dim);
 }
@@ -26,9 +27,9 @@ int MazeGen::lookup(int x, int y) {
 void MazeGen::set_free_cell(int x, int y) {
     grid.set(x + MAZE_OFFSET, y + MAZE_OFFSET, SPACE);
     int cell = maze_dim * y + x;
-    if (free_cell_set.find(cell) == free_cell_set.end()) {
+    if (!is_free_cell[cell]) {
         free_cells[num_free_cells] = cell;
-        free_cell_set.insert(cell);
+        is_free_cell[cell] = 1;
         num_free_cells += 1;
     }
 }
@@ -66,23 +67,26 @@ void MazeGen::get_neighbors(int idx, int type, std::vector<int> &neighbors) {
     }
 }
 
-int MazeGen::expand_to_type(std::set<int> &s0, std::set<int> &s1, int type) {
-    std::set<int> curr = s0;
-
-    std::vector<int> target_elems;
-    std::vector<int> adj_space;
+int MazeGen::expand_to_type(const std::vector<uint8_t> &s0, std::vector<uint8_t> &s1, int type) {
+    // each ring is visited in ascending cell order, which decides the target that is found
+    frontier.clear();
+    for (int i = 0; i < int(s0.size()); i++) {
+        if (s0[i]) {
+            frontier.push_back(i);
+        }
+    }
 
-    while (curr.size() > 0) {
-        std::set<int> next;
+    while (frontier.size() > 0) {
+        next_frontier.clear();
 
-        for (int elem : curr) {
+        for (int elem : frontier) {
             get_neighbors(elem, type, target_elems);
             get_neighbors(elem, SPACE, adj_space);
 
             for (int j : adj_space) {
-                if (!set_contains(s0, j) && !set_contains(s1, j)) {
-                    next.insert(j);
-                    s1.insert(j);
+                if (!s0[j] && !s1[j]) {
+                    next_frontier.push_back(j);
+                    s1[j] = 1;
                 }
             }
 
@@ -91,7 +95,8 @@ int MazeGen::expand_to_type(std::set<int> &s0, std::set<int> &s1, int type) {
             }
         }
 
-        curr = next;
+        std::sort(next_frontier.begin(), next_frontier.end());
+        std::swap(frontier, next_frontier);
     }
 
     return -1;
@@ -121,17 +126,10 @@ void MazeGen::generate_maze() {
     std::vector<Wall> walls;
 
     num_free_cells = 0;
-    free_cell_set.clear();
-
-    std::set<int> *s0 = &cell_sets[0];
-    s0->clear();
-    s0->insert(0);
-    cell_sets_idxs[0] = 0;
+    std::fill(is_free_cell.begin(), is_free_cell.end(), 0);
 
-    for (int i = 1; i < maze_dim * maze_dim; i++) {
-        std::set<int> *s1 = &cell_sets[i];
-        s1->clear();
-        s1->insert(i);
+    for (int i = 0; i < maze_dim * maze_dim; i++) {
+        cell_sets[i].assign(1, i);
         cell_sets_idxs[i] = i;
     }
 
@@ -156,9 +154,7 @@ void MazeGen::generate_maze() {
         Wall wall = walls[n];
 
         int s0_idx = lookup(wall.x1, wall.y1);
-        s0 = &cell_sets[s0_idx];
         int s1_idx = lookup(wall.x2, wall.y2);
-        std::set<int> *s1 = &cell_sets[s1_idx];
 
         int x0 = (wall.x1 + wall.x2) / 2;
         int y0 = (wall.y1 + wall.y2) / 2;
@@ -173,13 +169,16 @@ void MazeGen::generate_maze() {
             set_free_cell(x0, y0);
             set_free_cell(wall.x2, wall.y2);
 
-            s1->insert(s0->begin(), s0->end());
-            s1->insert(center);
-
-            std::set<int>::iterator it;
-            for (it = s1->begin(); it != s1->end(); ++it) {
-                cell_sets_idxs[*it] = s1_idx;
+            // the sets are disjoint and the wall center is in neither, so merging only needs
+            // to move the cells of s0 and the center over to s1
+            std::vector<int> &s0 = cell_sets[s0_idx];
+            std::vector<int> &s1 = cell_sets[s1_idx];
+            s0.push_back(center);
+            for (int cell : s0) {
+                cell_sets_idxs[cell] = s1_idx;
             }
+            s1.insert(s1.end(), s0.begin(), s0.end());
+            s0.clear();
         }
 
         walls.erase(walls.begin() + n);
@@ -253,25 +252,31 @@ void MazeGen::generate_maze_with_doors(int num_doors) {
         grid.set_index(agent_cell, AGENT_OBJ);
     }
 
-    std::set<int> s0;
-    s0.insert(agent_cell);
+    int num_cells = array_dim * array_dim;
+    std::vector<uint8_t> s0(num_cells, 0);
+    std::vector<uint8_t> s1(num_cells, 0);
+    s0[agent_cell] = 1;
 
     for (int door_num = 0; door_num < num_doors + 1; door_num++) {
-        std::set<int> s1;
+        std::fill(s1.begin(), s1.end(), 0);
         int found_door = -1;
 
         if (door_num < num_doors) {
             found_door = expand_to_type(s0, s1, DOOR_OBJ);
             grid.set_index(found_door, DOOR_OBJ + door_num + 1);
-            s0.insert(s1.begin(), s1.end());
+            for (int i = 0; i < num_cells; i++) {
+                s0[i] |= s1[i];
+            }
         }
 
         expand_to_type(s0, s1, -999);
 
         std::vector<int> space_cells;
 
-        for (int x : s1) {
-            space_cells.push_back(x);
+        for (int i = 0; i < num_cells; i++) {
+            if (s1[i]) {
+                space_cells.push_back(i);
+            }
         }
 
         fassert(space_cells.size() > 0);
@@ -281,10 +286,12 @@ void MazeGen::generate_maze_with_doors(int num_doors) {
                                      ? EXIT_OBJ
                                      : (KEY_OBJ + door_num + 1));
 
-        s0.insert(s1.begin(), s1.end());
+        for (int i = 0; i < num_cells; i++) {
+            s0[i] |= s1[i];
+        }
 
         if (found_door >= 0) {
-            s0.insert(found_door);
+            s0[found_door] = 1;
         }
     }
 }
@@ -6,8 +6,9 @@ Generate a maze using kruskal's algorithm
 
 */
 
+#include <cstdint>
 #include <memory>
-#include <set>
+#include <vector>
 #include "grid.h"
 #include "randgen.h"
 
@@ -29,11 +30,18 @@ class MazeGen {
     int array_dim;
 
     int num_free_cells;
-    std::vector<std::set<int>> cell_sets;
+    // the cells of each connected set, only the entry of the set a cell belongs to is kept
+    std::vector<std::vector<int>> cell_sets;
     std::vector<int> cell_sets_idxs;
-    std::set<int> free_cell_set;
+    std::vector<uint8_t> is_free_cell;
     std::vector<int> free_cells;
 
+    // scratch space for expand_to_type()
+    std::vector<int> frontier;
+    std::vector<int> next_frontier;
+    std::vector<int> target_elems;
+    std::vector<int> adj_space;
+
     void get_neighbors(int idx, int type, std::vector<int> &neighbors);
     int lookup(int x, int y);
     void set_free_cell(int x, int y);
@@ -41,5 +49,6 @@ class MazeGen {
     int to_index(int x, int y);
     int get_obj(int idx);
     std::vector<int> filter_cells(int type);
-    int expand_to_type(std::set<int> &s0, std::set<int> &s1, int type);
+    // s0 and s1 are bitmaps over the cells of grid
+    int expand_to_type(const std::vector<uint8_t> &s0, std::vector<uint8_t> &s1, int type);
 };
@@ -0,0 +1,108 @@
+#pragma once
+
+/*
+
+The drawing operations games use, so that observations can be drawn either by Qt or by
+the much simpler software rasterizer in fast-painter.h
+
+*/
+
+#include <QtGui/QPainter>
+#include <memory>
+
+// should match RENDER_BACKEND_DICT in env.py
+enum RenderBackend {
+    QtRenderBackend = 0,
+    FastRenderBackend = 1,
+};
+
+class Painter {
+  public:
+    virtual ~Painter() {
+    }
+
+    virtual void save() = 0;
+    virtual void restore() = 0;
+    virtual void translate(qreal dx, qreal dy) = 0;
+    virtual void rotate(qreal degrees) = 0;
+    virtual void setOpacity(qreal opacity) = 0;
+    virtual void setPen(const QPen &pen) = 0;
+    virtual void setBrush(const QBrush &brush) = 0;
+    virtual void setCompositionMode(QPainter::CompositionMode mode) = 0;
+    virtual void setClipRect(const QRect &rect) = 0;
+
+    virtual void fillRect(const QRectF &rect, const QColor &color) = 0;
+    virtual void drawImage(const QRectF &target, const QImage &image) = 0;
+    virtual void drawImage(const QPointF &point, const QImage &image) = 0;
+    virtual void drawEllipse(const QRectF &rect) = 0;
+    virtual void drawLine(int x1, int y1, int x2, int y2) = 0;
+};
+
+class QtPainter : public Painter {
+  public:
+    QtPainter(QImage *image) : p(image) {
+    }
+
+    void setRenderHint(QPainter::RenderHint hint, bool on = true) {
+        p.setRenderHint(hint, on);
+    }
+
+    void save() override {
+        p.save();
+    }
+
+    void restore() override {
+        p.restore();
+    }
+
+    void translate(qreal dx, qreal dy) override {
+        p.translate(dx, dy);
+    }
+
+    void rotate(qreal degrees) override {
+        p.rotate(degrees);
+    }
+
+    void setOpacity(qreal opacity) override {
+        p.setOpacity(opacity);
+    }
+
+    void setPen(const QPen &pen) override {
+        p.setPen(pen);
+    }
+
+    void setBrush(const QBrush &brush) override {
+        p.setBrush(brush);
+    }
+
+    void setCompositionMode(QPainter::CompositionMode mode) override {
+        p.setCompositionMode(mode);
+    }
+
+    void setClipRect(const QRect &rect) override {
+        p.setClipRect(rect);
+    }
+
+    void fillRect(const QRectF &rect, const QColor &color) override {
+        p.fillRect(rect, color);
+    }
+
+    void drawImage(const QRectF &target, const QImage &image) override {
+        p.drawImage(target, image);
+    }
+
+    void drawImage(const QPointF &point, const QImage &image) override {
+        p.drawImage(point, image);
+    }
+
+    void drawEllipse(const QRectF &rect) override {
+        p.drawEllipse(rect);
+    }
+
+    void drawLine(int x1, int y1, int x2, int y2) override {
+        p.drawLine(x1, y1, x2, y2);
+    }
+
+  private:
+    QPainter p;
+};
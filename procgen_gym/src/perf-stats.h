@@ -0,0 +1,80 @@
+#pragma once
+
+/*
+
+Cumulative per-phase timing counters, only collected when enabled so that the
+disabled path costs a single branch
+
+*/
+
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+
+// should match PERF_PHASES in env.py
+enum PerfPhase {
+    PerfGameStep = 0,
+    PerfRender = 1,
+    PerfConvert = 2,
+    PerfReset = 3,
+    NUM_PERF_PHASES = 4,
+};
+
+inline int64_t perf_now_ns() {
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(
+               std::chrono::steady_clock::now().time_since_epoch())
+        .count();
+}
+
+// counters owned by a single game, only touched by the thread that currently owns the game
+struct PerfStats {
+    bool enabled = false;
+    int64_t time_ns[NUM_PERF_PHASES] = {};
+    int64_t count[NUM_PERF_PHASES] = {};
+
+    void reset() {
+        for (int i = 0; i < NUM_PERF_PHASES; i++) {
+            time_ns[i] = 0;
+            count[i] = 0;
+        }
+    }
+};
+
+// adds the time spent in its scope to one phase of a PerfStats
+class PerfTimer {
+  public:
+    PerfTimer(PerfStats &_stats, PerfPhase _phase) : stats(_stats), phase(_phase) {
+        if (stats.enabled) {
+            start = perf_now_ns();
+        }
+    }
+
+    ~PerfTimer() {
+        if (stats.enabled) {
+            stats.time_ns[phase] += perf_now_ns() - start;
+            stats.count[phase] += 1;
+        }
+    }
+
+  private:
+    PerfStats &stats;
+    PerfPhase phase;
+    int64_t start = 0;
+};
+
+// counters for time spent by callers waiting on the stepping threads, may be updated
+// from several calling threads at once
+struct WaitStats {
+    std::atomic<int64_t> time_ns{0};
+    std::atomic<int64_t> count{0};
+
+    void add(int64_t ns) {
+        time_ns.fetch_add(ns, std::memory_order_relaxed);
+        count.fetch_add(1, std::memory_order_relaxed);
+    }
+
+    void reset() {
+        time_ns = 0;
+        count = 0;
+    }
+};
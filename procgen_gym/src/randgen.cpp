@@ -1,7 +1,9 @@
 #include "randgen.h"
 #include "cpp-utils.h"
 #include <set>
+#include <cstring>
 #include <sstream>
+#include <type_traits>
 
 int RandGen::randint(int low, int high) {
     fassert(is_seeded);
@@ -97,16 +99,179 @@ void RandGen::seed(int seed) {
     is_seeded = true;
 }
 
+// the compact format holds the numbers of the text form in binary instead of decimal strings,
+// the same numbers the default format writes as text, so both formats can only be read by builds
+// using the same standard library (libstdc++ writes the state_size words as they are stored
+// followed by the position in them, libc++ writes them rotated to start at the position)
+const int MAX_GEN_NUMBERS = std::mt19937::state_size + 1;
+
+// reused between calls so that converting to and from the text form doesn't allocate
+static thread_local std::ostringstream gen_out;
+static thread_local std::istringstream gen_in;
+static thread_local std::string gen_text;
+
+// the numbers of the text form of gen, returns how many there are
+static int text_numbers(const std::mt19937 &gen, uint32_t *numbers) {
+    gen_out.str("");
+    gen_out << gen;
+    gen_text = gen_out.str();
+
+    // unsigned decimals separated by spaces, parsed by hand since operator>> is slow
+    int count = 0;
+    uint64_t v = 0;
+    bool in_number = false;
+    for (char c : gen_text) {
+        if (c >= '0' && c <= '9') {
+            v = v * 10 + (c - '0');
+            fassert(v <= 0xffffffffu);
+            in_number = true;
+        } else if (in_number) {
+            fassert(count < MAX_GEN_NUMBERS);
+            numbers[count++] = (uint32_t)(v);
+            v = 0;
+            in_number = false;
+        }
+    }
+    if (in_number) {
+        fassert(count < MAX_GEN_NUMBERS);
+        numbers[count++] = (uint32_t)(v);
+    }
+    return count;
+}
+
+static void from_text_numbers(std::mt19937 &gen, const uint32_t *numbers, int count) {
+    gen_text.clear();
+    for (int i = 0; i < count; i++) {
+        char digits[10];
+        int n = 0;
+        uint32_t v = numbers[i];
+        do {
+            digits[n++] = (char)('0' + v % 10);
+            v /= 10;
+        } while (v > 0);
+        while (n > 0) {
+            gen_text += digits[--n];
+        }
+        gen_text += ' ';
+    }
+    gen_in.str(gen_text);
+    gen_in.clear();
+    gen_in >> gen;
+    fassert(!gen_in.fail());
+}
+
+// the state words are uniformly random, so they are stored as 4 little endian bytes each rather
+// than as varints, which would take 5 bytes for most of them
+static void write_le_words(WriteBuffer *b, const uint32_t *words, int count) {
+    uint8_t bytes[MAX_GEN_NUMBERS * 4];
+    for (int i = 0; i < count; i++) {
+        for (int j = 0; j < 4; j++) {
+            bytes[i * 4 + j] = (uint8_t)(words[i] >> (8 * j));
+        }
+    }
+    b->write_bytes(bytes, count * 4);
+}
+
+static void read_le_words(ReadBuffer *b, uint32_t *words, int count) {
+    uint8_t bytes[MAX_GEN_NUMBERS * 4];
+    b->read_bytes(bytes, count * 4);
+    for (int i = 0; i < count; i++) {
+        words[i] = 0;
+        for (int j = 0; j < 4; j++) {
+            words[i] |= (uint32_t)(bytes[i * 4 + j]) << (8 * j);
+        }
+    }
+}
+
+// going through the text form takes a few hundred microseconds, so where the generator turns
+// out to be stored as exactly the numbers of its text form they are copied in and out directly
+typedef std::mt19937::result_type GenWord;
+
+static bool check_gen_layout() {
+    if (!std::is_trivially_copyable<std::mt19937>::value || sizeof(std::mt19937) != MAX_GEN_NUMBERS * sizeof(GenWord)) {
+        return false;
+    }
+    // partway through a block, so that the position is neither 0 nor state_size
+    std::mt19937 gen(1234);
+    gen.discard(1000);
+    uint32_t numbers[MAX_GEN_NUMBERS];
+    if (text_numbers(gen, numbers) != MAX_GEN_NUMBERS) {
+        return false;
+    }
+    GenWord words[MAX_GEN_NUMBERS];
+    memcpy(words, &gen, sizeof(gen));
+    for (int i = 0; i < MAX_GEN_NUMBERS; i++) {
+        if (words[i] != numbers[i]) {
+            return false;
+        }
+    }
+    std::mt19937 copy;
+    from_text_numbers(copy, numbers, MAX_GEN_NUMBERS);
+    return copy == gen;
+}
+
+static const bool GEN_LAYOUT_MATCHES_TEXT = check_gen_layout();
+
 void RandGen::serialize(WriteBuffer *b) {
     b->write_int(is_seeded);
+    if (b->compact) {
+        uint32_t numbers[MAX_GEN_NUMBERS];
+        int count;
+        if (GEN_LAYOUT_MATCHES_TEXT) {
+            GenWord words[MAX_GEN_NUMBERS];
+            memcpy(words, &stdgen, sizeof(stdgen));
+            for (int i = 0; i < MAX_GEN_NUMBERS; i++) {
+                numbers[i] = (uint32_t)(words[i]);
+            }
+            count = MAX_GEN_NUMBERS;
+        } else {
+            count = text_numbers(stdgen, numbers);
+        }
+        b->write_varint(count);
+        write_le_words(b, numbers, count);
+        if (b->rand_gens != nullptr) {
+            b->rand_gens->push_back(*this);
+        }
+        return;
+    }
     std::ostringstream ostream;
     ostream << stdgen;
     auto str = ostream.str();
     b->write_string(str);
+    if (b->rand_gens != nullptr) {
+        b->rand_gens->push_back(*this);
+    }
 }
 
 void RandGen::deserialize(ReadBuffer *b) {
     is_seeded = b->read_int();
+    if (b->compact) {
+        uint32_t numbers[MAX_GEN_NUMBERS];
+        int count = b->read_varint();
+        fassert(count <= MAX_GEN_NUMBERS);
+        read_le_words(b, numbers, count);
+        if (GEN_LAYOUT_MATCHES_TEXT && count == MAX_GEN_NUMBERS && numbers[count - 1] <= std::mt19937::state_size) {
+            GenWord words[MAX_GEN_NUMBERS];
+            for (int i = 0; i < MAX_GEN_NUMBERS; i++) {
+                words[i] = numbers[i];
+            }
+            memcpy(&stdgen, words, sizeof(stdgen));
+        } else {
+            from_text_numbers(stdgen, numbers, count);
+        }
+        if (b->rand_gens != nullptr) {
+            b->rand_gen_idx++;
+        }
+        return;
+    }
+    if (b->rand_gens != nullptr) {
+        // the text form holds the same state, skip it
+        int size = b->read_int();
+        fassert(b->offset + size <= b->length);
+        b->offset += size;
+        stdgen = b->rand_gens->at(b->rand_gen_idx++).stdgen;
+        return;
+    }
     auto str = b->read_string();
     std::istringstream istream;
     istream.str(str);
@@ -1,5 +1,11 @@
 #include "resources.h"
 #include "cpp-utils.h"
+#include "fast-painter.h"
+#include <set>
+#include <mutex>
+#include <shared_mutex>
+#include <cstring>
+#include <unordered_map>
 
 std::string global_resource_root;
 
@@ -12,10 +18,167 @@ std::vector<std::shared_ptr<QImage>> water_surface_backgrounds;
 
 std::map<std::string, std::shared_ptr<QImage>> sprites;
 
+// bound on the memory used by scaled images, beyond it images are scaled on every draw again.
+// 16 envs stepping 2000 times with unlimited levels use about 18 MB in bossfight, which scales
+// its large boss sprites, 7.5 MB in bigfish and at most a few MB in the other games (easy and
+// hard). The bound leaves room for more than ten times that, e.g. several games in one process
+const size_t MAX_SCALED_IMAGE_BYTES = 256 * 1024 * 1024;
+
+// everything below is filled lazily from the stepping threads, so it is guarded by this lock
+std::shared_mutex shared_images_mutex;
+// images that never change after loading, only these can be scaled once and reused
+std::set<const QImage *> shared_images;
+std::map<std::string, std::shared_ptr<QImage>> reflected_sprites;
+// an image is scaled for a backend and the exact target rect in the observation
+struct ScaledImageKey {
+    const QImage *image;
+    int backend;
+    qreal rect[4];
+
+    bool operator==(const ScaledImageKey &other) const {
+        return image == other.image && backend == other.backend && memcmp(rect, other.rect, sizeof(rect)) == 0;
+    }
+};
+
+struct ScaledImageKeyHash {
+    size_t operator()(const ScaledImageKey &key) const {
+        uint64_t words[6];
+        words[0] = (uint64_t)(uintptr_t)key.image;
+        words[1] = (uint64_t)key.backend;
+        memcpy(&words[2], key.rect, sizeof(key.rect));
+        uint64_t hash = 0;
+        for (uint64_t word : words) {
+            hash = (hash ^ word) * 0x9e3779b97f4a7c15ULL;
+            hash ^= hash >> 32;
+        }
+        return (size_t)hash;
+    }
+};
+
+std::unordered_map<ScaledImageKey, std::shared_ptr<QImage>, ScaledImageKeyHash> scaled_images;
+size_t scaled_image_bytes = 0;
+
+// sprites that move by fractions of a pixel are rarely drawn at the same size and sub-pixel
+// position in many frames, and scaling an image costs about as much as drawing it. So a thread
+// only uses the cache for a rect once it has asked for it in this many frames. Each slot counts
+// the frames for the hash of one rect, a rect whose slot was taken over by another one starts
+// counting again. Measured with Qt over 300 steps of 4 envs: from the first frame, coinrun,
+// jumper and ninja render 3 to 8 times slower, from the 4th frame maze, miner and heist gain
+// less than from the 16th, and from the 64th frame they gain no more than from the 16th
+const int SCALED_IMAGE_MIN_FRAMES = 16;
+const size_t SCALED_IMAGE_CANDIDATE_SLOTS = 4096;
+struct ScaledImageCandidate {
+    size_t hash = 0;
+    uint32_t last_frame = 0;
+    int num_frames = 0;
+};
+// the scaled image for the rect of each slot once it was found, so that later draws don't take
+// the lock. Kept apart from the counts, which are looked at on every draw
+struct ScaledImageFound {
+    ScaledImageKey key;
+    std::shared_ptr<QImage> scaled;
+};
+struct ScaledImageThreadState {
+    std::vector<ScaledImageCandidate> candidates = std::vector<ScaledImageCandidate>(SCALED_IMAGE_CANDIDATE_SLOTS);
+    std::vector<ScaledImageFound> found = std::vector<ScaledImageFound>(SCALED_IMAGE_CANDIDATE_SLOTS);
+    uint32_t frame = 0;
+};
+thread_local ScaledImageThreadState scaled_image_state;
+
 std::shared_ptr<QImage> get_asset_ptr(std::string relpath) {
     return sprites.at(relpath);
 }
 
+std::shared_ptr<QImage> get_reflected_asset_ptr(std::string relpath) {
+    {
+        std::shared_lock<std::shared_mutex> lock(shared_images_mutex);
+        auto it = reflected_sprites.find(relpath);
+        if (it != reflected_sprites.end()) {
+            return it->second;
+        }
+    }
+
+    auto reflection = std::make_shared<QImage>(sprites.at(relpath)->mirrored(true, false));
+
+    std::unique_lock<std::shared_mutex> lock(shared_images_mutex);
+    // another game may have added it in the meantime
+    auto inserted = reflected_sprites.insert({relpath, reflection});
+    if (inserted.second) {
+        shared_images.insert(reflection.get());
+    }
+    return inserted.first->second;
+}
+
+void begin_scaled_image_frame() {
+    scaled_image_state.frame++;
+}
+
+std::shared_ptr<QImage> get_scaled_image_ptr(const QImage *image, RenderBackend backend, const QRectF &rect, QPoint *offset) {
+    // the image is drawn at the same sub-pixel position in an image that starts a pixel before
+    // rect, so that it isn't clipped. The offsets in the Qt and fast scaling loops are computed
+    // exactly, so the pixels only move with a whole pixel offset
+    int x0 = int(floor(rect.left())) - 1;
+    int y0 = int(floor(rect.top())) - 1;
+    QRectF local = rect.translated(-x0, -y0);
+    int w = int(ceil(local.right())) + 1;
+    int h = int(ceil(local.bottom())) + 1;
+    *offset = QPoint(x0, y0);
+
+    ScaledImageKey key = {image, int(backend), {local.x(), local.y(), local.width(), local.height()}};
+
+    // counted without taking the lock, rects that are not drawn often never get to it
+    ScaledImageThreadState &state = scaled_image_state;
+    size_t hash = ScaledImageKeyHash()(key);
+    size_t slot = hash % SCALED_IMAGE_CANDIDATE_SLOTS;
+    ScaledImageCandidate &candidate = state.candidates[slot];
+    if (candidate.hash != hash) {
+        candidate.hash = hash;
+        candidate.last_frame = state.frame;
+        candidate.num_frames = 1;
+    } else if (candidate.last_frame != state.frame) {
+        candidate.last_frame = state.frame;
+        candidate.num_frames++;
+    }
+    if (candidate.num_frames < SCALED_IMAGE_MIN_FRAMES) {
+        return nullptr;
+    }
+
+    ScaledImageFound &found = state.found[slot];
+    if (found.scaled != nullptr && found.key == key) {
+        return found.scaled;
+    }
+
+    {
+        std::shared_lock<std::shared_mutex> lock(shared_images_mutex);
+        auto it = scaled_images.find(key);
+        if (it != scaled_images.end()) {
+            found.key = key;
+            found.scaled = it->second;
+            return it->second;
+        }
+        size_t num_bytes = (size_t)w * h * 4;
+        if (shared_images.count(image) == 0 || scaled_image_bytes + num_bytes > MAX_SCALED_IMAGE_BYTES) {
+            return nullptr;
+        }
+    }
+
+    // drawn the same way as into the observation, so that the same code samples the image.
+    // Premultiplied pixels drawn over transparent ones keep their exact values
+    auto scaled = std::make_shared<QImage>(w, h, QImage::Format_ARGB32_Premultiplied);
+    scaled->fill(0);
+    {
+        std::unique_ptr<Painter> p = create_painter(scaled.get(), backend);
+        p->drawImage(local, *image);
+    }
+
+    std::unique_lock<std::shared_mutex> lock(shared_images_mutex);
+    auto inserted = scaled_images.insert({key, scaled});
+    if (inserted.second) {
+        scaled_image_bytes += (size_t)w * h * 4;
+    }
+    return inserted.first->second;
+}
+
 std::shared_ptr<QImage> load_resource_ptr(std::string relpath, QImage::Format format) {
     auto path = global_resource_root + relpath;
     auto asset = QImage(QString(path.c_str())).convertToFormat(format);
@@ -951,4 +1114,13 @@ void images_load() {
     for (auto bg : space_backgrounds) {
         platform_backgrounds.push_back(bg);
     }
+
+    for (const auto &pair : sprites) {
+        shared_images.insert(pair.second.get());
+    }
+    for (const auto &pair : group_to_vector) {
+        for (const auto &bg : *pair.second) {
+            shared_images.insert(bg.get());
+        }
+    }
 }
@@ -7,10 +7,22 @@ Load assets stored as individual image files
 */
 
 #include <QtGui/QPainter>
+#include "painter.h"
 #include <iostream>
 #include <memory>
 
 std::shared_ptr<QImage> get_asset_ptr(std::string relpath);
+// horizontally mirrored copy of an asset, created on first use and shared by all games
+std::shared_ptr<QImage> get_reflected_asset_ptr(std::string relpath);
+// a loaded asset, reflection or background drawn with backend into rect of an empty image that
+// starts at *offset. Copying it there gives the same pixels as drawing the image into rect.
+// Created once a thread has asked for the same image, size and sub-pixel position in several
+// frames and shared read-only by all games.
+// Returns nullptr until then, if image was not loaded here (generated assets can change) or if
+// the cache is full
+std::shared_ptr<QImage> get_scaled_image_ptr(const QImage *image, RenderBackend backend, const QRectF &rect, QPoint *offset);
+// starts a new frame for get_scaled_image_ptr() on the calling thread
+void begin_scaled_image_frame();
 
 extern std::string global_resource_root;
 extern void images_load();
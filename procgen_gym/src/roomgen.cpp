@@ -1,4 +1,15 @@
 #include "roomgen.h"
+#include <climits>
+
+int RoomGenerator::new_mark() {
+    // marks from earlier calls never match a new one, so cell_marks only needs clearing
+    // when the grid changes size or the counter runs out
+    if ((int)(cell_marks.size()) != game->grid_size || mark == INT_MAX) {
+        cell_marks.assign(game->grid_size, 0);
+        mark = 0;
+    }
+    return ++mark;
+}
 
 int RoomGenerator::count_neighbors(int idx, int type) {
     int x, y;
@@ -20,13 +31,13 @@ int RoomGenerator::count_neighbors(int idx, int type) {
 
 void RoomGenerator::update() {
     // update cellular automata
-    std::vector<int> next_cells;
+    next_cells.resize(game->grid_size);
 
     for (int i = 0; i < game->grid_size; i++) {
         if (count_neighbors(i, WALL_OBJ) >= 5) {
-            next_cells.push_back(WALL_OBJ);
+            next_cells[i] = WALL_OBJ;
         } else {
-            next_cells.push_back(SPACE);
+            next_cells[i] = SPACE;
         }
     }
 
@@ -35,17 +46,18 @@ void RoomGenerator::update() {
     }
 }
 
-void RoomGenerator::build_room(int idx, std::set<int> &room) {
-    std::queue<int> curr;
+void RoomGenerator::build_room(int idx, int room_mark, std::vector<int> &room) {
+    room.clear();
 
     if (game->get_obj(idx) != SPACE)
         return;
 
-    curr.push(idx);
+    // breadth first, frontier is used as a queue
+    frontier.clear();
+    frontier.push_back(idx);
 
-    while (curr.size() > 0) {
-        int curr_idx = curr.front();
-        curr.pop();
+    for (size_t head = 0; head < frontier.size(); head++) {
+        int curr_idx = frontier[head];
 
         if (game->get_obj(curr_idx) != SPACE)
             continue;
@@ -58,9 +70,10 @@ void RoomGenerator::build_room(int idx, std::set<int> &room) {
                 if ((i == 0 || j == 0) && (i + j != 0)) {
                     int next_idx = game->to_grid_idx(x + i, y + j);
 
-                    if (!set_contains(room, next_idx) && game->get_obj(next_idx) == SPACE) {
-                        curr.push(next_idx);
-                        room.insert(next_idx);
+                    if (next_idx >= 0 && game->get_obj(next_idx) == SPACE && cell_marks[next_idx] != room_mark) {
+                        frontier.push_back(next_idx);
+                        cell_marks[next_idx] = room_mark;
+                        room.push_back(next_idx);
                     }
                 }
             }
@@ -69,9 +82,9 @@ void RoomGenerator::build_room(int idx, std::set<int> &room) {
 }
 
 void RoomGenerator::find_path(int src, int dst, std::vector<int> &path) {
-    std::set<int> covered;
-    std::vector<int> expanded;
-    std::vector<int> parents;
+    int covered_mark = new_mark();
+    expanded.clear();
+    parents.clear();
 
     if (game->get_obj(src) != SPACE)
         return;
@@ -97,10 +110,10 @@ void RoomGenerator::find_path(int src, int dst, std::vector<int> &path) {
                 if ((i == 0 || j == 0) && (i + j != 0)) {
                     int next_idx = game->to_grid_idx(x + i, y + j);
 
-                    if (!set_contains(covered, next_idx) && game->get_obj(next_idx) == SPACE) {
+                    if (next_idx >= 0 && game->get_obj(next_idx) == SPACE && cell_marks[next_idx] != covered_mark) {
                         expanded.push_back(next_idx);
                         parents.push_back(search_idx);
-                        covered.insert(next_idx);
+                        cell_marks[next_idx] = covered_mark;
                     }
                 }
             }
@@ -109,49 +122,54 @@ void RoomGenerator::find_path(int src, int dst, std::vector<int> &path) {
         search_idx++;
     }
 
-    if (expanded[search_idx] == dst) {
-        std::vector<int> tmp;
+    if (search_idx < int(expanded.size()) && expanded[search_idx] == dst) {
+        int path_start = (int)(path.size());
 
         while (search_idx >= 0) {
-            tmp.push_back(expanded[search_idx]);
+            path.push_back(expanded[search_idx]);
             search_idx = parents[search_idx];
         }
 
-        for (int j = (int)(tmp.size()) - 1; j >= 0; j--) {
-            path.push_back(tmp[j]);
-        }
+        std::reverse(path.begin() + path_start, path.end());
     }
 }
 
-void RoomGenerator::find_best_room(std::set<int> &best_room) {
-    std::set<int> all_rooms;
-    all_rooms.clear();
+void RoomGenerator::find_best_room(std::vector<int> &best_room) {
+    // rooms are connected components, so one mark covers all of them
+    int room_mark = new_mark();
     best_room.clear();
 
     int best_room_size = -1;
 
     for (int i = 0; i < game->grid_size; i++) {
-        if (game->get_obj(i) == SPACE && !set_contains(all_rooms, i)) {
-            std::set<int> next_room;
-            build_room(i, next_room);
-            all_rooms.insert(next_room.begin(), next_room.end());
-
-            if (int(next_room.size()) > best_room_size) {
-                best_room_size = (int)(next_room.size());
-                best_room = next_room;
+        if (game->get_obj(i) == SPACE && cell_marks[i] != room_mark) {
+            build_room(i, room_mark, room);
+
+            if (int(room.size()) > best_room_size) {
+                best_room_size = (int)(room.size());
+                best_room = room;
             }
         }
     }
+
+    std::sort(best_room.begin(), best_room.end());
 }
 
-void RoomGenerator::expand_room(std::set<int> &set, int n) {
-    std::set<int> curr_set;
-    curr_set.insert(set.begin(), set.end());
+void RoomGenerator::expand_room(std::vector<int> &cells, int n) {
+    int room_mark = new_mark();
+
+    frontier.clear();
+    for (int idx : cells) {
+        if (cell_marks[idx] != room_mark) {
+            cell_marks[idx] = room_mark;
+            frontier.push_back(idx);
+        }
+    }
 
     for (int loop = 0; loop < n; loop++) {
-        std::set<int> next;
+        next_frontier.clear();
 
-        for (int curr_idx : curr_set) {
+        for (int curr_idx : frontier) {
             if (game->get_obj(curr_idx) != SPACE)
                 continue;
 
@@ -163,15 +181,16 @@ void RoomGenerator::expand_room(std::set<int> &set, int n) {
                     if (i != 0 || j != 0) {
                         int next_idx = game->to_grid_idx(x + i, y + j);
 
-                        if (!set_contains(set, next_idx) && game->get_obj(next_idx) == SPACE) {
-                            set.insert(next_idx);
-                            next.insert(next_idx);
+                        if (next_idx >= 0 && game->get_obj(next_idx) == SPACE && cell_marks[next_idx] != room_mark) {
+                            cell_marks[next_idx] = room_mark;
+                            cells.push_back(next_idx);
+                            next_frontier.push_back(next_idx);
                         }
                     }
                 }
             }
         }
 
-        curr_set = next;
+        std::swap(frontier, next_frontier);
     }
 }
@@ -15,12 +15,25 @@ class RoomGenerator {
 
     void update();
     void find_path(int src, int dst, std::vector<int> &path);
-    void find_best_room(std::set<int> &best_room);
-    void expand_room(std::set<int> &set, int n);
+    // the cells of the largest room, in ascending order
+    void find_best_room(std::vector<int> &best_room);
+    // adds the space cells within n steps of cells to it
+    void expand_room(std::vector<int> &cells, int n);
 
   private:
     BasicAbstractGame *game;
 
-    void build_room(int idx, std::set<int> &room);
+    // scratch space reused by every call, per grid cell the last mark it was visited with
+    std::vector<int> cell_marks;
+    int mark = 0;
+    std::vector<int> next_cells;
+    std::vector<int> room;
+    std::vector<int> frontier;
+    std::vector<int> next_frontier;
+    std::vector<int> expanded;
+    std::vector<int> parents;
+
+    int new_mark();
+    void build_room(int idx, int room_mark, std::vector<int> &room);
     int count_neighbors(int idx, int type);
-};
\ No newline at end of file
+};
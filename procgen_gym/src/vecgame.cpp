@@ -2,6 +2,10 @@
 #include "cpp-utils.h"
 #include "vecoptions.h"
 #include "game.h"
+#include <algorithm>
+#include <chrono>
+#include <cmath>
+#include <cstring>
 
 const int32_t END_OF_BUFFER = 0xCAFECAFE;
 
@@ -9,6 +13,14 @@ extern void coinrun_old_init(int rand_seed);
 
 static std::once_flag global_init_flag;
 
+static size_t tensortype_size(const struct libenv_tensortype &tt) {
+    size_t size = tt.dtype == LIBENV_DTYPE_UINT8 ? 1 : 4;
+    for (int i = 0; i < tt.ndim; i++) {
+        size *= tt.shape[i];
+    }
+    return size;
+}
+
 std::vector<std::string> split(std::string s, std::string delimiter) {
     std::vector<std::string> env_names;
 
@@ -100,43 +112,46 @@ void libenv_close(libenv_env *handle) {
 
 // end libenv api
 
-static void stepping_worker(std::mutex &stepping_thread_mutex,
-                            std::list<std::shared_ptr<Game>> &pending_games,
-                            std::condition_variable &pending_games_added,
-                            std::condition_variable &pending_game_complete, bool &time_to_die) {
+void VecGame::stepping_worker() {
     while (1) {
-        std::shared_ptr<Game> game;
+        std::shared_ptr<SteppingJob> job;
 
         {
             std::unique_lock<std::mutex> lock(stepping_thread_mutex);
-            while (1) {
-                if (time_to_die) {
-                    return;
-                }
-                if (!pending_games.empty()) {
-                    game = pending_games.front();
-                    pending_games.pop_front();
-                    break;
-                }
-
-                pending_games_added.wait(lock);
+            pending_jobs_added.wait(lock, [this]() { return time_to_die || !pending_jobs.empty(); });
+            if (time_to_die) {
+                return;
             }
+            job = pending_jobs.front();
         }
 
-        // the first time the threads are activated is before any step, just to initialize
-        // the environment and produce the initial observation
-        if (!game->initial_reset_complete) {
-            game->reset();
-            game->observe();
-            game->initial_reset_complete = true;
-        } else{
-            game->step();
+        // claim chunks of the job without holding the lock until there are none left
+        int count = job->stop - job->start;
+        while (1) {
+            int offset = job->next_offset.fetch_add(job->chunk_size);
+            if (offset >= count) {
+                break;
+            }
+            int end = std::min(offset + job->chunk_size, count);
+
+            for (int i = offset; i < end; i++) {
+                int e = job->start + i;
+                job->fn(e);
+                games[e]->is_waiting_for_step = false;
+            }
+
+            if (job->remaining.fetch_sub(end - offset) == end - offset) {
+                // this was the last chunk, wake up anyone waiting on the job
+                std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+                job_complete.notify_all();
+            }
         }
 
         {
             std::unique_lock<std::mutex> lock(stepping_thread_mutex);
-            game->is_waiting_for_step = false;
-            pending_game_complete.notify_all();
+            if (!pending_jobs.empty() && pending_jobs.front() == job) {
+                pending_jobs.pop_front();
+            }
         }
     }
 }
@@ -167,9 +182,14 @@ inline uint32_t hash_str_uint32(const std::string &str) {
 }
 
 VecGame::VecGame(int _nenvs, VecOptions opts) {
-    render_human = false;
+    spin_wait_us = 0;
+    perf_stats_enabled = false;
     num_envs = _nenvs;
     games.resize(num_envs);
+    state_bufs.resize(num_envs);
+    state_sizes.resize(num_envs);
+    clone_bufs.resize(num_envs);
+    clone_sizes.resize(num_envs);
     std::string env_name;
 
     int num_levels = 0;
@@ -178,6 +198,11 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
 
     int rand_seed = 0;
     int num_threads = 4;
+    int obs_format = RGBFormat;
+    int frame_stack = 1;
+    int action_repeat = 1;
+    int max_pool_last = 1;
+    int level_cache_mb = 0;
     std::string resource_root;
 
     opts.consume_string("env_name", &env_name);
@@ -187,36 +212,54 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
     opts.consume_int("rand_seed", &rand_seed);
     opts.consume_int("num_threads", &num_threads);
     opts.consume_string("resource_root", &resource_root);
-    opts.consume_bool("render_human", &render_human);
+    opts.consume_int("spin_wait_us", &spin_wait_us);
+    opts.consume_int("obs_format", &obs_format);
+    opts.consume_int("frame_stack", &frame_stack);
+    opts.consume_int("action_repeat", &action_repeat);
+    opts.consume_int("max_pool_last", &max_pool_last);
+    opts.consume_bool("perf_stats", &perf_stats_enabled);
+    opts.consume_int("level_cache_mb", &level_cache_mb);
 
     std::call_once(global_init_flag, global_init, rand_seed,
                    resource_root);
 
     fassert(num_threads >= 0);
+    fassert(spin_wait_us >= 0);
     threads.resize(num_threads);
     for (int t = 0; t < num_threads; t++) {
-        threads[t] = std::thread(
-            stepping_worker,
-            std::ref(stepping_thread_mutex),
-            std::ref(pending_games),
-            std::ref(pending_games_added),
-            std::ref(pending_game_complete),
-            std::ref(time_to_die));
+        threads[t] = std::thread(&VecGame::stepping_worker, this);
     }
 
     fassert(env_name != "");
     fassert(num_actions > 0);
     fassert(num_levels >= 0);
     fassert(start_level >= 0);
+    fassert(obs_format >= RGBFormat && obs_format <= GrayChannelsFirstFormat);
+    fassert(frame_stack >= 1);
+    fassert(action_repeat >= 1);
+    fassert(max_pool_last >= 1 && max_pool_last <= action_repeat);
+    fassert(level_cache_mb >= 0);
+
+    if (level_cache_mb > 0) {
+        level_cache = std::make_shared<LevelCache>((size_t)level_cache_mb << 20);
+    }
 
     {
+        auto format = static_cast<ObsFormat>(obs_format);
+        int channels = obs_format_channels(format) * frame_stack;
         struct libenv_tensortype s;
-        strcpy(s.name, "rgb");
+        strcpy(s.name, obs_format_channels(format) == 1 ? "gray" : "rgb");
         s.scalar_type = LIBENV_SCALAR_TYPE_DISCRETE;
         s.dtype = LIBENV_DTYPE_UINT8;
-        s.shape[0] = RES_W;
-        s.shape[1] = RES_H;
-        s.shape[2] = 3;
+        if (format == RGBChannelsFirstFormat || format == GrayChannelsFirstFormat) {
+            s.shape[0] = channels;
+            s.shape[1] = RES_H;
+            s.shape[2] = RES_W;
+        } else {
+            s.shape[0] = RES_W;
+            s.shape[1] = RES_H;
+            s.shape[2] = channels;
+        }
         s.ndim = 3;
         s.low.uint8 = 0;
         s.high.uint8 = 255;
@@ -266,21 +309,30 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
         s.high.int32 = INT32_MAX;
         info_types.push_back(s);
     }
-    
-    if (render_human) {
+
+    // statistics of the episode that ended on this step, zero on other steps
+    {
         struct libenv_tensortype s;
-        strcpy(s.name, "rgb");
-        s.scalar_type = LIBENV_SCALAR_TYPE_DISCRETE;
-        s.dtype = LIBENV_DTYPE_UINT8;
-        s.shape[0] = RENDER_RES;
-        s.shape[1] = RENDER_RES;
-        s.shape[2] = 3;
-        s.ndim = 3,
-        s.low.uint8 = 0;
-        s.high.uint8 = 255;
+        strcpy(s.name, "episode_return");
+        s.scalar_type = LIBENV_SCALAR_TYPE_REAL;
+        s.dtype = LIBENV_DTYPE_FLOAT32;
+        s.ndim = 0,
+        s.low.float32 = -INFINITY;
+        s.high.float32 = INFINITY;
         info_types.push_back(s);
     }
 
+    {
+        struct libenv_tensortype s;
+        strcpy(s.name, "episode_length");
+        s.scalar_type = LIBENV_SCALAR_TYPE_DISCRETE;
+        s.dtype = LIBENV_DTYPE_INT32;
+        s.ndim = 0,
+        s.low.int32 = 0;
+        s.high.int32 = INT32_MAX;
+        info_types.push_back(s);
+    }
+    
     int level_seed_low = 0;
     int level_seed_high = 0;
 
@@ -318,6 +370,18 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
         games[n]->is_waiting_for_step = false;
         games[n]->parse_options(name, opts);
         games[n]->info_name_to_offset = info_name_to_offset;
+        games[n]->obs_format = static_cast<ObsFormat>(obs_format);
+        games[n]->frame_stack = frame_stack;
+        games[n]->action_repeat = action_repeat;
+        games[n]->max_pool_last = max_pool_last;
+        games[n]->perf_stats.enabled = perf_stats_enabled;
+        // generated assets are not part of the serialized state
+        if (!games[n]->options.use_generated_assets) {
+            games[n]->level_cache = level_cache;
+        }
+        if (frame_stack > 1) {
+            games[n]->clear_frame_history();
+        }
 
         // Auto-selected a fixed_asset_seed if one wasn't specified on
         // construction
@@ -331,73 +395,185 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
 }
 
 void VecGame::set_buffers(const std::vector<std::vector<void *>> &ac, const std::vector<std::vector<void *>> &ob, const std::vector<std::vector<void *>> &info, float *rew, uint8_t *first) {
-    {
-        std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+    BufferSet set;
+    set.ac = ac;
+    set.ob = ob;
+    set.info = info;
+    set.rew = rew;
+    set.first = first;
+    set_buffer_sets({set});
+}
 
-        for (int e = 0; e < num_envs; e++) {
-            const auto &game = games[e];
-            // we only ever have one action
-            game->action_ptr = (int32_t *)(ac[e][0]);
-            game->obs_bufs = ob[e];
-            game->info_bufs = info[e];
-            game->reward_ptr = &rew[e];
-            game->first_ptr = &first[e];
-            
-            // render the initial state so we don't see a black screen on the first frame
-            fassert(!game->is_waiting_for_step);
-            fassert(!game->initial_reset_complete);
-            if (threads.size() == 0) {
-                // special case for no threads
-                game->reset();
-                game->observe();
-                game->initial_reset_complete = true;
-            } else {
-                game->is_waiting_for_step = true;
-                pending_games.push_back(game);
-            }
+void VecGame::set_buffer_sets(std::vector<BufferSet> sets) {
+    fassert(sets.size() > 0);
+    buffer_sets = std::move(sets);
+    use_buffer_set(0, 0, num_envs);
+
+    bool needs_initial_reset = false;
+    for (int e = 0; e < num_envs; e++) {
+        needs_initial_reset |= !games[e]->initial_reset_complete;
+    }
+
+    if (!needs_initial_reset) {
+        return;
+    }
+
+    // render the initial state so we don't see a black screen on the first frame
+    queue_job(0, num_envs, [this](int e) {
+        const auto &game = games[e];
+        if (!game->initial_reset_complete) {
+            game->reset();
+            game->observe();
+            game->initial_reset_complete = true;
         }
+    });
+}
+
+void VecGame::use_buffer_set(int idx, int start, int stop) {
+    fassert(0 <= idx && idx < (int)(buffer_sets.size()));
+    // make sure no stepping thread is still writing into the previous set before handing
+    // out the new pointers
+    wait_for_stepping_threads(start, stop);
+
+    const auto &set = buffer_sets[idx];
+    for (int e = start; e < stop; e++) {
+        const auto &game = games[e];
+        // we only ever have one action
+        game->action_ptr = (int32_t *)(set.ac[e][0]);
+        game->obs_bufs = set.ob[e];
+        game->info_bufs = set.info[e];
+        game->reward_ptr = &set.rew[e];
+        game->first_ptr = &set.first[e];
+
+        fassert(!game->is_waiting_for_step);
     }
-    pending_games_added.notify_all();
 }
 
 void VecGame::observe() {
-    wait_for_stepping_threads();
-    // at this point all games belong to the python thread
+    observe_range(0, num_envs);
+}
 
-    if (render_human) {
-        uint8_t render_hires_buf[RENDER_RES * RENDER_RES * 4];
+void VecGame::observe_range(int start, int stop) {
+    wait_for_stepping_threads(start, stop);
+    // at this point all games in the range belong to the python thread
+}
 
-        for (int e = 0; e < num_envs; e++) {
-            const auto &game = games[e];
-            game->render_to_buf(render_hires_buf, RENDER_RES, RENDER_RES, true);
-            bgr32_to_rgb888(game->info_bufs[game->info_name_to_offset.at("rgb")], render_hires_buf, RENDER_RES, RENDER_RES);
-        }
+void VecGame::act() {
+    act_range(0, num_envs);
+}
+
+void VecGame::act_range(int start, int stop) {
+    wait_for_stepping_threads(start, stop);
+
+    for (int e = start; e < stop; e++) {
+        const auto &game = games[e];
+        fassert(!game->is_waiting_for_step);
+        // save the action since it's only valid for the duration of this call
+        game->action = *game->action_ptr;
     }
+
+    queue_job(start, stop, [this](int e) {
+        games[e]->step();
+    });
+    // at this point all games in the range belong to the stepping threads
 }
 
-void VecGame::act() {
-    wait_for_stepping_threads();
+void VecGame::queue_job(int start, int stop, std::function<void(int)> fn) {
+    if (start >= stop) {
+        return;
+    }
+
+    if (threads.size() == 0) {
+        // special case for no threads
+        for (int e = start; e < stop; e++) {
+            fn(e);
+        }
+        return;
+    }
+
+    int count = stop - start;
+    int num_threads = (int)(threads.size());
+
+    auto job = std::make_shared<SteppingJob>();
+    job->start = start;
+    job->stop = stop;
+    // a few chunks per thread keeps the load balanced when step costs differ between
+    // games, without paying for an atomic claim per game
+    job->chunk_size = std::max(1, count / (num_threads * 4));
+    job->fn = std::move(fn);
+    job->remaining = count;
 
     {
         std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+        for (int e = start; e < stop; e++) {
+            games[e]->is_waiting_for_step = true;
+        }
+        pending_jobs.push_back(job);
+        active_jobs.push_back(job);
+    }
 
-        for (int e = 0; e < num_envs; e++) {
-            const auto &game = games[e];
-            fassert(!game->is_waiting_for_step);
-            // save the action since it's only valid for the duration of this call
-            game->action = *game->action_ptr;
-            if (threads.size() == 0) {
-                // special case for no threads
-                game->step();
-            } else {
-                game->is_waiting_for_step = true;
-                pending_games.push_back(game);
-            }
+    // only wake up as many threads as there are chunks to claim
+    int num_chunks = (count + job->chunk_size - 1) / job->chunk_size;
+    if (num_chunks >= num_threads) {
+        pending_jobs_added.notify_all();
+    } else {
+        for (int i = 0; i < num_chunks; i++) {
+            pending_jobs_added.notify_one();
         }
     }
-    // at this point all games belong to the stepping threads
+}
+
+void VecGame::parallel_for(int start, int stop, const std::function<void(int)> &fn) {
+    wait_for_stepping_threads(start, stop);
+    queue_job(start, stop, fn);
+    wait_for_stepping_threads(start, stop);
+}
+
+void VecGame::rollout(const int32_t *actions, int num_steps, void **ob, void **info, float *rew, uint8_t *first) {
+    std::vector<size_t> ob_sizes, info_sizes;
+    for (const auto &tt : observation_types) {
+        ob_sizes.push_back(tensortype_size(tt));
+    }
+    for (const auto &tt : info_types) {
+        info_sizes.push_back(tensortype_size(tt));
+    }
 
-    pending_games_added.notify_all();
+    parallel_for(0, num_envs, [&](int e) {
+        const auto &game = games[e];
+        auto obs_bufs = game->obs_bufs;
+        auto info_bufs = game->info_bufs;
+        float *reward_ptr = game->reward_ptr;
+        uint8_t *first_ptr = game->first_ptr;
+
+        for (int t = 0; t < num_steps; t++) {
+            size_t slot = (size_t)t * num_envs + e;
+            for (size_t i = 0; i < ob_sizes.size(); i++) {
+                game->obs_bufs[i] = (char *)(ob[i]) + slot * ob_sizes[i];
+            }
+            for (size_t i = 0; i < info_sizes.size(); i++) {
+                game->info_bufs[i] = (char *)(info[i]) + slot * info_sizes[i];
+            }
+            game->reward_ptr = &rew[slot];
+            game->first_ptr = &first[slot];
+            game->action = actions[slot];
+            game->step();
+        }
+
+        if (num_steps > 0) {
+            for (size_t i = 0; i < ob_sizes.size(); i++) {
+                memcpy(obs_bufs[i], game->obs_bufs[i], ob_sizes[i]);
+            }
+            for (size_t i = 0; i < info_sizes.size(); i++) {
+                memcpy(info_bufs[i], game->info_bufs[i], info_sizes[i]);
+            }
+            *reward_ptr = *game->reward_ptr;
+            *first_ptr = *game->first_ptr;
+        }
+        game->obs_bufs = obs_bufs;
+        game->info_bufs = info_bufs;
+        game->reward_ptr = reward_ptr;
+        game->first_ptr = first_ptr;
+    });
 }
 
 VecGame::~VecGame() {
@@ -406,7 +582,7 @@ VecGame::~VecGame() {
         std::unique_lock<std::mutex> lock(stepping_thread_mutex);
         time_to_die = true;
     }
-    pending_games_added.notify_all();
+    pending_jobs_added.notify_all();
 
     for (auto &t : threads) {
         t.join();
@@ -414,23 +590,54 @@ VecGame::~VecGame() {
 }
 
 void VecGame::wait_for_stepping_threads() {
+    wait_for_stepping_threads(0, num_envs);
+}
+
+void VecGame::wait_for_stepping_threads(int start, int stop) {
     if (threads.size() == 0) {
         return;
     }
 
-    std::unique_lock<std::mutex> lock(stepping_thread_mutex);
-    while (1) {
-        bool all_steps_completed = true;
+    std::vector<std::shared_ptr<SteppingJob>> jobs;
+    {
+        std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+        for (const auto &job : active_jobs) {
+            if (job->start < stop && start < job->stop) {
+                jobs.push_back(job);
+            }
+        }
+    }
 
-        for (int e = 0; e < num_envs; e++) {
-            const auto &game = games[e];
-            all_steps_completed &= !game->is_waiting_for_step;
+    auto jobs_complete = [&jobs]() {
+        for (const auto &job : jobs) {
+            if (job->remaining.load() > 0) {
+                return false;
+            }
         }
+        return true;
+    };
 
-        if (all_steps_completed)
-            break;
+    int64_t wait_start = perf_stats_enabled ? perf_now_ns() : 0;
 
-        pending_game_complete.wait(lock);
+    // cheap games finish quickly, so optionally spin for a bit before going to sleep
+    // to avoid paying for a condition variable wakeup
+    if (spin_wait_us > 0 && !jobs_complete()) {
+        auto deadline = std::chrono::steady_clock::now() + std::chrono::microseconds(spin_wait_us);
+        while (!jobs_complete() && std::chrono::steady_clock::now() < deadline) {
+            std::this_thread::yield();
+        }
+    }
+
+    std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+    job_complete.wait(lock, jobs_complete);
+    active_jobs.erase(
+        std::remove_if(active_jobs.begin(), active_jobs.end(), [](const std::shared_ptr<SteppingJob> &job) {
+            return job->remaining.load() == 0;
+        }),
+        active_jobs.end());
+
+    if (perf_stats_enabled && !jobs.empty()) {
+        wait_stats.add(perf_now_ns() - wait_start);
     }
 }
 
@@ -454,4 +661,245 @@ extern "C" {
         // next time VecGame::observe() is called, the correct data will be in the buffers
         venv->games.at(env_idx)->observe();
     }
+
+    // like libenv_set_buffers for count sets of buffers, which use_buffer_set switches
+    // between, the games start out writing into set 0
+    LIBENV_API void set_buffer_sets(libenv_env *handle, struct libenv_buffers *bufs, int count) {
+        auto venv = (VecGame *)(handle);
+        std::vector<BufferSet> sets(count);
+        for (int i = 0; i < count; i++) {
+            sets[i].ac = convert_bufs(bufs[i].ac, venv->num_envs, venv->action_types.size());
+            sets[i].ob = convert_bufs(bufs[i].ob, venv->num_envs, venv->observation_types.size());
+            sets[i].info = convert_bufs(bufs[i].info, venv->num_envs, venv->info_types.size());
+            sets[i].rew = bufs[i].rew;
+            sets[i].first = bufs[i].first;
+        }
+        venv->set_buffer_sets(std::move(sets));
+    }
+
+    LIBENV_API void use_buffer_set(libenv_env *handle, int idx, int start, int stop) {
+        auto venv = (VecGame *)(handle);
+        fassert(0 <= start && start <= stop && stop <= venv->num_envs);
+        venv->use_buffer_set(idx, start, stop);
+    }
+
+    LIBENV_API void act_range(libenv_env *handle, int start, int stop) {
+        auto venv = (VecGame *)(handle);
+        fassert(0 <= start && start <= stop && stop <= venv->num_envs);
+        venv->act_range(start, stop);
+    }
+
+    LIBENV_API void observe_range(libenv_env *handle, int start, int stop) {
+        auto venv = (VecGame *)(handle);
+        fassert(0 <= start && start <= stop && stop <= venv->num_envs);
+        venv->observe_range(start, stop);
+    }
+
+    LIBENV_API void rollout(libenv_env *handle, const int32_t *actions, int num_steps, void **ob, void **info, float *rew, uint8_t *first) {
+        auto venv = (VecGame *)(handle);
+        fassert(num_steps >= 0);
+        venv->rollout(actions, num_steps, ob, info, rew, first);
+    }
+
+    // batched versions of get_state/set_state, mask may be null to select every env,
+    // otherwise only envs with a nonzero mask entry are included and their states are
+    // laid out back to back in env order, with compact set the states use the compact
+    // encoding of WriteBuffer, set_states reads either
+
+    LIBENV_API int64_t serialize_states(libenv_env *handle, const uint8_t *mask, int compact) {
+        auto venv = (VecGame *)(handle);
+        venv->parallel_for(0, venv->num_envs, [venv, mask, compact](int e) {
+            if (mask != nullptr && !mask[e]) {
+                return;
+            }
+            auto b = WriteBuffer(&venv->state_bufs[e]);
+            b.compact = compact != 0;
+            venv->games[e]->serialize(&b);
+            b.write_int(END_OF_BUFFER);
+            venv->state_sizes[e] = b.offset;
+        });
+
+        int64_t total = 0;
+        for (int e = 0; e < venv->num_envs; e++) {
+            if (mask == nullptr || mask[e]) {
+                total += venv->state_sizes[e];
+            }
+        }
+        return total;
+    }
+
+    // copies the states produced by the last serialize_states call into data, offsets
+    // receives one entry per selected env plus the total size
+    LIBENV_API void read_states(libenv_env *handle, const uint8_t *mask, char *data, int64_t *offsets) {
+        auto venv = (VecGame *)(handle);
+        std::vector<int64_t> env_offsets(venv->num_envs, -1);
+        int64_t offset = 0;
+        int count = 0;
+        for (int e = 0; e < venv->num_envs; e++) {
+            if (mask == nullptr || mask[e]) {
+                env_offsets[e] = offset;
+                offsets[count++] = offset;
+                offset += venv->state_sizes[e];
+            }
+        }
+        offsets[count] = offset;
+
+        venv->parallel_for(0, venv->num_envs, [venv, &env_offsets, data](int e) {
+            if (env_offsets[e] >= 0) {
+                memcpy(data + env_offsets[e], venv->state_bufs[e].data(), venv->state_sizes[e]);
+            }
+        });
+    }
+
+    LIBENV_API void set_states(libenv_env *handle, const uint8_t *mask, char *data, const int64_t *offsets) {
+        auto venv = (VecGame *)(handle);
+        std::vector<int> slots(venv->num_envs, -1);
+        int count = 0;
+        for (int e = 0; e < venv->num_envs; e++) {
+            if (mask == nullptr || mask[e]) {
+                slots[e] = count++;
+            }
+        }
+
+        venv->parallel_for(0, venv->num_envs, [venv, &slots, data, offsets](int e) {
+            int slot = slots[e];
+            if (slot < 0) {
+                return;
+            }
+            auto b = ReadBuffer(data + offsets[slot], offsets[slot + 1] - offsets[slot]);
+            venv->games[e]->deserialize(&b);
+            fassert(b.read_int() == END_OF_BUFFER);
+            // same as set_state, refresh the observation and info buffers
+            venv->games[e]->observe();
+        });
+    }
+
+    // make env dst_idxs[i] a copy of env src_idxs[i] for each of the count pairs, without the
+    // states leaving C++, destinations must be unique and not also be sources
+    LIBENV_API void clone_envs(libenv_env *handle, const int32_t *src_idxs, const int32_t *dst_idxs, int count) {
+        auto venv = (VecGame *)(handle);
+        std::vector<int> src_of(venv->num_envs, -1);
+        std::vector<uint8_t> is_src(venv->num_envs, 0);
+        for (int i = 0; i < count; i++) {
+            int src = src_idxs[i];
+            int dst = dst_idxs[i];
+            fassert(0 <= src && src < venv->num_envs);
+            fassert(0 <= dst && dst < venv->num_envs);
+            fassert(src_of[dst] == -1);
+            src_of[dst] = src;
+            is_src[src] = 1;
+        }
+        for (int e = 0; e < venv->num_envs; e++) {
+            fassert(!(is_src[e] && src_of[e] >= 0));
+        }
+
+        // each source is serialized once however many copies are made, the compact format
+        // is used since it is much faster to write and read
+        auto serialize_source = [venv](int e) {
+            auto b = WriteBuffer(&venv->clone_bufs[e]);
+            b.compact = true;
+            venv->games[e]->serialize(&b);
+            venv->clone_sizes[e] = b.offset;
+        };
+        auto copy_to = [venv](int e, int src) {
+            auto b = ReadBuffer(venv->clone_bufs[src].data(), venv->clone_sizes[src]);
+            venv->games[e]->deserialize(&b);
+            fassert(b.offset == b.length);
+            venv->games[e]->copy_unserialized_state(*venv->games[src]);
+        };
+
+        // waking up the stepping threads costs more than a single copy
+        if (count == 1) {
+            venv->wait_for_stepping_threads();
+            serialize_source(src_idxs[0]);
+            copy_to(dst_idxs[0], src_idxs[0]);
+            return;
+        }
+
+        venv->parallel_for(0, venv->num_envs, [&is_src, &serialize_source](int e) {
+            if (is_src[e]) {
+                serialize_source(e);
+            }
+        });
+        venv->parallel_for(0, venv->num_envs, [&src_of, &copy_to](int e) {
+            if (src_of[e] >= 0) {
+                copy_to(e, src_of[e]);
+            }
+        });
+    }
+
+    // render the selected envs at RENDER_RES on the stepping threads, out receives one
+    // RENDER_RES x RENDER_RES x 3 image per entry of env_idxs in the same order
+    LIBENV_API void render_envs(libenv_env *handle, const int32_t *env_idxs, int count, uint8_t *out) {
+        auto venv = (VecGame *)(handle);
+        std::vector<int> slots(venv->num_envs, -1);
+        for (int i = 0; i < count; i++) {
+            fassert(0 <= env_idxs[i] && env_idxs[i] < venv->num_envs);
+            fassert(slots[env_idxs[i]] == -1);
+            slots[env_idxs[i]] = i;
+        }
+
+        venv->parallel_for(0, venv->num_envs, [venv, &slots, out](int e) {
+            int slot = slots[e];
+            if (slot < 0) {
+                return;
+            }
+            // too large for the stack of the stepping threads, keep one per thread instead
+            static thread_local std::vector<uint8_t> render_hires_buf(RENDER_RES * RENDER_RES * 4);
+            venv->games[e]->render_to_buf(render_hires_buf.data(), RENDER_RES, RENDER_RES, true);
+            bgr32_to_rgb888(out + (size_t)slot * RENDER_RES * RENDER_RES * 3, render_hires_buf.data(), RENDER_RES, RENDER_RES);
+        });
+    }
+
+    // cumulative per-phase timings, time_ns and counts receive num_envs x NUM_PERF_PHASES
+    // entries, wait receives the total time and number of waits on the stepping threads
+    LIBENV_API void get_perf_stats(libenv_env *handle, int64_t *time_ns, int64_t *counts, int64_t *wait) {
+        auto venv = (VecGame *)(handle);
+        venv->wait_for_stepping_threads();
+        for (int e = 0; e < venv->num_envs; e++) {
+            const auto &stats = venv->games[e]->perf_stats;
+            for (int p = 0; p < NUM_PERF_PHASES; p++) {
+                time_ns[e * NUM_PERF_PHASES + p] = stats.time_ns[p];
+                counts[e * NUM_PERF_PHASES + p] = stats.count[p];
+            }
+        }
+        wait[0] = venv->wait_stats.time_ns.load();
+        wait[1] = venv->wait_stats.count.load();
+    }
+
+    LIBENV_API void reset_perf_stats(libenv_env *handle) {
+        auto venv = (VecGame *)(handle);
+        venv->wait_for_stepping_threads();
+        for (int e = 0; e < venv->num_envs; e++) {
+            venv->games[e]->perf_stats.reset();
+        }
+        venv->wait_stats.reset();
+    }
+
+    // generation time of the level for each of the seeds in env env_idx, time_ns receives
+    // count entries, the state of the env is left unchanged
+    LIBENV_API void time_level_resets(libenv_env *handle, int env_idx, const int32_t *seeds, int count, int64_t *time_ns) {
+        auto venv = (VecGame *)(handle);
+        venv->wait_for_stepping_threads();
+        fassert(count >= 0);
+        venv->games.at(env_idx)->time_level_resets(seeds, count, time_ns);
+    }
+
+    // stats receives hits, misses, evictions, entries and bytes of the level cache
+    LIBENV_API void get_level_cache_stats(libenv_env *handle, int64_t *stats) {
+        auto venv = (VecGame *)(handle);
+        venv->wait_for_stepping_threads();
+        const auto &cache = venv->level_cache;
+        if (cache == nullptr) {
+            for (int i = 0; i < 5; i++) {
+                stats[i] = 0;
+            }
+            return;
+        }
+        stats[0] = cache->hits;
+        stats[1] = cache->misses;
+        stats[2] = cache->evictions;
+        stats[3] = (int64_t)(cache->num_entries());
+        stats[4] = (int64_t)(cache->num_bytes());
+    }
 }
\ No newline at end of file
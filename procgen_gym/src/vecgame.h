@@ -12,11 +12,35 @@ This implements the libenv interface and manages a vector of Game instances
 #include <string>
 #include <condition_variable>
 #include <thread>
-#include <list>
+#include <deque>
+#include <atomic>
+#include <functional>
+#include "perf-stats.h"
+#include "level-cache.h"
 
 class VecOptions;
 class Game;
 
+// the output and action pointers of every game, indexed by env and then by space
+struct BufferSet {
+    std::vector<std::vector<void *>> ac;
+    std::vector<std::vector<void *>> ob;
+    std::vector<std::vector<void *>> info;
+    float *rew = nullptr;
+    uint8_t *first = nullptr;
+};
+
+// A batch of work over the games in [start, stop), split into chunks that the
+// stepping threads claim with an atomic counter instead of one lock per game
+struct SteppingJob {
+    int start = 0;
+    int stop = 0;
+    int chunk_size = 1;
+    std::function<void(int)> fn;
+    std::atomic<int> next_offset{0};
+    std::atomic<int> remaining{0};
+};
+
 class VecGame {
   public:
     std::vector<struct libenv_tensortype> observation_types;
@@ -26,27 +50,68 @@ class VecGame {
     int num_envs;
     int num_joint_games;
     int num_actions;
-    bool render_human;
+    int spin_wait_us;
+    bool perf_stats_enabled;
+
+    // time callers spent blocked in wait_for_stepping_threads, when perf_stats_enabled is set
+    WaitStats wait_stats;
 
     std::vector<std::shared_ptr<Game>> games;
 
+    // registered by set_buffers or set_buffer_sets
+    std::vector<BufferSet> buffer_sets;
+
+    // snapshots of freshly generated levels, null unless level_cache_mb is set
+    std::shared_ptr<LevelCache> level_cache;
+
+    // per-env scratch space for serialized states, reused between calls
+    std::vector<std::vector<char>> state_bufs;
+    std::vector<size_t> state_sizes;
+    // the same for the source states of clone_envs
+    std::vector<std::vector<char>> clone_bufs;
+    std::vector<size_t> clone_sizes;
+
     VecGame(int _nenvs, VecOptions opt_vec);
     ~VecGame();
 
     void set_buffers(const std::vector<std::vector<void *>> &ac, const std::vector<std::vector<void *>> &ob, const std::vector<std::vector<void *>> &info, float *rew, uint8_t *first);
+    // register several sets of buffers at once and point every game at set 0, use_buffer_set
+    // then switches the games in [start, stop) to another set without rebuilding the pointers,
+    // e.g. to double buffer the outputs of one half of the batch while the other is stepping
+    void set_buffer_sets(std::vector<BufferSet> sets);
+    void use_buffer_set(int idx, int start, int stop);
     void observe();
     void act();
     void wait_for_stepping_threads();
 
+    // the same operations restricted to the games in [start, stop), so that one
+    // part of the batch can be simulated while the caller works on another
+    void observe_range(int start, int stop);
+    void act_range(int start, int stop);
+    void wait_for_stepping_threads(int start, int stop);
+
+    // run fn(env_idx) for every env in [start, stop) on the stepping threads and wait for
+    // it to finish, fn runs on the calling thread if there are no stepping threads
+    void parallel_for(int start, int stop, const std::function<void(int)> &fn);
+
+    // step every game num_steps times on the stepping threads without returning in between,
+    // actions and the outputs are laid out step major, so step t of env e uses
+    // actions[t * num_envs + e], ob and info hold one pointer per observation and info
+    // space, the output buffers are left holding the last step as if it came from act()
+    void rollout(const int32_t *actions, int num_steps, void **ob, void **info, float *rew, uint8_t *first);
+
   private:
-    // this mutex synchronizes access to pending_games and game->is_waiting_for_step
-    // when game->is_waiting_for_step is set to true
-    // ownership of game objects is transferred to the stepping thread until
-    // game->is_waiting_for_step is set to false
+    // this mutex synchronizes access to pending_jobs and active_jobs
+    // when a job is queued, ownership of the game objects in its range is transferred
+    // to the stepping threads until the job's remaining counter drops to zero
     std::mutex stepping_thread_mutex;
-    std::list<std::shared_ptr<Game>> pending_games;
-    std::condition_variable pending_games_added;
-    std::condition_variable pending_game_complete;
+    std::deque<std::shared_ptr<SteppingJob>> pending_jobs;
+    std::vector<std::shared_ptr<SteppingJob>> active_jobs;
+    std::condition_variable pending_jobs_added;
+    std::condition_variable job_complete;
     std::vector<std::thread> threads;
     bool time_to_die = false;
+
+    void queue_job(int start, int stop, std::function<void(int)> fn);
+    void stepping_worker();
 };
@@ -0,0 +1,61 @@
+"""Tests for the benchmark entry point."""
+
+import json
+
+from procgen_gym import bench
+from procgen_gym.env import ENV_NAMES
+
+
+def test_supported_distribution_modes():
+    for env_name in ENV_NAMES:
+        modes = bench.supported_distribution_modes(env_name)
+        assert modes[:2] == ["easy", "hard"]
+    assert "extreme" in bench.supported_distribution_modes("starpilot")
+    assert "memory" in bench.supported_distribution_modes("maze")
+    assert "exploration" in bench.supported_distribution_modes("coinrun")
+    assert bench.supported_distribution_modes("bigfish") == ["easy", "hard"]
+
+
+def test_make_configs():
+    configs = bench.make_configs(["coinrun", "starpilot"], ["hard", "extreme"], [1, 4], [0], ["none"])
+    # coinrun has no extreme mode
+    assert len(configs) == 2 + 4
+    assert {c["env_name"] for c in configs} == {"coinrun", "starpilot"}
+
+
+def test_run_config():
+    result = bench.run_config("coinrun", num_envs=2, num_threads=0, num_steps=10, warmup_steps=2)
+    assert result["steps_per_sec"] > 0
+    assert 0 < result["step_latency_p50_ms"] <= result["step_latency_p99_ms"]
+    assert result["reset_latency_ms"] > 0
+
+    result = bench.run_config("maze", render_mode="rgb_array", num_steps=5, warmup_steps=0)
+    assert result["render_mode"] == "rgb_array"
+
+
+def test_compare_results():
+    baseline = [bench.run_config("coinrun", num_steps=5, warmup_steps=0)]
+    current = [dict(baseline[0], steps_per_sec=baseline[0]["steps_per_sec"] * 0.5)]
+    assert bench.compare_results(baseline, baseline) == []
+    regressions = bench.compare_results(baseline, current, max_regression=0.1)
+    assert len(regressions) == 1
+    assert regressions[0]["metric"] == "steps_per_sec"
+
+
+def test_main(tmp_path):
+    output = tmp_path / "bench.json"
+    args = [
+        "--env-names", "bigfish",
+        "--distribution-modes", "easy",
+        "--num-envs", "2",
+        "--num-threads", "0",
+        "--num-steps", "5",
+        "--warmup-steps", "0",
+        "--output", str(output),
+    ]
+    assert bench.main(args) == 0
+    report = json.loads(output.read_text())
+    assert len(report["results"]) == 1
+    assert report["results"][0]["env_name"] == "bigfish"
+    # comparing a run against itself passes with a generous threshold
+    assert bench.main(args + ["--no-isolate", "--compare", str(output), "--max-regression", "10"]) == 0
@@ -1,9 +1,16 @@
 """Core environment tests: seeding, determinism, state save/load, rendering."""
 
+import hashlib
+import os
+import struct
+
 import numpy as np
 import pytest
+from gymnasium.error import AlreadyPendingCallError, NoAsyncCallError
+
+from procgen_gym.env import COMPACT_SERIALIZE_VERSION, ENV_NAMES, SERIALIZE_VERSION, ProcgenVecEnv
 
-from procgen_gym.env import ENV_NAMES, ProcgenVecEnv
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
 
 @pytest.mark.parametrize("env_name", ENV_NAMES)
@@ -67,6 +74,376 @@ def test_state_save_load(coinrun_vec):
     assert np.array_equal(obs_saved, obs_restored)
 
 
+@pytest.mark.parametrize("num_threads", [0, 4])
+def test_batched_states(num_threads):
+    env = ProcgenVecEnv(num_envs=6, env_name="coinrun", rand_seed=1, num_threads=num_threads)
+    env.reset()
+    for _ in range(10):
+        env.step(np.zeros(6, dtype=np.int32))
+
+    data, offsets = env.get_states()
+    assert data.dtype == np.uint8 and offsets.dtype == np.int64
+    assert offsets.shape == (7,) and offsets[0] == 0 and offsets[-1] == len(data)
+    states = env.get_state()
+    for i, state in enumerate(states):
+        assert data[offsets[i]:offsets[i + 1]].tobytes() == state
+
+    mask = np.array([False, True, False, False, True, False])
+    masked_data, masked_offsets = env.get_states(mask)
+    assert masked_offsets.shape == (3,)
+    assert masked_data[masked_offsets[0]:masked_offsets[1]].tobytes() == states[1]
+    assert masked_data[masked_offsets[1]:masked_offsets[2]].tobytes() == states[4]
+
+    obs_saved, _, _, _, _ = env.step(np.zeros(6, dtype=np.int32))
+    for _ in range(10):
+        env.step(np.ones(6, dtype=np.int32))
+    after = env.get_state()
+
+    # restoring a subset leaves the other envs untouched
+    env.set_states(masked_data, masked_offsets, mask)
+    partial = env.get_state()
+    for i in range(6):
+        assert partial[i] == (states[i] if mask[i] else after[i])
+
+    env.set_states(data, offsets)
+    obs_restored, _, _, _, _ = env.step(np.zeros(6, dtype=np.int32))
+    assert np.array_equal(obs_saved, obs_restored)
+    env.close()
+
+
+@pytest.mark.parametrize("env_name", ["bigfish", "bossfight", "coinrun", "miner", "starpilot"])
+def test_load_baseline_state(env_name):
+    # saved in the default format by the version before the entity pool and compact states,
+    # after 30 steps of action 7 with rand_seed=7, bigfish, bossfight and starpilot have many
+    # spawned entities
+    with open(os.path.join(DATA_DIR, f"{env_name}_state_v0.bin"), "rb") as f:
+        state = f.read()
+    env = ProcgenVecEnv(num_envs=1, env_name=env_name, rand_seed=0, num_threads=0)
+    env.reset()
+    env.set_state([state])
+    assert env.get_state() == [state]
+
+    compact_state = env.get_state(compact=True)
+    obs_saved, _, _, _, _ = env.step(np.array([7], dtype=np.int32))
+    env.set_state([state])
+    obs_restored, _, _, _, _ = env.step(np.array([7], dtype=np.int32))
+    assert np.array_equal(obs_saved, obs_restored)
+    env.set_state(compact_state)
+    assert env.get_state() == [state]
+    env.close()
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+def test_compact_states(env_name):
+    env = ProcgenVecEnv(num_envs=4, env_name=env_name, rand_seed=0)
+    env.reset()
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        env.step(rng.randint(low=0, high=15, size=4))
+
+    states = env.get_state()
+    compact_states = env.get_state(compact=True)
+    assert sum(map(len, compact_states)) * 2 < sum(map(len, states))
+
+    obs_saved, rew_saved, _, _, _ = env.step(np.zeros(4, dtype=np.int32))
+    for _ in range(10):
+        env.step(np.ones(4, dtype=np.int32))
+
+    # both formats restore exactly the same state
+    env.set_state(compact_states)
+    assert env.get_state() == states
+    assert env.get_state(compact=True) == compact_states
+    obs_restored, rew_restored, _, _, _ = env.step(np.zeros(4, dtype=np.int32))
+    assert np.array_equal(obs_saved, obs_restored)
+    assert np.array_equal(rew_saved, rew_restored)
+    env.close()
+
+
+def test_state_version_mismatch():
+    env = ProcgenVecEnv(num_envs=2, env_name="coinrun", rand_seed=0, num_threads=0)
+    env.reset()
+    states = env.get_state()
+    compact_states = env.get_state(compact=True)
+
+    # the version is the first int of a default state, a varint after the 4 byte magic in a compact one
+    newer = struct.pack("<i", SERIALIZE_VERSION + 1) + states[1][4:]
+    with pytest.raises(ValueError, match="state 1 uses format version 1"):
+        env.set_state([states[0], newer])
+    older = compact_states[0][:4] + bytes([(COMPACT_SERIALIZE_VERSION + 1) << 1]) + compact_states[0][5:]
+    with pytest.raises(ValueError, match=f"compact format version {COMPACT_SERIALIZE_VERSION + 1}"):
+        env.set_state([older, compact_states[1]])
+    # versions from 64 on take more than one varint byte, 1000 is zigzag encoded as 2000
+    newer = compact_states[1][:4] + bytes([0xD0, 0x0F]) + compact_states[1][5:]
+    with pytest.raises(ValueError, match="state 1 uses compact format version 1000,"):
+        env.set_state([compact_states[0], newer])
+    with pytest.raises(ValueError, match="state 0 is too short"):
+        env.set_state([compact_states[1][:4] + bytes([0xD0]), compact_states[1]])
+
+    # nothing was restored and the env can still be used
+    env.set_state(compact_states)
+    assert env.get_state() == states
+    env.close()
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+@pytest.mark.parametrize("frame_stack", [1, 4])
+def test_clone_envs(env_name, frame_stack):
+    env = ProcgenVecEnv(num_envs=6, env_name=env_name, rand_seed=0, frame_stack=frame_stack)
+    env.reset()
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        env.step(rng.randint(low=0, high=15, size=6))
+
+    states = env.get_state()
+    env.clone_envs([2, 2, 4], [0, 5, 1])
+    env.clone_env(4, 3)
+    cloned = env.get_state()
+    for dst, src in enumerate([2, 4, 2, 4, 4, 2]):
+        assert cloned[dst] == states[src]
+
+    # the copies, including their frame stacks, evolve exactly like their sources
+    for _ in range(30):
+        actions = rng.randint(low=0, high=15, size=6)
+        actions[[0, 5]] = actions[2]
+        actions[[1, 3]] = actions[4]
+        obs, rew, terminated, _, info = env.step(actions)
+        for dst, src in [(0, 2), (5, 2), (1, 4), (3, 4)]:
+            assert np.array_equal(obs[dst], obs[src])
+            assert rew[dst] == rew[src]
+            assert terminated[dst] == terminated[src]
+            assert info["level_seed"][dst] == info["level_seed"][src]
+
+    with pytest.raises(AssertionError):
+        env.clone_envs([0, 1], [2, 2])
+    with pytest.raises(AssertionError):
+        env.clone_envs([0, 1], [1, 2])
+    with pytest.raises(AssertionError):
+        env.clone_env(0, 6)
+    env.close()
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+@pytest.mark.parametrize("frame_stack", [1, 2])
+def test_rollout(env_name, frame_stack):
+    num_envs, num_steps = 3, 200
+    rng = np.random.RandomState(0)
+    actions = rng.randint(low=0, high=15, size=(num_steps, num_envs))
+    actions[50, 1] = -1
+
+    stepped = ProcgenVecEnv(num_envs=num_envs, env_name=env_name, rand_seed=0, frame_stack=frame_stack)
+    rolled = ProcgenVecEnv(num_envs=num_envs, env_name=env_name, rand_seed=0, frame_stack=frame_stack)
+    out = rolled.make_rollout_buffers(num_steps)
+    obs, rew, terminated, truncated, info = rolled.rollout(actions, out=out)
+    assert obs is out["obs"] and not truncated.any()
+
+    for t in range(num_steps):
+        step_obs, step_rew, step_terminated, _, step_info = stepped.step(actions[t])
+        assert np.array_equal(obs[t], step_obs)
+        assert np.array_equal(rew[t], step_rew)
+        assert np.array_equal(terminated[t], step_terminated)
+        for key, value in step_info.items():
+            assert np.array_equal(info[key][t], value)
+
+    # the envs carry on from the end of the rollout
+    assert np.array_equal(rolled.reset()[0], stepped.reset()[0])
+    assert np.array_equal(rolled.step(actions[0])[0], stepped.step(actions[0])[0])
+
+    with pytest.raises(AssertionError):
+        rolled.rollout(actions[:, :2])
+    with pytest.raises(AssertionError):
+        rolled.rollout(actions[:10], out=out)
+    with pytest.raises(AssertionError, match="integers"):
+        rolled.rollout(actions.astype(np.float32))
+    with pytest.raises(AssertionError, match=r"\[-1, 15\)"):
+        rolled.rollout(np.full((2, num_envs), 15))
+    with pytest.raises(AssertionError, match=r"\[-1, 15\)"):
+        rolled.rollout(np.full((2, num_envs), -2))
+
+    # reused buffers don't keep stale truncations
+    out["truncated"].fill(True)
+    rolled.rollout(actions, out=out)
+    assert not out["truncated"].any()
+    stepped.close()
+    rolled.close()
+
+
+def test_zero_copy_matches_copy():
+    def collect(copy):
+        rng = np.random.RandomState(0)
+        env = ProcgenVecEnv(num_envs=4, env_name="coinrun", rand_seed=7, copy=copy)
+        obs, _ = env.reset()
+        results = [np.array(obs)]
+        for _ in range(64):
+            actions = rng.randint(low=0, high=15, size=(4,), dtype=np.int32)
+            obs, rew, terminated, truncated, info = env.step(actions)
+            results.append(np.array(obs))
+            results.append(np.array(rew))
+            results.append(np.array(terminated))
+            results.append(np.array(info["level_seed"]))
+        env.close()
+        return results
+
+    for a, b in zip(collect(True), collect(False)):
+        assert np.array_equal(a, b)
+
+
+def test_zero_copy_views():
+    env = ProcgenVecEnv(num_envs=2, env_name="coinrun", rand_seed=0, copy=False)
+    env.reset()
+
+    obs1, rew1, _, _, info1 = env.step(np.zeros(2, dtype=np.int32))
+    assert not obs1.flags.writeable
+    assert not rew1.flags.writeable
+    assert not info1["level_seed"].flags.writeable
+    with pytest.raises(ValueError):
+        obs1[0, 0, 0, 0] = 0
+
+    saved = obs1.copy()
+    obs2, _, _, _, _ = env.step(np.full(2, 7, dtype=np.int32))
+    # double buffering keeps the previous step's arrays intact
+    assert not np.shares_memory(obs1, obs2)
+    assert np.array_equal(obs1, saved)
+    env.close()
+
+
+@pytest.mark.parametrize("num_threads", [0, 2])
+def test_zero_copy_half_views(num_threads):
+    env = ProcgenVecEnv(num_envs=4, env_name="coinrun", rand_seed=0, num_threads=num_threads, copy=False)
+    env.reset()
+
+    env.step_half_async(0, np.zeros(2, dtype=np.int32))
+    obs1, rew1, _, _, info1 = env.step_half_wait(0)
+    assert obs1.shape[0] == 2
+    assert not obs1.flags.writeable
+    saved = [obs1.copy(), rew1.copy(), info1["level_seed"].copy()]
+
+    # stepping either half again keeps the views of the last step of half 0 intact
+    env.step_half_async(1, np.full(2, 7, dtype=np.int32))
+    env.step_half_async(0, np.full(2, 7, dtype=np.int32))
+    obs2, _, _, _, _ = env.step_half_wait(0)
+    env.step_half_wait(1)
+    assert not np.shares_memory(obs1, obs2)
+    for a, b in zip(saved, [obs1, rew1, info1["level_seed"]]):
+        assert np.array_equal(a, b)
+
+    # a full step after the halves were stepped a different number of times
+    env.step_half_async(0, np.full(2, 7, dtype=np.int32))
+    obs3, _, _, _, _ = env.step_half_wait(0)
+    saved = obs3.copy()
+    obs4, _, _, _, _ = env.step(np.full(4, 7, dtype=np.int32))
+    assert obs4.shape[0] == 4
+    assert not obs4.flags.writeable
+    assert np.array_equal(obs3, saved)
+    env.close()
+
+
+@pytest.mark.parametrize("num_threads", [0, 2])
+def test_zero_copy_half_steps_match_copy(num_threads):
+    def collect(copy):
+        rng = np.random.RandomState(0)
+        env = ProcgenVecEnv(num_envs=4, env_name="maze", rand_seed=3, num_threads=num_threads, copy=copy)
+        env.reset()
+        results = []
+        for t in range(64):
+            actions = rng.randint(low=0, high=15, size=(4,), dtype=np.int32)
+            # half 0 is stepped twice as often as half 1, with a full step now and then
+            if t % 5 == 4:
+                steps = [env.step(actions)]
+            else:
+                env.step_half_async(0, actions[:2])
+                steps = [env.step_half_wait(0)]
+                if t % 2 == 0:
+                    env.step_half_async(1, actions[2:])
+                    steps.append(env.step_half_wait(1))
+            results.extend(np.array(x) for step in steps for x in (step[0], step[1], step[4]["level_seed"]))
+        env.close()
+        return results
+
+    for a, b in zip(collect(True), collect(False)):
+        assert np.array_equal(a, b)
+
+
+def test_output_buffers():
+    def make_env():
+        return ProcgenVecEnv(num_envs=3, env_name="bigfish", rand_seed=4, num_threads=2)
+
+    env, reference = make_env(), make_env()
+    env.reset()
+    reference.reset()
+    actions = np.zeros(3, dtype=np.int32)
+    # buffers for a single step have the shapes of the results of step()
+    buffer_sets = [
+        {
+            "obs": out["obs"][0],
+            "reward": out["reward"][0],
+            "terminated": out["terminated"][0],
+            "info": {k: v[0] for k, v in out["info"].items()},
+        }
+        for out in [env.make_rollout_buffers(1) for _ in range(2)]
+    ]
+    env.set_output_buffers(actions, buffer_sets)
+
+    rng = np.random.RandomState(0)
+    for t in range(40):
+        actions[:] = rng.randint(low=0, high=15, size=3)
+        env.step_into(t % 2)
+        obs, rew, terminated, _, info = reference.step(actions)
+        arrays = buffer_sets[t % 2]
+        assert np.array_equal(arrays["obs"], obs)
+        assert np.array_equal(arrays["reward"], rew)
+        assert np.array_equal(arrays["terminated"], terminated)
+        assert np.array_equal(arrays["info"]["level_seed"], info["level_seed"])
+
+    with pytest.raises(AssertionError, match="int32"):
+        env.set_output_buffers(actions.astype(np.int64), buffer_sets)
+    with pytest.raises(IndexError):
+        env.step_into(2)
+    env.close()
+    reference.close()
+
+
+@pytest.mark.parametrize("num_threads", [0, 2])
+def test_step_async_matches_step(num_threads):
+    def collect(pipelined):
+        rng = np.random.RandomState(0)
+        env = ProcgenVecEnv(num_envs=4, env_name="maze", rand_seed=3, num_threads=num_threads)
+        results = []
+        for _ in range(64):
+            actions = rng.randint(low=0, high=15, size=(4,), dtype=np.int32)
+            if pipelined:
+                env.step_half_async(0, actions[:2])
+                env.step_half_async(1, actions[2:])
+                halves = [env.step_half_wait(0), env.step_half_wait(1)]
+                step = [np.concatenate(parts) for parts in zip(*[h[:4] for h in halves])]
+            else:
+                env.step_async(actions)
+                step = env.step_wait()[:4]
+            results.extend(np.array(x) for x in step)
+        env.close()
+        return results
+
+    for a, b in zip(collect(False), collect(True)):
+        assert np.array_equal(a, b)
+
+
+def test_step_async_errors(coinrun_vec2):
+    with pytest.raises(NoAsyncCallError):
+        coinrun_vec2.step_wait()
+    coinrun_vec2.step_async(np.zeros(2, dtype=np.int32))
+    with pytest.raises(AlreadyPendingCallError):
+        coinrun_vec2.step_async(np.zeros(2, dtype=np.int32))
+    with pytest.raises(AlreadyPendingCallError):
+        coinrun_vec2.step_half_async(0, np.zeros(1, dtype=np.int32))
+    coinrun_vec2.step_wait()
+
+    coinrun_vec2.step_half_async(1, np.zeros(1, dtype=np.int32))
+    with pytest.raises(NoAsyncCallError):
+        coinrun_vec2.step_half_wait(0)
+    obs, rew, terminated, truncated, info = coinrun_vec2.step_half_wait(1)
+    assert obs.shape == (1, 64, 64, 3)
+    assert rew.shape == terminated.shape == truncated.shape == (1,)
+
+
 def test_render_mode_rgb_array(coinrun_vec_rgb):
     coinrun_vec_rgb.reset()
 
@@ -78,6 +455,522 @@ def test_render_mode_rgb_array(coinrun_vec_rgb):
     assert frames[0].shape[-1] == 3
 
 
+@pytest.mark.parametrize("obs_format", ["rgb", "gray", "rgb_chw", "gray_chw"])
+def test_obs_format(obs_format):
+    def collect(fmt):
+        env = ProcgenVecEnv(num_envs=2, env_name="heist", rand_seed=4, obs_format=fmt)
+        obs, _ = env.reset()
+        obses = [obs]
+        for _ in range(8):
+            obs, _, _, _, _ = env.step(np.array([1, 7], dtype=np.int32))
+            obses.append(obs)
+        assert env.single_observation_space.shape == obs.shape[1:]
+        assert env.observation_space.shape == obs.shape
+        env.close()
+        return np.array(obses)
+
+    rgb = collect("rgb")
+    obs = collect(obs_format)
+
+    if obs_format.startswith("gray"):
+        # same conversion as gymnasium's GrayscaleObservation, up to float rounding
+        expected = np.sum(np.multiply(rgb, np.array([0.2125, 0.7154, 0.0721])), axis=-1)
+        expected = expected.astype(np.uint8)[..., None]
+    else:
+        expected = rgb
+    if obs_format.endswith("_chw"):
+        expected = np.moveaxis(expected, -1, -3)
+
+    assert obs.shape == expected.shape
+    assert obs.dtype == np.uint8
+    assert np.abs(obs.astype(np.int16) - expected.astype(np.int16)).max() <= 1
+
+
+@pytest.mark.parametrize("env_name", ["bigfish", "coinrun", "miner"])
+@pytest.mark.parametrize("action_repeat,max_pool_last", [(1, 1), (4, 1), (4, 2), (3, 3)])
+def test_action_repeat(env_name, action_repeat, max_pool_last):
+    env = ProcgenVecEnv(num_envs=1, env_name=env_name, rand_seed=5)
+    repeat_env = ProcgenVecEnv(
+        num_envs=1, env_name=env_name, rand_seed=5, action_repeat=action_repeat, max_pool_last=max_pool_last
+    )
+
+    obs, _ = env.reset()
+    repeat_obs, _ = repeat_env.reset()
+    rng = np.random.RandomState(0)
+    episodes = 0
+    for t in range(200):
+        assert np.array_equal(repeat_obs, obs)
+        actions = rng.randint(low=0, high=15, size=(1,), dtype=np.int32)
+        if t % 100 == 99:
+            actions[0] = -1
+        total_rew = 0
+        frames = []
+        for _ in range(action_repeat):
+            obs, rew, terminated, _, info = env.step(actions)
+            total_rew += rew
+            frames.append(obs)
+            if terminated[0]:
+                break
+        if not terminated[0]:
+            obs = np.max(frames[-max_pool_last:], axis=0)
+        repeat_obs, repeat_rew, repeat_terminated, _, repeat_info = repeat_env.step(actions)
+        assert np.array_equal(repeat_rew, total_rew)
+        assert np.array_equal(repeat_terminated, terminated)
+        assert np.array_equal(repeat_info["level_seed"], info["level_seed"])
+        assert np.array_equal(repeat_info["prev_level_seed"], info["prev_level_seed"])
+        episodes += terminated[0]
+    assert episodes >= 2
+    env.close()
+    repeat_env.close()
+
+    with pytest.raises(AssertionError):
+        ProcgenVecEnv(num_envs=1, env_name=env_name, action_repeat=2, max_pool_last=3)
+
+
+@pytest.mark.parametrize("env_name", ["jumper", "leaper"])
+def test_action_repeat_sequential_levels(env_name):
+    # a level completed during the repeat ends it, and the observation is the first frame of
+    # the next level without pooling in frames of the old one
+    kwargs = dict(num_envs=1, env_name=env_name, rand_seed=5, distribution_mode="easy", use_sequential_levels=True)
+    env = ProcgenVecEnv(**kwargs)
+    repeat_env = ProcgenVecEnv(action_repeat=4, max_pool_last=2, **kwargs)
+
+    obs, _ = env.reset()
+    repeat_obs, _ = repeat_env.reset()
+    rng = np.random.RandomState(0)
+    level_changes = 0
+    for _ in range(500):
+        assert np.array_equal(repeat_obs, obs)
+        actions = rng.randint(low=0, high=15, size=(1,), dtype=np.int32)
+        frames = []
+        for _ in range(4):
+            obs, _, terminated, _, info = env.step(actions)
+            frames.append(obs)
+            level_changed = terminated[0] or info["prev_level_complete"][0]
+            if level_changed:
+                break
+        if not level_changed:
+            obs = np.max(frames[-2:], axis=0)
+        repeat_obs, _, _, _, repeat_info = repeat_env.step(actions)
+        assert np.array_equal(repeat_info["level_seed"], info["level_seed"])
+        level_changes += info["prev_level_complete"][0] and not terminated[0]
+    assert level_changes > 0
+    env.close()
+    repeat_env.close()
+
+
+@pytest.mark.parametrize("env_name", ["bigfish", "chaser", "miner"])
+@pytest.mark.parametrize("action_repeat", [1, 3])
+def test_episode_statistics(env_name, action_repeat):
+    num_envs = 4
+    env = ProcgenVecEnv(num_envs=num_envs, env_name=env_name, rand_seed=1, action_repeat=action_repeat)
+    _, info = env.reset()
+    returns = np.zeros(num_envs, dtype=np.float32)
+    lengths = np.zeros(num_envs, dtype=np.int32)
+    seeds = info["level_seed"].copy()
+    rng = np.random.RandomState(0)
+    episodes = 0
+    for t in range(300):
+        actions = rng.randint(low=0, high=15, size=(num_envs,), dtype=np.int32)
+        if t % 100 == 99:
+            actions[0] = -1
+        _, rew, terminated, _, info = env.step(actions)
+        returns += rew
+        lengths += 1
+        # with action_repeat the C++ side sums the rewards of each game step
+        np.testing.assert_allclose(info["episode_return"], np.where(terminated, returns, 0), rtol=1e-5)
+        np.testing.assert_array_equal(info["episode_length"], np.where(terminated, lengths, 0))
+        np.testing.assert_array_equal(info["prev_level_seed"][terminated], seeds[terminated])
+        returns[terminated] = 0
+        lengths[terminated] = 0
+        seeds = info["level_seed"].copy()
+        episodes += terminated.sum()
+    assert episodes >= 3
+    env.close()
+
+
+def test_episode_statistics_in_state():
+    env = ProcgenVecEnv(num_envs=1, env_name="bigfish", rand_seed=1)
+    env.reset()
+    for _ in range(20):
+        env.step(np.array([1], dtype=np.int32))
+    compact_state = env.get_state(compact=True)
+    state = env.get_state()
+    restored = ProcgenVecEnv(num_envs=1, env_name="bigfish", rand_seed=2)
+    restored.reset()
+    restored.set_state(compact_state)
+    # end the episode so both envs report the statistics of the running one
+    _, _, _, _, info = env.step(np.array([-1], dtype=np.int32))
+    _, _, _, _, restored_info = restored.step(np.array([-1], dtype=np.int32))
+    assert info["episode_length"][0] == 21
+    assert restored_info["episode_length"][0] == info["episode_length"][0]
+    assert restored_info["episode_return"][0] == info["episode_return"][0]
+
+    # the default format leaves the statistics out, the episode in progress reports them as unknown
+    restored.set_state(state)
+    compact_state = restored.get_state(compact=True)
+    _, _, terminated, _, restored_info = restored.step(np.array([-1], dtype=np.int32))
+    assert terminated[0]
+    assert np.isnan(restored_info["episode_return"][0])
+    assert restored_info["episode_length"][0] == -1
+    # including after a round trip through the compact format
+    restored.set_state(compact_state)
+    _, _, _, _, restored_info = restored.step(np.array([-1], dtype=np.int32))
+    assert restored_info["episode_length"][0] == -1
+
+    # the next episode is counted normally
+    for _ in range(20):
+        restored.step(np.array([1], dtype=np.int32))
+    _, _, _, _, restored_info = restored.step(np.array([-1], dtype=np.int32))
+    assert restored_info["episode_length"][0] == 21
+    assert not np.isnan(restored_info["episode_return"][0])
+    env.close()
+    restored.close()
+
+
+@pytest.mark.parametrize("obs_format", ["rgb", "gray_chw"])
+@pytest.mark.parametrize("frame_stack", [2, 4])
+def test_frame_stack(obs_format, frame_stack):
+    def make_env(k):
+        return ProcgenVecEnv(
+            num_envs=3, env_name="bigfish", rand_seed=2, obs_format=obs_format, frame_stack=k
+        )
+
+    env, stacked_env = make_env(1), make_env(frame_stack)
+    channel_axis = -1 if obs_format == "rgb" else -3
+    assert stacked_env.single_observation_space.shape[channel_axis] == (
+        env.single_observation_space.shape[channel_axis] * frame_stack
+    )
+
+    obs, _ = env.reset()
+    stacked, _ = stacked_env.reset()
+    history = [np.zeros_like(obs)] * (frame_stack - 1) + [obs]
+    rng = np.random.RandomState(0)
+    saw_first = False
+    for _ in range(300):
+        assert np.array_equal(stacked, np.concatenate(history[-frame_stack:], axis=channel_axis))
+        actions = rng.randint(low=0, high=15, size=(3,), dtype=np.int32)
+        obs, _, terminated, _, _ = env.step(actions)
+        stacked, _, _, _, _ = stacked_env.step(actions)
+        # the stack restarts from zeros at the first frame of each episode
+        history = [np.where(terminated[:, None, None, None], 0, h) for h in history]
+        history.append(obs)
+        saw_first |= terminated.any()
+    assert saw_first
+
+    env.close()
+    stacked_env.close()
+
+
+@pytest.mark.parametrize("num_threads", [0, 2])
+def test_render_env_indices(num_threads):
+    env = ProcgenVecEnv(
+        num_envs=3, env_name="coinrun", rand_seed=0, render_mode="rgb_array", num_threads=num_threads
+    )
+    env.reset()
+    for _ in range(5):
+        env.step(np.array([7, 7, 7], dtype=np.int32))
+
+    frames = env.render()
+    assert len(frames) == 3
+    assert all(frame.shape == (512, 512, 3) and frame.dtype == np.uint8 for frame in frames)
+    assert not np.array_equal(frames[0], frames[1])
+
+    subset = env.render([2, 0, 2])
+    assert len(subset) == 3
+    assert np.array_equal(subset[0], frames[2])
+    assert np.array_equal(subset[1], frames[0])
+    assert np.array_equal(subset[2], frames[2])
+
+    # frames are rendered from the current state, not the state at the last observe
+    env.step(np.array([7, 7, 7], dtype=np.int32))
+    assert not np.array_equal(env.render([0])[0], frames[0])
+    env.close()
+
+
+def test_render_disabled(coinrun_vec):
+    assert coinrun_vec.render() is None
+    assert "rgb" not in coinrun_vec.reset()[1]
+
+
+@pytest.mark.parametrize("num_threads", [0, 2])
+def test_perf_stats(num_threads):
+    env = ProcgenVecEnv(num_envs=2, env_name="coinrun", rand_seed=0, num_threads=num_threads, perf_stats=True)
+    env.reset()
+    num_steps = 20
+    for _ in range(num_steps):
+        env.step(np.array([7, 7], dtype=np.int32))
+
+    stats = env.get_perf_stats()
+    assert set(stats) == {"game_step", "render", "convert", "reset", "wait"}
+    assert np.all(stats["game_step"]["count"] == num_steps)
+    # one observation for the initial reset plus one per step
+    assert np.all(stats["render"]["count"] == num_steps + 1)
+    assert np.all(stats["convert"]["count"] == num_steps + 1)
+    assert np.all(stats["reset"]["count"] >= 1)
+    assert np.all(stats["game_step"]["time_s"] > 0)
+    if num_threads > 0:
+        assert stats["wait"]["count"] > 0
+    else:
+        assert stats["wait"]["count"] == 0
+
+    env.reset_perf_stats()
+    stats = env.get_perf_stats()
+    assert np.all(stats["game_step"]["count"] == 0)
+    assert np.all(stats["render"]["time_s"] == 0)
+    env.close()
+
+
+def test_perf_stats_disabled(coinrun_vec):
+    coinrun_vec.step(np.zeros(coinrun_vec.num_envs, dtype=np.int32))
+    with pytest.raises(AssertionError):
+        coinrun_vec.get_perf_stats()
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+def test_level_cache(env_name):
+    kwargs = dict(num_envs=4, env_name=env_name, num_levels=3, start_level=0, rand_seed=0, num_threads=2)
+    env = ProcgenVecEnv(**kwargs)
+    cached_env = ProcgenVecEnv(level_cache_mb=16, **kwargs)
+    env.reset()
+    cached_env.reset()
+
+    rng = np.random.RandomState(0)
+    for _ in range(300):
+        # force frequent resets so that levels repeat
+        actions = np.where(rng.rand(4) < 0.05, -1, rng.randint(low=0, high=15, size=4)).astype(np.int32)
+        obs, rew, terminated, _, info = env.step(actions)
+        cached_obs, cached_rew, cached_terminated, _, cached_info = cached_env.step(actions)
+        assert np.array_equal(obs, cached_obs)
+        assert np.array_equal(rew, cached_rew)
+        assert np.array_equal(terminated, cached_terminated)
+        assert np.array_equal(info["level_seed"], cached_info["level_seed"])
+        if terminated.any():
+            # restored levels are indistinguishable from generated ones
+            assert env.get_state() == cached_env.get_state()
+
+    stats = cached_env.get_level_cache_stats()
+    assert stats["hits"] > 0
+    # one snapshot per level, envs generating the same level at the same time share it
+    assert stats["entries"] == 3
+    assert env.get_level_cache_stats()["entries"] == 0
+    env.close()
+    cached_env.close()
+
+
+@pytest.mark.parametrize("env_name,start_level", [("jumper", 0), ("leaper", 3)])
+def test_level_cache_sequential_levels(env_name, start_level):
+    # with one level, every episode continues into the same sequence of levels, so completed
+    # levels are restored from the cache in the middle of an episode
+    kwargs = dict(
+        num_envs=2, env_name=env_name, num_levels=1, start_level=start_level, rand_seed=0,
+        distribution_mode="easy", use_sequential_levels=True, frame_stack=3,
+    )
+    env = ProcgenVecEnv(**kwargs)
+    cached_env = ProcgenVecEnv(level_cache_mb=16, **kwargs)
+    env.reset()
+    cached_env.reset()
+
+    rng = np.random.RandomState(0)
+    level_changes = 0
+    for t in range(600):
+        actions = rng.randint(low=0, high=15, size=(2,), dtype=np.int32)
+        if t % 150 == 149:
+            actions[:] = -1
+        obs, rew, terminated, _, info = env.step(actions)
+        cached_obs, cached_rew, cached_terminated, _, cached_info = cached_env.step(actions)
+        assert np.array_equal(obs, cached_obs)
+        assert np.array_equal(rew, cached_rew)
+        assert np.array_equal(terminated, cached_terminated)
+        assert np.array_equal(info["level_seed"], cached_info["level_seed"])
+        level_changes += np.sum(info["prev_level_complete"] & ~terminated)
+
+    assert level_changes > 0
+    assert cached_env.get_level_cache_stats()["hits"] > 0
+    env.close()
+    cached_env.close()
+
+
+def test_level_cache_eviction():
+    env = ProcgenVecEnv(num_envs=8, env_name="maze", num_levels=200, rand_seed=0, num_threads=0, level_cache_mb=1)
+    env.reset()
+    for _ in range(100):
+        env.step(np.full(8, -1, dtype=np.int32))
+    stats = env.get_level_cache_stats()
+    assert stats["evictions"] > 0
+    assert 0 < stats["bytes"] <= 2 ** 20
+    assert stats["entries"] == stats["misses"] - stats["evictions"]
+    env.close()
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+@pytest.mark.parametrize("center_agent", [False, True])
+@pytest.mark.parametrize("distribution_mode", ["easy", "hard"])
+def test_cache_static_tiles(env_name, center_agent, distribution_mode):
+    # centered views of caveflyer, climber, coinrun, fruitbot, jumper and ninja scroll by
+    # fractions of a pixel, and the edges of the tiles blend with what is below them, the
+    # cached tiles must still match exactly
+    kwargs = dict(
+        num_envs=2, env_name=env_name, center_agent=center_agent, num_levels=5, rand_seed=0, num_threads=0,
+        distribution_mode=distribution_mode,
+    )
+    env = ProcgenVecEnv(**kwargs)
+    cached_env = ProcgenVecEnv(cache_static_tiles=True, **kwargs)
+    env.reset()
+    cached_env.reset()
+
+    rng = np.random.RandomState(0)
+    for step in range(400):
+        if step == 150:
+            # restoring a state has to redraw the layer
+            env.step(rng.randint(low=0, high=15, size=2))
+            cached_env.set_state(env.get_state())
+        if step < 300:
+            actions = rng.randint(low=0, high=15, size=2)
+        else:
+            # standing still, the layer is drawn again where the view stopped
+            actions = np.full(2, 4)
+        obs, *_ = env.step(actions)
+        cached_obs, *_ = cached_env.step(actions)
+        assert np.array_equal(obs, cached_obs)
+
+    env.close()
+    cached_env.close()
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+@pytest.mark.parametrize("render_backend", ["qt", "fast"])
+@pytest.mark.parametrize("distribution_mode", ["easy", "hard"])
+def test_cache_scaled_sprites(env_name, render_backend, distribution_mode):
+    kwargs = dict(
+        num_envs=4, env_name=env_name, num_levels=5, rand_seed=0, num_threads=2,
+        render_mode="rgb_array", render_backend=render_backend, distribution_mode=distribution_mode,
+    )
+    env = ProcgenVecEnv(**kwargs)
+    cached_env = ProcgenVecEnv(cache_scaled_sprites=True, **kwargs)
+    env.reset()
+    cached_env.reset()
+
+    rng = np.random.RandomState(0)
+    for _ in range(100):
+        actions = rng.randint(low=0, high=15, size=4)
+        obs, rew, terminated, *_ = env.step(actions)
+        cached_obs, cached_rew, cached_terminated, *_ = cached_env.step(actions)
+        assert np.array_equal(obs, cached_obs)
+        assert np.array_equal(rew, cached_rew)
+        assert np.array_equal(terminated, cached_terminated)
+
+    # the antialiased render keeps scaling sprites on every draw
+    assert np.array_equal(env.render(), cached_env.render())
+    env.close()
+    cached_env.close()
+
+
+@pytest.mark.parametrize(
+    "env_name,distribution_mode,expected",
+    [
+        ("caveflyer", "hard", "a077dc2df150ab40"),
+        ("caveflyer", "memory", "8b28394029d60fb1"),
+        ("chaser", "hard", "6dbbfe5a756f8fbc"),
+        ("heist", "hard", "e80634637a8071d7"),
+        ("heist", "memory", "453dbaccd8dcdc56"),
+        ("jumper", "hard", "bff64be63d7615d8"),
+        ("jumper", "memory", "760609efaf6eec6a"),
+        ("maze", "hard", "8f3c2a9bd1209d31"),
+        ("maze", "memory", "ee19af84f6bbc87c"),
+    ],
+)
+@pytest.mark.slow
+def test_level_generation_hashes(env_name, distribution_mode, expected):
+    # every env starts on a different level, the hashes pin the levels that the maze and room
+    # generators produce for these seeds, through the default state format which must not change
+    env = ProcgenVecEnv(
+        num_envs=2000, env_name=env_name, rand_seed=0, num_threads=0, distribution_mode=distribution_mode
+    )
+    h = hashlib.sha256()
+    for state in env.get_state():
+        h.update(state)
+    env.close()
+    assert h.hexdigest()[:16] == expected
+
+
+@pytest.mark.parametrize(
+    "distribution_mode,expected",
+    [
+        ("easy", "2caa4536f3132c77"),
+        ("hard", "1785bddde99b51b5"),
+        ("memory", "de8f3985ea14e906"),
+    ],
+)
+def test_miner_trajectory_hashes(distribution_mode, expected):
+    # miner only updates the grid cells near a change each step, the hashes pin the
+    # trajectories of the scan over every cell it replaced, like test_level_generation_hashes
+    # they rely on the default state format staying the same
+    env = ProcgenVecEnv(
+        num_envs=16, env_name="miner", rand_seed=0, num_threads=0, distribution_mode=distribution_mode
+    )
+    env.reset()
+    rng = np.random.RandomState(0)
+    h = hashlib.sha256()
+    for step in range(500):
+        _obs, rew, terminated, _truncated, _info = env.step(rng.randint(low=0, high=15, size=16))
+        h.update(rew.tobytes())
+        h.update(terminated.tobytes())
+        for state in env.get_state():
+            h.update(state)
+    env.close()
+    assert h.hexdigest()[:16] == expected
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+@pytest.mark.parametrize("rand_seed", [0, 1, 2])
+def test_collision_broadphase(env_name, rand_seed):
+    kwargs = dict(num_envs=4, env_name=env_name, rand_seed=rand_seed, num_threads=0)
+    env = ProcgenVecEnv(**kwargs)
+    # use the grid at any number of entities, the default only does for crowded levels
+    grid_env = ProcgenVecEnv(collision_broadphase=True, broadphase_min_entities=0, **kwargs)
+    env.reset()
+    grid_env.reset()
+
+    rng = np.random.RandomState(rand_seed)
+    for step in range(300):
+        actions = rng.randint(low=0, high=15, size=4)
+        obs, rew, terminated, *_ = env.step(actions)
+        grid_obs, grid_rew, grid_terminated, *_ = grid_env.step(actions)
+        # the broadphase must find the same collisions in the same order
+        assert np.array_equal(obs, grid_obs)
+        assert np.array_equal(rew, grid_rew)
+        assert np.array_equal(terminated, grid_terminated)
+        if step % 50 == 0:
+            assert env.get_state() == grid_env.get_state()
+    env.close()
+    grid_env.close()
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+@pytest.mark.parametrize("distribution_mode", ["easy", "hard"])
+def test_render_backend(env_name, distribution_mode):
+    kwargs = dict(num_envs=4, env_name=env_name, distribution_mode=distribution_mode, num_levels=5, rand_seed=0, num_threads=2, render_mode="rgb_array")
+    env = ProcgenVecEnv(**kwargs)
+    fast_env = ProcgenVecEnv(render_backend="fast", **kwargs)
+    env.reset()
+    fast_env.reset()
+
+    rng = np.random.RandomState(0)
+    for _ in range(100):
+        actions = rng.randint(low=0, high=15, size=4)
+        obs, rew, terminated, *_ = env.step(actions)
+        fast_obs, fast_rew, fast_terminated, *_ = fast_env.step(actions)
+        assert np.array_equal(obs, fast_obs)
+        assert np.array_equal(rew, fast_rew)
+        assert np.array_equal(terminated, fast_terminated)
+
+    # the antialiased render is always drawn by Qt
+    assert np.array_equal(env.render(), fast_env.render())
+    env.close()
+    fast_env.close()
+
+
 @pytest.mark.parametrize("env_name", ENV_NAMES)
 @pytest.mark.parametrize("num_envs", [1, 2, 16])
 def test_multi_speed(env_name, num_envs, benchmark):
@@ -93,3 +986,85 @@ def test_multi_speed(env_name, num_envs, benchmark):
 
     benchmark(lambda: rollout(1000))
     env.close()
+
+
+@pytest.mark.parametrize("copy", [True, False])
+@pytest.mark.parametrize("num_envs", [16, 64])
+def test_copy_speed(copy, num_envs, benchmark):
+    env = ProcgenVecEnv(num_envs=num_envs, env_name="bigfish", copy=copy)
+
+    actions = np.zeros(num_envs, dtype=np.int32)
+
+    def rollout(max_steps):
+        for _ in range(max_steps):
+            env.step(actions)
+
+    benchmark(lambda: rollout(1000))
+    env.close()
+
+
+@pytest.mark.parametrize("num_envs", [1, 16])
+def test_rollout_speed(num_envs, benchmark):
+    env = ProcgenVecEnv(num_envs=num_envs, env_name="bigfish")
+
+    # the outputs of every step are kept, so fewer steps than test_multi_speed
+    actions = np.zeros((250, num_envs), dtype=np.int32)
+    out = env.make_rollout_buffers(len(actions))
+
+    benchmark(lambda: env.rollout(actions, out=out))
+    env.close()
+
+
+@pytest.mark.parametrize("num_threads", [1, 4])
+@pytest.mark.parametrize("spin_wait_us", [0, 100])
+def test_step_latency(num_threads, spin_wait_us, benchmark):
+    # a small batch of a cheap game, where waking up the stepping threads dominates
+    env = ProcgenVecEnv(
+        num_envs=4,
+        env_name="maze",
+        num_threads=num_threads,
+        spin_wait_us=spin_wait_us,
+    )
+    actions = np.zeros(4, dtype=np.int32)
+
+    benchmark(env.step, actions)
+    env.close()
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("env_name", ["maze", "bigfish"])
+@pytest.mark.parametrize("num_threads", [4, 16])
+@pytest.mark.parametrize("spin_wait_us", [0, 100])
+def test_step_latency_large_batch(env_name, num_threads, spin_wait_us, benchmark):
+    # a large batch on many threads, where the threads contend for the job queue
+    env = ProcgenVecEnv(
+        num_envs=256,
+        env_name=env_name,
+        num_threads=num_threads,
+        spin_wait_us=spin_wait_us,
+    )
+    actions = np.zeros(256, dtype=np.int32)
+
+    benchmark(env.step, actions)
+    env.close()
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("num_envs", [64, 512])
+def test_get_states_speed(num_envs, compact, benchmark):
+    env = ProcgenVecEnv(num_envs=num_envs, env_name="coinrun")
+
+    def roundtrip():
+        env.set_states(*env.get_states(compact=compact))
+
+    benchmark.extra_info["state_bytes"] = int(len(env.get_states(compact=compact)[0]) // num_envs)
+    benchmark(roundtrip)
+    env.close()
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_get_states_only_speed(compact, benchmark):
+    env = ProcgenVecEnv(num_envs=64, env_name="coinrun")
+    benchmark.extra_info["state_bytes"] = int(len(env.get_states(compact=compact)[0]) // 64)
+    benchmark(env.get_states, compact=compact)
+    env.close()
@@ -4,7 +4,7 @@ import gymnasium as gym
 import numpy as np
 import pytest
 
-from procgen_gym.env import ENV_NAMES
+from procgen_gym.env import ENV_NAMES, default_num_threads
 
 
 @pytest.mark.parametrize("env_name", ENV_NAMES)
@@ -36,3 +36,49 @@ def test_gymnasium_make(env_name):
     assert isinstance(truncated, bool)
 
     env.close()
+
+
+@pytest.mark.parametrize("num_threads", [None, 0, 2])
+def test_make_vec_num_threads(num_threads):
+    env = gym.make_vec("procgen_gym/procgen-coinrun-v0", num_envs=4, num_threads=num_threads)
+    env.reset()
+    obs, rew, terminated, truncated, info = env.step(np.zeros(4, dtype=np.int32))
+    assert obs.shape == (4, 64, 64, 3)
+    env.close()
+
+
+@pytest.mark.parametrize("num_threads", [None, 0, 2])
+def test_make_num_threads(num_threads):
+    env = gym.make("procgen_gym/procgen-coinrun-v0", num_threads=num_threads)
+    env.reset()
+    obs, rew, terminated, truncated, info = env.step(0)
+    assert obs.shape == (64, 64, 3)
+    env.close()
+
+
+def test_default_num_threads():
+    assert default_num_threads(1) == 0
+    assert 1 <= default_num_threads(2) <= 2
+    assert default_num_threads(1024) >= 1
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+@pytest.mark.parametrize("num_envs", [16, 64])
+@pytest.mark.parametrize("num_threads", [0, None])
+def test_make_vec_scaling(env_name, num_envs, num_threads, benchmark):
+    # compares the default against stepping on the calling thread for every game, the full
+    # sweep with more thread counts is run with procgen-bench, see the README
+    env = gym.make_vec(
+        f"procgen_gym/procgen-{env_name}-v0", num_envs=num_envs, num_threads=num_threads
+    )
+    env.reset()
+
+    actions = np.zeros(num_envs, dtype=np.int32)
+
+    def rollout(max_steps):
+        for _ in range(max_steps):
+            env.step(actions)
+
+    benchmark(lambda: rollout(100))
+    env.close()
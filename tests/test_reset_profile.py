@@ -0,0 +1,99 @@
+"""Tests for the level generation latency profiler."""
+
+import json
+
+import numpy as np
+import pytest
+
+from procgen_gym import reset_profile
+from procgen_gym.env import ProcgenVecEnv
+
+
+def test_time_level_resets_keeps_state():
+    env = ProcgenVecEnv(num_envs=2, env_name="heist", rand_seed=0)
+    for _ in range(5):
+        env.step(np.zeros(2, dtype=np.int32))
+    states = env.get_state()
+    times = env.time_level_resets([0, 1, 2, 2 ** 31 - 1], env_idx=1)
+    assert times.shape == (4,)
+    assert np.all(times > 0)
+    assert env.get_state() == states
+    env.close()
+
+
+def test_time_level_resets_keeps_frame_stack():
+    def make_env():
+        return ProcgenVecEnv(num_envs=2, env_name="bigfish", rand_seed=0, frame_stack=4)
+
+    env, reference = make_env(), make_env()
+    rng = np.random.RandomState(0)
+    for t in range(30):
+        actions = rng.randint(low=0, high=15, size=(2,), dtype=np.int32)
+        obs, _, _, _, _ = env.step(actions)
+        expected, _, _, _, _ = reference.step(actions)
+        if t == 10:
+            env.time_level_resets([0, 1, 2], env_idx=1)
+            assert np.array_equal(env.reset()[0], obs)
+        assert np.array_equal(obs, expected)
+    env.close()
+    reference.close()
+
+
+def test_time_level_resets_keeps_episode_stats():
+    def make_env():
+        return ProcgenVecEnv(num_envs=2, env_name="coinrun", rand_seed=0)
+
+    env, reference = make_env(), make_env()
+    rng = np.random.RandomState(0)
+    finished = False
+    for t in range(2000):
+        actions = rng.randint(low=0, high=15, size=(2,), dtype=np.int32)
+        _, _, terminated, truncated, infos = env.step(actions)
+        _, _, _, _, expected_infos = reference.step(actions)
+        if t == 10:
+            env.time_level_resets([0, 1, 2], env_idx=1)
+        assert np.array_equal(infos["episode_return"], expected_infos["episode_return"])
+        assert np.array_equal(infos["episode_length"], expected_infos["episode_length"])
+        # the episode that was running during the call is checked once it ends
+        finished = terminated[1] or truncated[1]
+        if finished:
+            break
+    assert finished
+    env.close()
+    reference.close()
+
+
+def test_time_level_resets_generated_assets():
+    env = ProcgenVecEnv(num_envs=1, env_name="maze", use_generated_assets=True)
+    with pytest.raises(AssertionError, match="use_generated_assets"):
+        env.time_level_resets([0])
+    env.close()
+
+
+def test_profile_resets():
+    result = reset_profile.profile_resets("maze", num_seeds=20, repeats=2, num_worst=3)
+    assert result["num_seeds"] == 20
+    assert 0 < result["p50_ms"] <= result["p99_ms"] <= result["max_ms"]
+    assert len(result["worst"]) == 3
+    latencies = [w["latency_ms"] for w in result["worst"]]
+    assert latencies == sorted(latencies, reverse=True)
+    assert latencies[0] == result["max_ms"]
+    assert all(0 <= w["seed"] < 20 for w in result["worst"])
+
+
+def test_main(tmp_path):
+    output = tmp_path / "reset_profile.json"
+    args = [
+        "--env-names", "coinrun", "starpilot",
+        "--distribution-modes", "easy", "extreme",
+        "--start-seed", "100",
+        "--num-seeds", "5",
+        "--repeats", "1",
+        "--output", str(output),
+    ]
+    assert reset_profile.main(args) == 0
+    report = json.loads(output.read_text())
+    # coinrun has no extreme mode
+    configs = [(r["env_name"], r["distribution_mode"]) for r in report["results"]]
+    assert configs == [("coinrun", "easy"), ("starpilot", "easy"), ("starpilot", "extreme")]
+    assert len(report["results"][0]["worst"]) == 5
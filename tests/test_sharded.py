@@ -0,0 +1,113 @@
+"""Tests for the multi-process sharded vector environment."""
+
+import numpy as np
+import pytest
+from gymnasium.error import AlreadyPendingCallError, NoAsyncCallError
+
+from procgen_gym import ProcgenShardedVecEnv
+from procgen_gym.env import ProcgenVecEnv
+from procgen_gym.sharded import _CMD_STEP
+
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_sharded_matches_shards(copy):
+    env = ProcgenShardedVecEnv(num_envs=5, num_workers=2, env_name="maze", rand_seed=3, copy=copy)
+    # the batch is split into contiguous shards, shard i is seeded with rand_seed + i
+    shards = [
+        ProcgenVecEnv(num_envs=3, env_name="maze", rand_seed=3),
+        ProcgenVecEnv(num_envs=2, env_name="maze", rand_seed=4),
+    ]
+
+    obs, info = env.reset()
+    assert obs.shape == (5, 64, 64, 3)
+    assert env.observation_space.shape == (5, 64, 64, 3)
+    expected = np.concatenate([shard.reset()[0] for shard in shards])
+    assert np.array_equal(obs, expected)
+
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        actions = rng.randint(low=0, high=15, size=(5,), dtype=np.int32)
+        obs, rew, terminated, truncated, info = env.step(actions)
+        results = [shards[0].step(actions[:3]), shards[1].step(actions[3:])]
+        for i, value in enumerate((obs, rew, terminated, truncated)):
+            assert np.array_equal(value, np.concatenate([r[i] for r in results]))
+        for key in info:
+            assert np.array_equal(info[key], np.concatenate([r[4][key] for r in results]))
+
+    env.close()
+    for shard in shards:
+        shard.close()
+
+
+def test_sharded_zero_copy_views():
+    env = ProcgenShardedVecEnv(num_envs=4, num_workers=2, env_name="coinrun", rand_seed=0, copy=False)
+    env.reset()
+
+    obs1, rew1, _, _, _ = env.step(np.zeros(4, dtype=np.int32))
+    assert not obs1.flags.writeable
+    saved = obs1.copy()
+    obs2, _, _, _, _ = env.step(np.full(4, 7, dtype=np.int32))
+    assert not np.shares_memory(obs1, obs2)
+    assert np.array_equal(obs1, saved)
+
+    # a reset doesn't overwrite the views of the last step either
+    saved = obs2.copy()
+    obs3, _ = env.reset()
+    assert not np.shares_memory(obs2, obs3)
+    assert np.array_equal(obs2, saved)
+    assert np.array_equal(obs3, saved)
+    env.close()
+
+
+def test_sharded_async_and_kwargs():
+    env = ProcgenShardedVecEnv(
+        num_envs=3, num_workers=3, env_name="bigfish", obs_format="gray_chw", frame_stack=2
+    )
+    obs, _ = env.reset()
+    assert obs.shape == (3, 2, 64, 64)
+
+    with pytest.raises(NoAsyncCallError):
+        env.step_wait()
+    env.step_async(np.zeros(3, dtype=np.int32))
+    with pytest.raises(AlreadyPendingCallError):
+        env.step_async(np.zeros(3, dtype=np.int32))
+    obs, rew, terminated, truncated, info = env.step_wait()
+    assert obs.shape == (3, 2, 64, 64)
+    assert rew.shape == terminated.shape == truncated.shape == (3,)
+
+    env.close()
+    env.close()
+
+
+def test_sharded_worker_error():
+    with pytest.raises(RuntimeError, match="procgen worker failed"):
+        ProcgenShardedVecEnv(num_envs=2, num_workers=2, env_name="maze", obs_format="bogus")
+
+
+def test_sharded_worker_error_keeps_pipes_in_sync():
+    env = ProcgenShardedVecEnv(num_envs=3, num_workers=3, env_name="maze", rand_seed=0)
+    env.reset()
+    # an invalid buffer set index makes worker 1 fail while the others step normally
+    for i, conn in enumerate(env._conns):
+        conn.send_bytes(_CMD_STEP + bytes([9 if i == 1 else 0]))
+    with pytest.raises(RuntimeError, match="worker 1"):
+        env._wait_all()
+    # the replies of the other workers were read, nothing is left for the next command
+    assert not env._conns[0].poll(0.1)
+    assert not env._conns[2].poll(0.1)
+    env.close()
+
+
+@pytest.mark.parametrize("num_workers", [1, 2, 4])
+def test_sharded_speed(num_workers, benchmark):
+    env = ProcgenShardedVecEnv(num_envs=64, num_workers=num_workers, env_name="bigfish", copy=False)
+    env.reset()
+
+    actions = np.zeros(64, dtype=np.int32)
+
+    def rollout(max_steps):
+        for _ in range(max_steps):
+            env.step(actions)
+
+    benchmark(lambda: rollout(100))
+    env.close()